@@ -0,0 +1,199 @@
+"""
+Compare the legacy generation of the CI test files with the bulk builder and its cache.
+
+A regression suite of the given sizes is generated in an in-memory SQLite database, spread over categories, with two
+output files per regression test and a baseline test that differed on a tenth of the outputs. The legacy generation
+(a query per regression test and per output file) is checked to write the same entries as the bulk builder.
+
+Run from the root of the repository with ``python -m benchmarks.ci_files``.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from typing import Any, Callable, List
+
+from lxml import etree
+from sqlalchemy import and_
+
+import mod_auth.models  # noqa: F401
+import mod_customized.models  # noqa: F401
+import mod_upload.models  # noqa: F401
+from database import create_session
+from mod_ci.ci_files import TestFileCache, write_test_files
+from mod_home.models import GeneralData
+from mod_regression.models import (Category, InputType, OutputType,
+                                   RegressionTest, RegressionTestOutput)
+from mod_sample.models import Sample
+from mod_test.models import (Fork, Test, TestPlatform, TestQueueState,
+                             TestResultFile, TestType)
+
+SIZES = [1000, 3000]
+CATEGORIES = 20
+
+
+def create_suite(db, size: int) -> Test:
+    """
+    Fill the database with a regression suite and the baseline test of the linux platform.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param size: number of regression tests
+    :type size: int
+    :return: a test to generate the files of
+    :rtype: Test
+    """
+    categories = [Category('category_{number}'.format(number=number), '') for number in range(CATEGORIES)]
+    db.add_all(categories)
+    db.add_all([Sample('{number:064x}'.format(number=number), 'ts', 'sample.ts') for number in range(size)])
+    db.commit()
+    for number in range(size):
+        regression_test = RegressionTest(number + 1, '-autoprogram -out=srt', InputType.file, OutputType.file,
+                                         None, 0)
+        categories[number % CATEGORIES].regression_tests.append(regression_test)
+        db.add(regression_test)
+    db.commit()
+    db.add_all([RegressionTestOutput(regression_id, 'correct_{id}_{output}'.format(id=regression_id, output=output),
+                                     '.srt', '_{output}'.format(output=output))
+                for regression_id in range(1, size + 1) for output in range(2)])
+    db.add(Fork('https://github.com/owner/repo.git'))
+    db.add(GeneralData('fetch_commit_linux', 'baseline'))
+    db.commit()
+    baseline = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'baseline')
+    baseline.queue_state = TestQueueState.finished
+    test = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'change')
+    db.add_all([baseline, test])
+    db.commit()
+    db.add_all([TestResultFile(baseline.id, output.regression_id, output.id, output.correct,
+                               'got_{id}'.format(id=output.id))
+                for output in RegressionTestOutput.query.all() if output.id % 10 == 0])
+    db.commit()
+    return test
+
+
+def legacy_write_files(db, test, regression_ids: List[int], base_folder: str) -> None:
+    """Generate the test files with a query per regression test and output file, as done before the bulk builder."""
+    platform = test.platform
+    categories = Category.query.order_by(Category.id.desc()).all()
+    commit_name = 'fetch_commit_' + platform.value
+    commit_hash = GeneralData.query.filter(GeneralData.key == commit_name).first().value
+    last_commit = Test.query.filter(and_(Test.commit == commit_hash, Test.platform == platform)).first()
+    multi_test = etree.Element('multitest')
+    for category in categories:
+        if len(category.regression_tests) == 0:
+            continue
+        file_name = '{name}.xml'.format(name=category.name)
+        single_test = etree.Element('tests')
+        check_write = False
+        for regression_test in category.regression_tests:
+            if regression_test.id not in regression_ids:
+                continue
+            check_write = True
+            entry = etree.SubElement(single_test, 'entry', id=str(regression_test.id))
+            command = etree.SubElement(entry, 'command')
+            command.text = regression_test.command
+            input_node = etree.SubElement(entry, 'input', type=regression_test.input_type.value)
+            input_node.text = regression_test.sample.filename
+            output_node = etree.SubElement(entry, 'output')
+            output_node.text = regression_test.output_type.value
+            compare = etree.SubElement(entry, 'compare')
+            last_files = TestResultFile.query.filter(and_(
+                TestResultFile.test_id == last_commit.id,
+                TestResultFile.regression_test_id == regression_test.id
+            )).subquery()
+            for output_file in regression_test.output_files:
+                ignore_file = str(output_file.ignore).lower()
+                file_node = etree.SubElement(compare, 'file', ignore=ignore_file, id=str(output_file.id))
+                last_commit_files = db.query(last_files.c.got).filter(and_(
+                    last_files.c.regression_test_output_id == output_file.id,
+                    last_files.c.got.isnot(None)
+                )).first()
+                correct = etree.SubElement(file_node, 'correct')
+                if last_commit_files is None:
+                    correct.text = output_file.filename_correct
+                else:
+                    correct.text = output_file.create_correct_filename(last_commit_files[0])
+                expected = etree.SubElement(file_node, 'expected')
+                expected.text = output_file.filename_expected(regression_test.sample.sha)
+        if check_write:
+            single_test.getroottree().write(
+                os.path.join(base_folder, file_name), encoding='utf-8', xml_declaration=True, pretty_print=True
+            )
+            test_file = etree.SubElement(multi_test, 'testfile')
+            location = etree.SubElement(test_file, 'location')
+            location.text = file_name
+    multi_test.getroottree().write(
+        os.path.join(base_folder, 'TestAll.xml'), encoding='utf-8', xml_declaration=True, pretty_print=True
+    )
+
+
+def measure(func: Callable[[], Any], repeat: int) -> float:
+    """
+    Measure the best time of a function, in milliseconds.
+
+    :param func: function to measure
+    :type func: Callable
+    :param repeat: number of timed runs
+    :type repeat: int
+    :return: the best time in milliseconds
+    :rtype: float
+    """
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def entries(path: str) -> List[bytes]:
+    """Get the entries of a test file, sorted as the legacy generation doesn't order them within a category."""
+    return sorted(etree.tostring(entry, with_tail=False) for entry in etree.parse(path).getroot())
+
+
+def same_files(first: str, second: str) -> bool:
+    """Check whether two folders hold the same files, with the same entries in every test file."""
+    names = sorted(os.listdir(first))
+    if names != sorted(os.listdir(second)):
+        return False
+    return all(entries(os.path.join(first, name)) == entries(os.path.join(second, name)) for name in names)
+
+
+def main() -> int:
+    """Print a comparison table of the legacy generation, the bulk builder and the cache."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of regression tests')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    args = parser.parse_args()
+
+    print('{size:>8} {legacy:>12} {bulk:>12} {cached:>12}'.format(
+        size='tests', legacy='legacy (ms)', bulk='bulk (ms)', cached='cached (ms)'))
+    for size in args.sizes:
+        db = create_session('sqlite://', drop_tables=True)
+        test = create_suite(db, size)
+        regression_ids = test.get_customized_regressiontests()
+        folder = tempfile.mkdtemp()
+        try:
+            legacy_folder, bulk_folder, cached_folder = (os.path.join(folder, name)
+                                                         for name in ['legacy', 'bulk', 'cached'])
+            for path in [legacy_folder, bulk_folder, cached_folder]:
+                os.mkdir(path)
+            cache = TestFileCache(os.path.join(folder, 'cache'))
+
+            legacy = measure(lambda: legacy_write_files(db, test, regression_ids, legacy_folder), args.repeat)
+            bulk = measure(lambda: write_test_files(db, test, regression_ids, bulk_folder), args.repeat)
+            write_test_files(db, test, regression_ids, cached_folder, cache=cache)
+            cached = measure(lambda: write_test_files(db, test, regression_ids, cached_folder, cache=cache),
+                             args.repeat)
+
+            if not same_files(legacy_folder, bulk_folder) or not same_files(bulk_folder, cached_folder):
+                print('the generated files differ for {size} regression tests'.format(size=size))
+                return 1
+            print('{size:>8} {legacy:12.2f} {bulk:12.2f} {cached:12.2f}'.format(
+                size=size, legacy=legacy, bulk=bulk, cached=cached))
+        finally:
+            shutil.rmtree(folder)
+            db.remove()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
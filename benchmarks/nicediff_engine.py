@@ -0,0 +1,126 @@
+"""
+Compare the legacy nicediff equality search with the Myers based engine.
+
+Run from the root of the repository with ``python -m benchmarks.nicediff_engine``.
+"""
+
+import os
+import random
+import sys
+import timeit
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mod_test.nicediff.diff import compress, same_regions
+
+STATIC_MOCK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests',
+                               'static_mock_files')
+# The legacy search is (at least) cubic in the line length; don't even try it beyond this number of tokens.
+LEGACY_TOKEN_LIMIT = 400
+
+_legacy_index = dict()  # type: Dict[str, Dict[str, list]]
+
+
+def legacy_eq(a: List[str], b: List[str], same_regions: Optional[List[List[int]]] = None,
+              delta_a: int = 0, delta_b: int = 0) -> list:
+    """Longest-common-substring-first search used by nicediff before the Myers engine, kept for reference."""
+    key_a, key_b = ''.join(a), ''.join(b)
+    if _legacy_index.get(key_a, dict()).get(key_b, None) is None:
+        e = 0
+        rez = []  # type: list
+        best_len, a_iter, b_iter = -1, -1, -1
+        find = False
+        for length in range(min(len(a), len(b)), 0, -1):
+            if find:
+                break
+            for i in range(len(a) - length + 1):
+                if find:
+                    break
+                for j in range(len(b) - length + 1):
+                    if a[i:i + length] != b[j:j + length]:
+                        continue
+                    find = True
+                    _e1 = legacy_eq(a[0:i], b[0:j])[0]
+                    _e2 = legacy_eq(a[i + length:], b[j + length:])[0]
+                    if _e1 + _e2 + length > e:
+                        e = _e1 + _e2 + length
+                        best_len, a_iter, b_iter = length, i, j
+                        rez = legacy_eq(a[0:i], b[0:j])[1] + a[i:i + length] + legacy_eq(
+                            a[i + length:], b[j + length:])[1]
+        _legacy_index.setdefault(key_a, dict())[key_b] = [e, rez, a_iter, b_iter, best_len]
+
+    if same_regions is not None and _legacy_index[key_a][key_b][0] > 1:
+        a_iter, b_iter, best_len = _legacy_index[key_a][key_b][2:]
+        same_regions.append([
+            a_iter + delta_a, a_iter + best_len + delta_a, b_iter + delta_b, b_iter + best_len + delta_b
+        ])
+        legacy_eq(a[0:a_iter], b[0:b_iter], same_regions, delta_a, delta_b)
+        legacy_eq(a[a_iter + best_len:], b[b_iter + best_len:], same_regions,
+                  delta_a + a_iter + best_len, delta_b + b_iter + best_len)
+
+    return _legacy_index[key_a][key_b]
+
+
+def legacy_regions(a: List[str], b: List[str]) -> List[List[int]]:
+    """Compute the same regions of two token lists with the legacy search."""
+    _legacy_index.clear()
+    regions = []  # type: List[List[int]]
+    legacy_eq(a, b, same_regions=regions)
+    return regions
+
+
+def synthetic_line(tokens: int, edits: int, seed: int = 0) -> Tuple[str, str]:
+    """
+    Build a pair of lines of roughly the given amount of tokens, differing by a number of word substitutions.
+
+    :param tokens: approximate number of tokens of the lines
+    :type tokens: int
+    :param edits: number of words to replace in the second line
+    :type edits: int
+    :param seed: random seed
+    :type seed: int
+    :return: the original and the edited line
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    vocabulary = ['the', 'fourth', 'be', 'with', 'you', '00:00:12,340', '-->', 'May']
+    words = [rng.choice(vocabulary) for _ in range(tokens // 2)]
+    edited = list(words)
+    for _ in range(edits):
+        edited[rng.randrange(len(edited))] = 'twenty'
+    return ' '.join(words), ' '.join(edited)
+
+
+def mock_file_pairs() -> List[Tuple[str, str]]:
+    """Pair up the lines of the static mock files used by the diff tests."""
+    with open(os.path.join(STATIC_MOCK_DIR, 'expected.txt')) as expected, \
+            open(os.path.join(STATIC_MOCK_DIR, 'obtained.txt')) as obtained:
+        return list(zip(expected.readlines(), obtained.readlines()))
+
+
+def measure(func: Callable, pairs: List[Tuple[List[str], List[str]]], repeat: int = 3) -> float:
+    """Return the best of `repeat` runs of func over all pairs, in milliseconds."""
+    return min(timeit.repeat(lambda: [func(a, b) for a, b in pairs], number=1, repeat=repeat)) * 1000
+
+
+def main() -> int:
+    """Print a comparison table of both engines."""
+    cases = [('static mock files', mock_file_pairs())]
+    for tokens, edits in [(40, 2), (200, 5), (1000, 10), (10000, 10), (10000, 200)]:
+        cases.append(('synthetic {tokens} tokens, {edits} edits'.format(tokens=tokens, edits=edits),
+                      [synthetic_line(tokens, edits)]))
+    cases.append(('synthetic 10000 tokens, unrelated', [(synthetic_line(10000, 0)[0], synthetic_line(10000, 0, 1)[0])]))
+
+    print('{case:<40} {legacy:>12} {myers:>12}'.format(case='case', legacy='legacy (ms)', myers='myers (ms)'))
+    for name, lines in cases:
+        pairs = [(compress(a), compress(b)) for a, b in lines]
+        myers_time = measure(same_regions, pairs)
+        if max(max(len(a), len(b)) for a, b in pairs) <= LEGACY_TOKEN_LIMIT:
+            legacy = '{time:12.2f}'.format(time=measure(legacy_regions, pairs))
+        else:
+            legacy = '{text:>12}'.format(text='skipped')
+        print('{case:<40} {legacy} {myers:12.2f}'.format(case=name, legacy=legacy, myers=myers_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+Benchmark suite of the diff engine, with a stored baseline to track regressions.
+
+Every case of a corpus of generated caption files (identical, shifted by an inserted cue, drifting timestamps and fully
+different, in increasing sizes) is diffed line by line, cue by cue and page by page, reporting the best time and the
+peak memory allocated. The line level helpers (``same_regions`` and ``_process``) are measured on their own too.
+
+Run from the root of the repository with ``python -m benchmarks.nicediff_suite``, which compares the results with the
+stored baseline and exits with a non-zero status when a measurement regressed by more than the threshold. After an
+intended change, store the new baseline with ``--save``. Timings depend on the machine, so only compare a baseline
+with runs on the machine it was made on. Tracing the memory slows the engine down a lot, which is why the corpus
+stays rather small; the whole suite takes a few minutes.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from mod_test.nicediff.cache import region_cache
+from mod_test.nicediff.diff import (_process, compress, generate_file_diff,
+                                    same_regions)
+from mod_test.nicediff.pages import generate_file_diff_page
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline', 'nicediff.json')
+
+SIZES = [100, 300, 1000]
+KINDS = ['identical', 'shifted', 'drift', 'different']
+
+# a measurement regressed when it got this much slower or bigger than the baseline
+DEFAULT_THRESHOLD = 1.5
+# measurements below these are too small to compare reliably
+MIN_TIME_MS = 1.0
+MIN_PEAK_KIB = 64.0
+
+WORDS = ['May', 'the', 'fourth', 'be', 'with', 'you', 'always', 'captions', 'are', 'fun', 'to', 'diff', 'and', 'so',
+         'on', 'Extractor', 'closed', 'caption', 'line', 'twenty']
+
+
+def _timestamp(milliseconds: int) -> str:
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return '{h:02}:{m:02}:{s:02},{ms:03}'.format(h=hours, m=minutes, s=seconds, ms=milliseconds)
+
+
+def _cue_texts(count: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) for _ in range(count)]
+
+
+def _srt(texts: List[str], drift: int = 0) -> str:
+    cues = []
+    for idx, text in enumerate(texts):
+        start = idx * 2500 + drift * (idx % 7)
+        cues.append('{number}\n{start} --> {end}\n{text}\n'.format(
+            number=idx + 1, start=_timestamp(start), end=_timestamp(start + 2000), text=text))
+    return '\n'.join(cues)
+
+
+def corpus_case(kind: str, size: int) -> Tuple[str, str]:
+    """
+    Generate the expected and obtained captions of a case of the corpus.
+
+    :param kind: identical, shifted (a cue inserted at the start), drift (timestamps off by up to 60 ms) or different
+    :type kind: str
+    :param size: number of cues
+    :type size: int
+    :return: the expected and obtained SRT content
+    :rtype: tuple
+    """
+    texts = _cue_texts(size, seed=size)
+    expected = _srt(texts)
+    if kind == 'identical':
+        return expected, expected
+    if kind == 'shifted':
+        return expected, _srt(['an inserted cue'] + texts)
+    if kind == 'drift':
+        return expected, _srt(texts, drift=10)
+    return expected, _srt(_cue_texts(size, seed=size + 1))
+
+
+def measure(func: Callable[[], Any], repeat: int = 3) -> Dict[str, float]:
+    """
+    Measure the best time and the peak memory of a function, starting from an empty region cache every run.
+
+    A function taking a second or more is only timed once, as the noise is small compared to its running time then.
+
+    :param func: function to measure
+    :type func: Callable
+    :param repeat: number of timed runs
+    :type repeat: int
+    :return: the best time in milliseconds and the peak memory in KiB
+    :rtype: dict
+    """
+    def run() -> None:
+        region_cache.clear()
+        func()
+
+    best = timeit.timeit(run, number=1)
+    if best < 1:
+        best = min([best] + timeit.repeat(run, number=1, repeat=repeat - 1))
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'time_ms': round(best * 1000, 3), 'peak_kib': round(peak / 1024, 1)}
+
+
+def run_suite(sizes: List[int]) -> Dict[str, Dict[str, float]]:
+    """
+    Run every benchmark of the suite.
+
+    :param sizes: the numbers of cues of the corpus cases
+    :type sizes: List[int]
+    :return: the measurements, by benchmark name
+    :rtype: dict
+    """
+    results = {}
+    folder = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            for kind in KINDS:
+                expected, obtained = corpus_case(kind, size)
+                correct_path = os.path.join(folder, '{kind}_{size}_expected.srt'.format(kind=kind, size=size))
+                result_path = os.path.join(folder, '{kind}_{size}_obtained.srt'.format(kind=kind, size=size))
+                with open(correct_path, 'w') as f:
+                    f.write(expected)
+                with open(result_path, 'w') as f:
+                    f.write(obtained)
+                name = '{kind}/{size}'.format(kind=kind, size=size)
+
+                def full(tolerance: Any = None) -> None:
+                    for _ in generate_file_diff(correct_path, result_path, False, tolerance):
+                        pass
+
+                def page() -> None:
+                    _, chunks = generate_file_diff_page(correct_path, result_path, size // 2, 50)
+                    for _ in chunks:
+                        pass
+
+                results['lines/' + name] = measure(full)
+                results['cues/' + name] = measure(lambda: full(100))
+                results['page/' + name] = measure(page)
+
+        for tokens in [50, 500, 2000]:
+            line, edited = (' '.join(texts) for texts in (_cue_texts(tokens // 16, 1), _cue_texts(tokens // 16, 2)))
+            drifted = ' '.join(_cue_texts(tokens // 16, 1)[:-1] + ['twenty'])
+            results['same_regions/{tokens}'.format(tokens=tokens)] = measure(
+                lambda: same_regions(compress(line), compress(drifted)))
+            results['process/{tokens}'.format(tokens=tokens)] = measure(lambda: _process(line, edited, '0'))
+    finally:
+        shutil.rmtree(folder)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """
+    Print the results next to the baseline.
+
+    :param results: the measurements of this run
+    :type results: dict
+    :param baseline: the stored measurements
+    :type baseline: dict
+    :param threshold: ratio to the baseline above which a measurement regressed
+    :type threshold: float
+    :return: the names of the regressed measurements
+    :rtype: List[str]
+    """
+    regressions = []
+    print('{name:<28} {time:>12} {base_time:>12} {peak:>12} {base_peak:>12}'.format(
+        name='benchmark', time='time (ms)', base_time='baseline', peak='peak (KiB)', base_peak='baseline'))
+    for name, result in results.items():
+        base = baseline.get(name, {})
+        flags = []
+        if base.get('time_ms', 0) >= MIN_TIME_MS and result['time_ms'] > base['time_ms'] * threshold:
+            flags.append('time')
+        if base.get('peak_kib', 0) >= MIN_PEAK_KIB and result['peak_kib'] > base['peak_kib'] * threshold:
+            flags.append('memory')
+        if flags:
+            regressions.append(name)
+        print('{name:<28} {time:12.2f} {base_time:>12} {peak:12.1f} {base_peak:>12} {flags}'.format(
+            name=name, time=result['time_ms'], base_time=base.get('time_ms', '-'), peak=result['peak_kib'],
+            base_peak=base.get('peak_kib', '-'), flags=' '.join('SLOWER' if f == 'time' else 'BIGGER' for f in flags)
+        ))
+    return regressions
+
+
+def main() -> int:
+    """Run the suite, then store it as the baseline or compare it with the stored one."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE, help='path of the baseline file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='ratio to the baseline above which a measurement regressed')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of cues of the corpus cases')
+    args = parser.parse_args()
+
+    results = run_suite(args.sizes)
+    baseline = {}  # type: Dict[str, Dict[str, float]]
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline stored in {path}'.format(path=args.baseline))
+        return 0
+    if regressions:
+        print('regressed: {names}'.format(names=', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Compare the memory and time nicediff needs with tokens as strings and as interned integer ids.
+
+Run from the root of the repository with ``python -m benchmarks.nicediff_tokens``.
+"""
+
+import sys
+import timeit
+import tracemalloc
+from typing import Any, Callable, List, Tuple
+
+from benchmarks.nicediff_engine import synthetic_line
+from mod_test.nicediff.diff import compress, intern_tokens
+from mod_test.nicediff.myers import matching_blocks
+
+
+def allocated(func: Callable[[], Any]) -> Tuple[int, int]:
+    """
+    Measure the memory allocated by a function.
+
+    :param func: function to measure
+    :type func: Callable
+    :return: the bytes still held by the result, and the peak number of bytes allocated while running
+    :rtype: tuple
+    """
+    tracemalloc.start()
+    result = func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return retained, peak
+
+
+def best_time(func: Callable[[], Any], repeat: int = 3) -> float:
+    """Return the best of `repeat` runs of func, in milliseconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def as_strings(a: str, b: str) -> Tuple[List[str], List[str]]:
+    """Token representation used before interning: lists of strings."""
+    return compress(a), compress(b)
+
+
+def as_ids(a: str, b: str) -> Any:
+    """Token representation used by the engine: arrays of interned ids."""
+    return intern_tokens(compress(a), compress(b))
+
+
+def main() -> int:
+    """Print a comparison table of both token representations."""
+    print('{case:<32} {repr:<8} {held:>12} {peak:>12} {time:>12}'.format(
+        case='case', repr='tokens', held='held (KiB)', peak='peak (KiB)', time='diff (ms)'))
+    for tokens, edits in [(200, 5), (10000, 10), (10000, 200), (100000, 100)]:
+        a, b = synthetic_line(tokens, edits)
+        name = '{tokens} tokens, {edits} edits'.format(tokens=tokens, edits=edits)
+        for label, build in [('str', as_strings), ('id', as_ids)]:
+            # Only keep what survives the conversion, the original lines aren't part of the representation
+            held, _ = allocated(lambda: build(a, b))
+            first, second = build(a, b)
+            _, peak = allocated(lambda: matching_blocks(first, second))
+            time = best_time(lambda: matching_blocks(first, second))
+            print('{case:<32} {repr:<8} {held:12.1f} {peak:12.1f} {time:12.2f}'.format(
+                case=name, repr=label, held=held / 1024, peak=peak / 1024, time=time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
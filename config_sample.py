@@ -18,10 +18,24 @@ GITHUB_CI_KEY = ''
 GITHUB_CLIENT_ID = ''
 GITHUB_CLIENT_SECRET = ''
 INSTALL_FOLDER = '/path/to/installation'
-KVM_LINUX_NAME = ''
-KVM_WINDOWS_NAME = ''
+KVM_LINUX_NAME = ''  # Name of the VM, or a list of names for a pool of VMs
+KVM_WINDOWS_NAME = ''  # Name of the VM, or a list of names for a pool of VMs
 KVM_MAX_RUNTIME = 120  # In minutes
+SCHEDULER_SOCKET = ''  # Path of the socket of `manage.py scheduler`, empty to start a process per test instead
+SCHEDULER_POLL_INTERVAL = 60  # In seconds
+TEST_SHARDS = 1  # Number of VMs of a platform the regression tests of one test are split over
+PREEMPT_SUPERSEDED_TESTS = False  # Also stop running tests of a PR when a newer commit is pushed
+GITHUB_PUBLISHER = False  # True when `python manage.py publisher` delivers the statuses and comments for GitHub
+GITHUB_PUBLISH_INTERVAL = 2  # Seconds between two deliveries of the publisher
+PREMERGE_PULL_REQUESTS = False  # Merge PRs on master once queued, canceling conflicting ones first (needs git 2.38+)
+IMPACT_SELECTION = 0  # Number of regression tests most likely impacted by a PR to run and report first, 0 for none
 SAMPLE_REPOSITORY = '/path/to/samples'
+RESULT_STORE = 'filesystem'  # Where result files are kept, see mod_test.result_store.STORES
+RESULT_COMPRESSION = 'gzip'  # 'zstd' (needs the zstandard package), 'gzip' or 'none'
+DIFF_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # In bytes
+DIFF_PRECOMPUTE_WORKERS = 0  # Processes rendering diffs of uploaded results, 0 to disable
+DIFF_PRECOMPUTE_QUEUE_SIZE = 64
+DIFF_CAPTION_TOLERANCE = 0  # In milliseconds, None to diff caption files line by line
 SESSION_COOKIE_PATH = '/'
 FTP_PORT = 21
 MAX_CONTENT_LENGTH = 512 * 1024 * 1024
@@ -143,6 +143,7 @@ echo "Setting up the directories.."
     mkdir -p "${sample_repository}/TempFiles"
     mkdir -p "${sample_repository}/LogFiles"
     mkdir -p "${sample_repository}/TestResults"
+    mkdir -p "${sample_repository}/DiffCache"
     mkdir -p "${sample_repository}/TestFiles"
     mkdir -p "${sample_repository}/TestFiles/media"
     mkdir -p "${sample_repository}/QueuedFiles"
@@ -222,6 +223,7 @@ echo "* Creating Nginx config"
     sed -i "s#SAMPLE_DIR#${sample_repository}/TestFiles/media#g" /etc/nginx/sites-available/platform
     sed -i "s#LOGFILE_DIR#${sample_repository}/LogFiles#g" /etc/nginx/sites-available/platform
     sed -i "s#RESULT_DIR#${sample_repository}/TestResults#g" /etc/nginx/sites-available/platform
+    sed -i "s#DIFFCACHE_DIR#${sample_repository}/DiffCache#g" /etc/nginx/sites-available/platform
     sed -i "s#NGINX_CERT#${config_ssl_cert}#g" /etc/nginx/sites-available/platform 
     sed -i "s#NGINX_KEY#${config_ssl_key}#g" /etc/nginx/sites-available/platform 
     sed -i "s#NGINX_DIR#${root_dir}#g" /etc/nginx/sites-available/platform 
@@ -4,11 +4,11 @@ import os
 import unittest
 from exceptions import CCExtractorEndedWithNonZero, MissingPathToCCExtractor
 
-from flask_script import Command, Manager
+from flask_script import Command, Manager, Option
 
 from mod_regression.controllers import mod_regression
 from mod_regression.update_regression import update_expected_results
-from run import app
+from run import app, config
 
 manager = Manager(app)
 
@@ -41,5 +41,115 @@ class UpdateResults(Command):
         return 0
 
 
+@manager.add_command
+class BackfillDiffs(Command):
+    """
+    Render the missing diffs of all mismatching results of a test into the diff cache.
+
+    Example, `python manage.py diffs 42`
+    """
+
+    name = 'diffs'
+    option_list = (
+        Option('test_id', type=int, help='id of the test'),
+    )
+
+    def run(self, test_id):
+        """Driver function for diffs subcommand."""
+        from database import create_session
+        from mod_test.diff_worker import backfill_diffs
+
+        db = create_session(config['DATABASE_URI'])
+        rendered = backfill_diffs(db, config, test_id)
+        db.remove()
+        print('rendered {count} diffs for test {id}'.format(count=rendered, id=test_id))
+        return 0
+
+
+@manager.add_command
+class CollectResults(Command):
+    """
+    Remove the result files no test result nor regression test refers to anymore.
+
+    Example, `python manage.py gc`, or `python manage.py gc --dry-run` to only count them.
+    """
+
+    name = 'gc'
+    option_list = (
+        Option('--min-age', type=float, default=24, help='hours a result file is kept after it was stored'),
+        Option('--dry-run', action='store_true', help='only count the result files that would be removed'),
+    )
+
+    def run(self, min_age, dry_run):
+        """Driver function for gc subcommand."""
+        from database import create_session
+        from mod_test.result_gc import collect_garbage
+        from mod_test.result_store import result_store_from_config
+
+        db = create_session(config['DATABASE_URI'])
+        removed, freed = collect_garbage(db, result_store_from_config(config), min_age * 60 * 60, dry_run)
+        db.remove()
+        print('{action} {count} result files, {size} bytes'.format(
+            action='would remove' if dry_run else 'removed', count=removed, size=freed))
+        return 0
+
+
+@manager.add_command
+class RunScheduler(Command):
+    """
+    Run the scheduler starting the tests of every platform, until interrupted.
+
+    Set SCHEDULER_SOCKET in the configuration first. Example, `python manage.py scheduler`, or
+    `python manage.py scheduler --metrics` to print the metrics of the running scheduler.
+    """
+
+    name = 'scheduler'
+    option_list = (
+        Option('--metrics', action='store_true', help='print the metrics of the running scheduler'),
+    )
+
+    def run(self, metrics):
+        """Driver function for scheduler subcommand."""
+        from mod_ci.scheduler import run_scheduler, scheduler_metrics
+
+        if config.get('SCHEDULER_SOCKET', '') == '':
+            print('SCHEDULER_SOCKET is not configured')
+            return 1
+        running = scheduler_metrics(config)
+        if metrics:
+            if running is None:
+                print('the scheduler is not running')
+                return 1
+            for kvm_name, values in running.items():
+                print('{name}: {values}'.format(
+                    name=kvm_name, values=', '.join('{0}={1}'.format(*item) for item in values.items())))
+            return 0
+        if running is not None:
+            print('the scheduler is already running')
+            return 1
+        run_scheduler(app, config)
+        return 0
+
+
+@manager.add_command
+class RunPublisher(Command):
+    """
+    Deliver the queued commit statuses and pull request comments to GitHub, until interrupted.
+
+    Set GITHUB_PUBLISHER in the configuration, so requests leave the delivery to it.
+    Example, `python manage.py publisher`.
+    """
+
+    name = 'publisher'
+
+    def run(self):
+        """Driver function for publisher subcommand."""
+        from mod_ci.publisher import run_publisher
+        from run import log
+
+        run_publisher(config, log)
+        return 0
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,22 @@
+"""Allow a test to be held by one KVM only
+
+Revision ID: a4e2d8c1f0b7
+Revises: 6b1274f61edd
+Create Date: 2026-10-18 09:12:41.504122
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a4e2d8c1f0b7'
+down_revision = '6b1274f61edd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_unique_constraint('test_id', 'kvm', ['test_id'])
+
+
+def downgrade():
+    op.drop_constraint('test_id', 'kvm', type_='unique')
@@ -0,0 +1,58 @@
+"""Keep the statistics of the durations of the tests of every platform in their own table
+
+Revision ID: a7d3e9b4c182
+Revises: f2c8a5d7b316
+Create Date: 2026-10-18 21:14:52.730614
+
+"""
+import json
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9b4c182'
+down_revision = 'f2c8a5d7b316'
+branch_labels = None
+depends_on = None
+
+# keys of the averages and counts general_data held, by phase
+AVERAGE_KEYS = {
+    'prep': ('avg_prep_time_{platform}', 'avg_prep_count_{platform}'),
+    'build': ('avg_build_time_{platform}', 'avg_build_count_{platform}'),
+    'test': ('average_time_{platform}', None),
+}
+
+
+def upgrade():
+    platform_stats = op.create_table('platform_stats',
+                                     sa.Column('id', sa.Integer(), nullable=False),
+                                     sa.Column('platform', sa.Enum('linux', 'windows'), nullable=False),
+                                     sa.Column('phase', sa.String(length=16), nullable=False),
+                                     sa.Column('count', sa.Integer(), nullable=False),
+                                     sa.Column('mean', sa.Float(), nullable=False),
+                                     sa.Column('m2', sa.Float(), nullable=False),
+                                     sa.Column('window', sa.Text(), nullable=False),
+                                     sa.Column('median', sa.Float(), nullable=False),
+                                     sa.Column('p90', sa.Float(), nullable=False),
+                                     sa.PrimaryKeyConstraint('id'),
+                                     sa.UniqueConstraint('platform', 'phase', name='platform_stats_phase'),
+                                     mysql_engine='InnoDB'
+                                     )
+    # Start from the averages kept so far, as if they were a single duration when their count is unknown
+    general_data = dict(op.get_bind().execute(sa.text('SELECT `key`, value FROM general_data')).fetchall())
+    rows = []
+    for platform in ['linux', 'windows']:
+        for phase, (average_key, count_key) in AVERAGE_KEYS.items():
+            average = general_data.get(average_key.format(platform=platform))
+            if average is None:
+                continue
+            count = 1 if count_key is None else int(general_data.get(count_key.format(platform=platform), 1))
+            rows.append({'platform': platform, 'phase': phase, 'count': count, 'mean': float(average), 'm2': 0.0,
+                         'window': json.dumps([float(average)]), 'median': float(average), 'p90': float(average)})
+    if len(rows) > 0:
+        op.bulk_insert(platform_stats, rows)
+
+
+def downgrade():
+    op.drop_table('platform_stats')
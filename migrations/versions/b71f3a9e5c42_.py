@@ -0,0 +1,37 @@
+"""Store the queue state and priority of tests, indexed
+
+Revision ID: b71f3a9e5c42
+Revises: a4e2d8c1f0b7
+Create Date: 2026-10-18 10:03:17.218350
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b71f3a9e5c42'
+down_revision = 'a4e2d8c1f0b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('test', sa.Column('queue_state', sa.Enum('queued', 'running', 'finished'), nullable=False,
+                                    server_default='queued'))
+    op.add_column('test', sa.Column('priority', sa.Integer(), nullable=False, server_default='0'))
+    # Backfill: finished tests have a final progress entry, running ones are held by a KVM
+    op.execute(
+        "UPDATE test SET queue_state = 'finished' WHERE id IN ("
+        "SELECT test_id FROM test_progress WHERE status IN ('completed', 'canceled'))"
+    )
+    op.execute(
+        "UPDATE test SET queue_state = 'running' WHERE queue_state = 'queued' AND id IN ("
+        "SELECT test_id FROM kvm WHERE test_id IS NOT NULL)"
+    )
+    op.create_index('ix_test_queue', 'test', ['platform', 'queue_state', sa.text('priority DESC'), 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_test_queue', table_name='test')
+    op.drop_column('test', 'priority')
+    op.drop_column('test', 'queue_state')
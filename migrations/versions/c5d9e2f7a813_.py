@@ -0,0 +1,28 @@
+"""Store the weights of the queue priority
+
+Revision ID: c5d9e2f7a813
+Revises: b71f3a9e5c42
+Create Date: 2026-10-18 11:24:51.903214
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'c5d9e2f7a813'
+down_revision = 'b71f3a9e5c42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('queue_weight',
+                    sa.Column('name', sa.String(length=64), nullable=False),
+                    sa.Column('weight', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('name'),
+                    mysql_engine='InnoDB'
+                    )
+
+
+def downgrade():
+    op.drop_table('queue_weight')
@@ -0,0 +1,42 @@
+"""Split the regression tests of a test in shards running on several KVMs
+
+Revision ID: d8a3f6b2c914
+Revises: c5d9e2f7a813
+Create Date: 2026-10-18 13:02:38.551046
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd8a3f6b2c914'
+down_revision = 'c5d9e2f7a813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('test_shard',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('test_id', sa.Integer(), nullable=False),
+                    sa.Column('number', sa.Integer(), nullable=False),
+                    sa.Column('regression_ids', sa.Text(), nullable=False),
+                    sa.Column('queue_state', sa.Enum('queued', 'running', 'finished'), nullable=False),
+                    sa.Column('status', sa.Enum('preparation', 'building', 'testing', 'completed', 'canceled'),
+                              nullable=True),
+                    sa.ForeignKeyConstraint(['test_id'], ['test.id'], onupdate='CASCADE', ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('test_id', 'number'),
+                    mysql_engine='InnoDB'
+                    )
+    op.add_column('kvm', sa.Column('shard', sa.Integer(), nullable=False, server_default='0'))
+    # The new constraint covers the foreign key of test_id before the old one is dropped
+    op.create_unique_constraint('kvm_test_shard', 'kvm', ['test_id', 'shard'])
+    op.drop_constraint('test_id', 'kvm', type_='unique')
+
+
+def downgrade():
+    op.create_unique_constraint('test_id', 'kvm', ['test_id'])
+    op.drop_constraint('kvm_test_shard', 'kvm', type_='unique')
+    op.drop_column('kvm', 'shard')
+    op.drop_table('test_shard')
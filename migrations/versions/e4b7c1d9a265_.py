@@ -0,0 +1,40 @@
+"""Store the files changed by a test and the regression tests it most likely impacts
+
+Revision ID: e4b7c1d9a265
+Revises: d8a3f6b2c914
+Create Date: 2026-10-18 15:41:12.203518
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c1d9a265'
+down_revision = 'd8a3f6b2c914'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('test_changed_file',
+                    sa.Column('test_id', sa.Integer(), nullable=False),
+                    sa.Column('path', sa.String(length=255), nullable=False),
+                    sa.ForeignKeyConstraint(['test_id'], ['test.id'], onupdate='CASCADE', ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('test_id', 'path'),
+                    mysql_engine='InnoDB'
+                    )
+    op.create_index(op.f('ix_test_changed_file_path'), 'test_changed_file', ['path'], unique=False)
+    op.create_table('test_selection',
+                    sa.Column('test_id', sa.Integer(), nullable=False),
+                    sa.Column('regression_ids', sa.Text(), nullable=False),
+                    sa.Column('reported', sa.Boolean(), nullable=False),
+                    sa.ForeignKeyConstraint(['test_id'], ['test.id'], onupdate='CASCADE', ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('test_id'),
+                    mysql_engine='InnoDB'
+                    )
+
+
+def downgrade():
+    op.drop_table('test_selection')
+    op.drop_index(op.f('ix_test_changed_file_path'), table_name='test_changed_file')
+    op.drop_table('test_changed_file')
@@ -0,0 +1,37 @@
+"""Queue the statuses and comments delivered to GitHub
+
+Revision ID: f2c8a5d7b316
+Revises: e4b7c1d9a265
+Create Date: 2026-10-18 19:02:37.518044
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f2c8a5d7b316'
+down_revision = 'e4b7c1d9a265'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('github_event',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('kind', sa.Enum('status', 'comment'), nullable=False),
+                    sa.Column('target', sa.String(length=64), nullable=False),
+                    sa.Column('context', sa.String(length=64), nullable=False),
+                    sa.Column('payload', sa.Text(), nullable=False),
+                    sa.Column('revision', sa.Integer(), nullable=False),
+                    sa.Column('attempts', sa.Integer(), nullable=False),
+                    sa.Column('next_attempt', sa.DateTime(), nullable=False),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('kind', 'target', 'context', name='github_event_key'),
+                    mysql_engine='InnoDB'
+                    )
+    op.create_index(op.f('ix_github_event_next_attempt'), 'github_event', ['next_attempt'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_github_event_next_attempt'), table_name='github_event')
+    op.drop_table('github_event')
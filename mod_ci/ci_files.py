@@ -0,0 +1,353 @@
+"""
+Build the XML files listing the regression tests a VM runs, one file per category and the collection file.
+
+The regression tests, their samples, output files and categories are loaded in a few bulk queries, together with the
+results of the baseline test the outputs are compared against. The files only depend on the regression suite, on the
+run of the baseline test and on the regression tests to run, so they're cached on disk by the revision of the suite
+(bumped whenever a regression test, a category or a sample changes), the run of the baseline test and the selected
+regression tests. A VM running the same regression tests as an earlier one gets copies of the cached files.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+from lxml import etree
+from sqlalchemy import func
+
+from mod_home.models import GeneralData
+from mod_regression.models import (Category, RegressionTest,
+                                   RegressionTestOutput,
+                                   regressionTestLinkTable)
+from mod_sample.models import Sample
+from mod_test.models import Test, TestProgress, TestQueueState, TestResultFile
+
+SUITE_REVISION = 'regression_suite_revision'
+IMPACTED_TESTS_FILE = 'ImpactedTests.xml'
+COLLECTION_FILE = 'TestAll.xml'
+
+# number of cached sets of files kept for the current revision of the suite
+DEFAULT_MAX_ENTRIES = 64
+
+
+def suite_revision(db) -> int:
+    """
+    Get the revision of the regression suite.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :return: the revision, 0 if the suite never changed
+    :rtype: int
+    """
+    revision = db.query(GeneralData.value).filter(GeneralData.key == SUITE_REVISION).first()
+    return 0 if revision is None else int(revision[0])
+
+
+def bump_suite_revision(db) -> None:
+    """
+    Bump the revision of the regression suite, along with a change to it that isn't committed yet.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    """
+    revision = db.query(GeneralData).filter(GeneralData.key == SUITE_REVISION).first()
+    if revision is None:
+        db.add(GeneralData(SUITE_REVISION, '1'))
+    else:
+        revision.value = str(int(revision.value) + 1)
+
+
+def find_baseline(db, platform: Any) -> Optional[Test]:
+    """
+    Get the test the results of a platform are compared against, the one of the last commit fetched.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param platform: the platform
+    :type platform: TestPlatform
+    :return: the baseline test, None if there's none
+    :rtype: Test
+    """
+    commit = db.query(GeneralData.value).filter(GeneralData.key == 'fetch_commit_' + platform.value).first()
+    if commit is None:
+        return None
+    return db.query(Test).filter(Test.commit == commit[0], Test.platform == platform).first()
+
+
+def baseline_run(db, baseline: Optional[Test]) -> Optional[str]:
+    """
+    Identify the run of a baseline test, which changes when the test is restarted.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param baseline: the baseline test
+    :type baseline: Test
+    :return: the id of the test and of its last progress, None if the test is still running
+    :rtype: str
+    """
+    if baseline is None:
+        return 'none'
+    if baseline.queue_state != TestQueueState.finished:
+        return None
+    last_progress = db.query(func.max(TestProgress.id)).filter(TestProgress.test_id == baseline.id).scalar()
+    return '{id}-{progress}'.format(id=baseline.id, progress=last_progress)
+
+
+def cache_key(revision: int, baseline: str, regression_ids: List[int], impacted: List[int]) -> str:
+    """
+    Get the key of the files of a selection of regression tests.
+
+    :param revision: the revision of the regression suite
+    :type revision: int
+    :param baseline: the run of the baseline test, see baseline_run
+    :type baseline: str
+    :param regression_ids: ids of the regression tests to run
+    :type regression_ids: list
+    :param impacted: ids of the regression tests to run first, in that order
+    :type impacted: list
+    :return: the key
+    :rtype: str
+    """
+    selection = '{baseline}:{ids}:{impacted}'.format(
+        baseline=baseline, ids=','.join(str(regression_id) for regression_id in sorted(set(regression_ids))),
+        impacted=','.join(str(regression_id) for regression_id in impacted)
+    )
+    return 'r{revision}/{digest}'.format(revision=revision, digest=hashlib.sha256(selection.encode()).hexdigest())
+
+
+class Suite:
+    """The regression tests to run, loaded in bulk."""
+
+    def __init__(self, db, regression_ids: List[int], baseline: Optional[Test]) -> None:
+        """
+        Load the regression tests, their outputs and categories, and the results of the baseline test.
+
+        :param db: database connection
+        :type db: sqlalchemy.orm.scoped_session
+        :param regression_ids: ids of the regression tests to run
+        :type regression_ids: list
+        :param baseline: the test the outputs are compared against
+        :type baseline: Test
+        """
+        in_scope = set(regression_ids)
+        self.tests = {}  # type: Dict[int, Tuple[Any, ...]]
+        for regression_id, command, input_type, output_type, sample in db.query(
+                RegressionTest.id, RegressionTest.command, RegressionTest.input_type, RegressionTest.output_type,
+                Sample).join(RegressionTest.sample).all():
+            if regression_id in in_scope:
+                self.tests[regression_id] = (command, input_type, output_type, sample)
+
+        self.outputs = {}  # type: Dict[int, List[Any]]
+        for output in db.query(RegressionTestOutput).order_by(RegressionTestOutput.id).all():
+            if output.regression_id in self.tests:
+                self.outputs.setdefault(output.regression_id, []).append(output)
+
+        members = {}  # type: Dict[int, List[int]]
+        for category_id, regression_id in db.query(regressionTestLinkTable.c.category_id,
+                                                   regressionTestLinkTable.c.regression_id).all():
+            members.setdefault(category_id, []).append(regression_id)
+        self.categories = []  # type: List[Tuple[str, List[int]]]
+        for category_id, name in db.query(Category.id, Category.name).order_by(Category.id.desc()).all():
+            if len(members.get(category_id, [])) > 0:
+                self.categories.append((name, sorted(members[category_id])))
+
+        # Output id to the result of the baseline, when it differed from the correct output
+        self.baseline_got = {}  # type: Dict[int, str]
+        if baseline is not None:
+            self.baseline_got = dict(db.query(TestResultFile.regression_test_output_id, TestResultFile.got).filter(
+                TestResultFile.test_id == baseline.id,
+                TestResultFile.got.isnot(None)
+            ).all())
+
+    def add_entry(self, single_test, regression_id: int) -> None:
+        """
+        Add a regression test to a test file.
+
+        :param single_test: the root of the test file
+        :type single_test: etree.Element
+        :param regression_id: id of the regression test
+        :type regression_id: int
+        """
+        command, input_type, output_type, sample = self.tests[regression_id]
+        entry = etree.SubElement(single_test, 'entry', id=str(regression_id))
+        command_node = etree.SubElement(entry, 'command')
+        command_node.text = command
+        input_node = etree.SubElement(entry, 'input', type=input_type.value)
+        # Need a path that is relative to the folder we provide inside the CI environment.
+        input_node.text = sample.filename
+        output_node = etree.SubElement(entry, 'output')
+        output_node.text = output_type.value
+        compare = etree.SubElement(entry, 'compare')
+        for output_file in self.outputs.get(regression_id, []):
+            ignore_file = str(output_file.ignore).lower()
+            file_node = etree.SubElement(compare, 'file', ignore=ignore_file, id=str(output_file.id))
+            correct = etree.SubElement(file_node, 'correct')
+            # Need a path that is relative to the folder we provide inside the CI environment.
+            if output_file.id in self.baseline_got:
+                correct.text = output_file.create_correct_filename(self.baseline_got[output_file.id])
+            else:
+                correct.text = output_file.filename_correct
+            expected = etree.SubElement(file_node, 'expected')
+            expected.text = output_file.filename_expected(sample.sha)
+
+    def build(self, impacted: List[int]) -> List[Tuple[str, bytes]]:
+        """
+        Build the test files, the regression tests to run first in a file of their own, and the collection file.
+
+        :param impacted: ids of the regression tests to run before the others, in that order
+        :type impacted: list
+        :return: the name and content of every file, the collection file last
+        :rtype: List[Tuple[str, bytes]]
+        """
+        impacted = [regression_id for regression_id in impacted if regression_id in self.tests]
+        files = []  # type: List[Tuple[str, Any]]
+        if len(impacted) > 0:
+            single_test = etree.Element('tests')
+            for regression_id in impacted:
+                self.add_entry(single_test, regression_id)
+            files.append((IMPACTED_TESTS_FILE, single_test))
+        for name, members in self.categories:
+            single_test = etree.Element('tests')
+            in_file = False
+            for regression_id in members:
+                if regression_id in self.tests and regression_id not in impacted:
+                    self.add_entry(single_test, regression_id)
+                    in_file = True
+            # Skip categories without tests to run
+            if in_file:
+                files.append(('{name}.xml'.format(name=name), single_test))
+
+        multi_test = etree.Element('multitest')
+        for file_name, _ in files:
+            test_file = etree.SubElement(multi_test, 'testfile')
+            location = etree.SubElement(test_file, 'location')
+            location.text = file_name
+        files.append((COLLECTION_FILE, multi_test))
+        return [(file_name, etree.tostring(root, encoding='UTF-8', xml_declaration=True, pretty_print=True))
+                for file_name, root in files]
+
+
+def cache_from_config(config: Dict[str, Any]) -> 'TestFileCache':
+    """
+    Create the cache of the test files of the sample repository.
+
+    :param config: the platform configuration
+    :type config: dict
+    :return: the cache
+    :rtype: TestFileCache
+    """
+    return TestFileCache(os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'TestFileCache'))
+
+
+class TestFileCache:
+    """Folder of generated test files, one folder per key, only keeping the latest revision of the suite."""
+
+    def __init__(self, root: str, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.root = root
+        self.max_entries = max_entries
+
+    def copy_to(self, key: str, folder: str) -> bool:
+        """
+        Copy the cached files of a key to a folder.
+
+        :param key: the key of the files
+        :type key: str
+        :param folder: the folder to copy the files to
+        :type folder: str
+        :return: True if the files were cached, False otherwise
+        :rtype: bool
+        """
+        entry = os.path.join(self.root, key)
+        try:
+            names = os.listdir(entry)
+            for name in names:
+                shutil.copyfile(os.path.join(entry, name), os.path.join(folder, name))
+            # Mark the entry as recently used
+            os.utime(entry)
+        except OSError:
+            return False
+        return COLLECTION_FILE in names
+
+    def store(self, key: str, files: List[Tuple[str, bytes]]) -> None:
+        """
+        Cache the files of a key, dropping the files of other revisions and the least recently used ones.
+
+        :param key: the key of the files
+        :type key: str
+        :param files: the name and content of every file
+        :type files: List[Tuple[str, bytes]]
+        """
+        revision, digest = key.split('/')
+        revision_folder = os.path.join(self.root, revision)
+        try:
+            os.makedirs(revision_folder, exist_ok=True)
+            # Write the files next to the entry and move them in place at once, so they're never read half written
+            staging = tempfile.mkdtemp(dir=revision_folder, prefix='.')
+            for name, content in files:
+                with open(os.path.join(staging, name), 'wb') as f:
+                    f.write(content)
+            try:
+                os.rename(staging, os.path.join(revision_folder, digest))
+            except OSError:
+                # Another VM cached the same files meanwhile
+                shutil.rmtree(staging, ignore_errors=True)
+            self.evict(revision)
+        except OSError:
+            pass
+
+    def evict(self, revision: str) -> None:
+        """
+        Remove the entries of other revisions, and the least recently used entries beyond the maximum.
+
+        :param revision: the folder of the current revision
+        :type revision: str
+        """
+        for name in os.listdir(self.root):
+            if name != revision:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+        revision_folder = os.path.join(self.root, revision)
+        entries = [os.path.join(revision_folder, name) for name in os.listdir(revision_folder)
+                   if not name.startswith('.')]
+        entries.sort(key=lambda entry: os.stat(entry).st_mtime, reverse=True)
+        for entry in entries[self.max_entries:]:
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def write_test_files(db, test, regression_ids: List[int], base_folder: str, impacted: Optional[List[int]] = None,
+                     cache: Optional[TestFileCache] = None) -> Optional[Test]:
+    """
+    Write the XML files listing the regression tests a VM runs, one file per category, and the collection file.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: the test to run
+    :type test: Test
+    :param regression_ids: ids of the regression tests to run
+    :type regression_ids: list
+    :param base_folder: folder to write the files to
+    :type base_folder: str
+    :param impacted: ids of regression tests to run before the others, in that order, in a file of their own
+    :type impacted: list
+    :param cache: the cache of the test files, None to build them every time
+    :type cache: TestFileCache
+    :return: the test the outputs are compared against
+    :rtype: Test
+    """
+    impacted = impacted or []
+    baseline = find_baseline(db, test.platform)
+    run_id = baseline_run(db, baseline)
+    key = None
+    if cache is not None and run_id is not None:
+        key = cache_key(suite_revision(db), run_id, regression_ids, impacted)
+        if cache.copy_to(key, base_folder):
+            return baseline
+
+    files = Suite(db, regression_ids, baseline).build(impacted)
+    for name, content in files:
+        with open(os.path.join(base_folder, name), 'wb') as f:
+            f.write(content)
+    if cache is not None and key is not None:
+        cache.store(key, files)
+    return baseline
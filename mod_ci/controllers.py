@@ -1,25 +1,25 @@
 """maintains all functionality related running virtual machines, starting and tracking tests."""
 
 import datetime
-import hashlib
 import json
 import multiprocessing
 import os
 import shutil
 import sys
 from multiprocessing import Process
+from threading import Thread
 from typing import Any, Callable, List, Optional, Tuple, Type
 
 import pymysql.err
 import requests
 from flask import (Blueprint, abort, current_app, flash, g, jsonify, redirect,
                    request, url_for)
-from git import GitCommandError, InvalidGitRepositoryError, Repo
+from git import GitCommandError
 from github import ApiError, GitHub
-from lxml import etree
 from markdown2 import markdown
 from pymysql.err import IntegrityError
-from sqlalchemy import and_, func, or_
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError as SQLAlchemyIntegrityError
 from sqlalchemy.sql import label
 from sqlalchemy.sql.functions import count
 from werkzeug.utils import secure_filename
@@ -28,8 +28,23 @@ from decorators import get_menu_entries, template_renderer
 from mailer import Mailer
 from mod_auth.controllers import check_access_rights, login_required
 from mod_auth.models import Role
-from mod_ci.forms import AddUsersToBlacklist, RemoveUsersFromBlacklist
-from mod_ci.models import BlockedUsers, Kvm, MaintenanceMode
+from mod_ci.ci_files import (bump_suite_revision, cache_from_config,
+                             write_test_files)
+from mod_ci.forms import (AddUsersToBlacklist, ForkWeightForm,
+                          QueueWeightsForm, RemoveUsersFromBlacklist)
+from mod_ci.impact import (failed_regression_tests, record_changed_files,
+                           select_impacted_tests)
+from mod_ci.ingest import parse_records, store_records
+from mod_ci.mirror import can_premerge, mirror_from_config
+from mod_ci.models import (BlockedUsers, Kvm, MaintenanceMode, PlatformStats,
+                           QueueWeight)
+from mod_ci.priority import (AGING, FAIR_SHARE, MAIN_FORK, OTHER_FORKS,
+                             assign_priority, fork_key, load_weights, type_key)
+from mod_ci.publisher import (client_from_config, deliver_due, queue_comment,
+                              queue_status)
+from mod_ci.scheduler import kvm_names, notify_scheduler, scheduler_metrics
+from mod_ci.sharding import create_shards, merge_shard_progress
+from mod_ci.uploads import store_upload
 from mod_customized.models import CustomizedTest
 from mod_deploy.controllers import is_valid_signature, request_from_github
 from mod_home.models import CCExtractorVersion, GeneralData
@@ -37,14 +52,20 @@ from mod_regression.models import (Category, RegressionTest,
                                    RegressionTestOutput,
                                    regressionTestLinkTable)
 from mod_sample.models import Issue
+from mod_test.diff_worker import queue_diffs
 from mod_test.models import (Fork, Test, TestPlatform, TestProgress,
-                             TestResult, TestResultFile, TestStatus, TestType)
+                             TestQueueState, TestResult, TestResultFile,
+                             TestStatus, TestType)
+from mod_test.result_store import result_store_from_config
 
 if sys.platform.startswith("linux"):
     import libvirt
 
 mod_ci = Blueprint('ci', __name__)
 
+# number of tests a VM tries to claim before giving up, when other VMs keep claiming them first
+MAX_CLAIM_ATTEMPTS = 5
+
 
 class Status:
     """Define different states for the tests."""
@@ -63,7 +84,9 @@ def before_app_request() -> None:
             {'title': 'Maintenance', 'icon': 'wrench',
              'route': 'ci.show_maintenance', 'access': [Role.admin]},  # type: ignore
             {'title': 'Blocked Users', 'icon': 'ban',
-             'route': 'ci.blocked_users', 'access': [Role.admin]}  # type: ignore
+             'route': 'ci.blocked_users', 'access': [Role.admin]},  # type: ignore
+            {'title': 'Queue Priority', 'icon': 'sort-amount-desc',
+             'route': 'ci.queue_priority', 'access': [Role.admin]}  # type: ignore
         ]
     )
     if 'config' in g.menu_entries and 'entries' in config_entries:
@@ -74,32 +97,35 @@ def before_app_request() -> None:
 
 def start_platforms(db, repository, delay=None, platform=None) -> None:
     """
-    Start new test on both platforms in parallel.
+    Start new tests on all VMs of both platforms in parallel.
 
-    We use multiprocessing module which bypasses Python GIL to make use of multiple cores of the processor.
+    When the scheduler runs, it's notified and starts the next test itself once the delay passed. Otherwise, we use
+    multiprocessing module which bypasses Python GIL to make use of multiple cores of the processor.
     """
     from run import config, log, app
 
+    if notify_scheduler(config, platform, delay):
+        log.info('notified the scheduler...')
+        return
+
     with app.app_context():
         from flask import current_app
-        if platform is None or platform == TestPlatform.linux:
-            linux_kvm_name = config.get('KVM_LINUX_NAME', '')
-            log.info('setting Linux virtual machine process...')
-            linux_process = Process(target=kvm_processor, args=(current_app._get_current_object(), db, linux_kvm_name,
-                                                                TestPlatform.linux, repository, delay,))
-            linux_process.start()
-            log.info('started Linux virtual machine process...')
-
-        if platform is None or platform == TestPlatform.windows:
-            win_kvm_name = config.get('KVM_WINDOWS_NAME', '')
-            log.info('setting Windows virtual machine process...')
-            windows_process = Process(target=kvm_processor, args=(current_app._get_current_object(), db, win_kvm_name,
-                                                                  TestPlatform.windows, repository, delay,))
-            windows_process.start()
-            log.info('started Windows virtual machine process...')
-
-
-def kvm_processor(app, db, kvm_name, platform, repository, delay) -> None:
+        for vm_platform, description in [(TestPlatform.linux, 'Linux'), (TestPlatform.windows, 'Windows')]:
+            if platform is not None and platform != vm_platform:
+                continue
+            names = kvm_names(config, vm_platform)
+            if len(names) == 0:
+                log.critical('[{platform}] KVM name is empty!'.format(platform=vm_platform))
+            # Every VM of the pool claims a test of its own
+            for kvm_name in names:
+                log.info('setting {description} virtual machine process...'.format(description=description))
+                process = Process(target=kvm_processor, args=(current_app._get_current_object(), db, kvm_name,
+                                                              vm_platform, repository, delay,))
+                process.start()
+                log.info('started {description} virtual machine process...'.format(description=description))
+
+
+def kvm_processor(app, db, kvm_name, platform, repository, delay, conn=None) -> None:
     """
     Check whether there is no already running same kvm.
 
@@ -118,10 +144,10 @@ def kvm_processor(app, db, kvm_name, platform, repository, delay) -> None:
     :type repository: str
     :param delay: time delay after which to start kvm processor
     :type delay: int
+    :param conn: open libvirt connection to use, None to open (and close) one
+    :type conn: libvirt.virConnect
     """
-    from run import config, log, get_github_config
-
-    github_config = get_github_config(config)
+    from run import config, log
 
     log.info("[{platform}] Running kvm_processor".format(platform=platform))
     if kvm_name == "":
@@ -138,8 +164,10 @@ def kvm_processor(app, db, kvm_name, platform, repository, delay) -> None:
         log.debug('[{platform}] In maintenance mode! Waiting...'.format(platform=platform))
         return
 
-    # Open connection to libvirt
-    conn = libvirt.open("qemu:///system")
+    # Open connection to libvirt, unless the caller keeps one open
+    close_conn = conn is None
+    if conn is None:
+        conn = libvirt.open("qemu:///system")
     if conn is None:
         log.critical("[{platform}] Couldn't open connection to libvirt!".format(platform=platform))
         return
@@ -158,15 +186,15 @@ def kvm_processor(app, db, kvm_name, platform, repository, delay) -> None:
         if status is not None:
             if datetime.datetime.now() - status.timestamp >= datetime.timedelta(minutes=max_runtime):
                 # Mark entry as aborted
-                test_progress = TestProgress(status.test.id, TestStatus.canceled, 'Runtime exceeded')
+                test = status.test
+                test_progress = TestProgress(test.id, TestStatus.canceled, 'Runtime exceeded')
                 db.add(test_progress)
-                db.delete(status)
-                db.commit()
+                test.queue_state = TestQueueState.finished
 
-                # Abort process
-                if vm.destroy() == -1:
-                    # Failed to shut down
-                    log.critical("[{platform}] Failed to shut down {name}".format(platform=platform, name=kvm_name))
+                # Abort process, on the VMs running the other shards of the test too
+                stopped = stop_test_vms(db, conn, test)
+                db.commit()
+                if not stopped:
                     return
             else:
                 log.info("[{platform}] Current job not expired yet.".format(platform=platform))
@@ -183,249 +211,267 @@ def kvm_processor(app, db, kvm_name, platform, repository, delay) -> None:
     if status is not None:
         log.warn("[{platform}] KVM is powered off, but test {id} still present".format(
             platform=platform, id=status.test.id))
+        # The VM stopped before the test finished, so another VM runs it again
+        requeue_claim(status)
         db.delete(status)
         db.commit()
 
-    # Get oldest test for this platform
-    finished_tests = db.query(TestProgress.test_id).filter(
-        TestProgress.status.in_([TestStatus.canceled, TestStatus.completed])
-    ).subquery()
-    fork = Fork.query.filter(Fork.github.like(
-        "%/{owner}/{repo}.git".format(owner=github_config['repository_owner'], repo=github_config['repository'])
-    )).first()
-    test = Test.query.filter(
-        Test.id.notin_(finished_tests), Test.platform == platform, Test.fork_id == fork.id
-    ).order_by(Test.id.asc()).first()
-
-    if test is None:
-        test = Test.query.filter(Test.id.notin_(finished_tests), Test.platform == platform).order_by(
-            Test.id.asc()).first()
-
-    if test is None:
-        log.info('[{platform}] No more tests to run, returning'.format(platform=platform))
+    status = claim_test(db, kvm_name, platform)
+    if status is None:
         return
 
-    if test.test_type == TestType.pull_request and test.pr_nr == 0:
-        log.warn('[{platform}] Test {id} is invalid, deleting'.format(platform=platform, id=test.id))
-        db.delete(test)
-        db.commit()
-        return
+    # Release the test for the other VMs unless it's running on this one
+    started = False
+    try:
+        started = start_test(app, db, vm, status, repository)
+    finally:
+        if not started:
+            db.rollback()
+            requeue_claim(status)
+            db.delete(status)
+            db.commit()
+
+    # Close connection to libvirt
+    if close_conn:
+        conn.close()
+
+
+def requeue_claim(status) -> None:
+    """
+    Put the test (or the shard of the test) a VM claimed back in the queue, unless it finished.
+
+    :param status: the Kvm entry holding the test
+    :type status: Kvm
+    """
+    if status.test.queue_state == TestQueueState.running:
+        status.test.queue_state = TestQueueState.queued
+    for shard in status.test.shards:
+        if shard.number == status.shard and shard.queue_state == TestQueueState.running:
+            shard.queue_state = TestQueueState.queued
+
+
+def stop_test_vms(db, conn, test) -> bool:
+    """
+    Shut down the VMs running a test, one per shard of the test, and release them and the shards.
+
+    A VM that fails to shut down is released all the same, the kvm_processor resets it once it finds it running without
+    a test.
+
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param conn: The connection to libvirt.
+    :type conn: libvirt.virConnect
+    :param test: The running test.
+    :type test: Test
+    :return: Whether every VM was shut down
+    :rtype: bool
+    """
+    from run import log
+
+    stopped = True
+    for status in Kvm.query.filter(Kvm.test_id == test.id).all():
+        try:
+            vm = conn.lookupByName(status.name)
+            if vm.info()[0] != libvirt.VIR_DOMAIN_SHUTOFF and vm.destroy() == -1:
+                log.critical("Failed to shut down {name} running test {id}".format(name=status.name, id=test.id))
+                stopped = False
+        except libvirt.libvirtError:
+            log.critical("No VM named {name} found running test {id}!".format(name=status.name, id=test.id))
+        db.delete(status)
+    for shard in test.shards:
+        shard.queue_state = TestQueueState.finished
+    return stopped
+
+
+def claim_test(db, kvm_name, platform) -> Optional[Kvm]:
+    """
+    Claim the queued test of a platform with the highest priority, the oldest one first on a tie.
+
+    The claim is the Kvm entry of the VM, which holds at most one entry per test, and marks the test as running. When
+    several VMs of a platform claim the same test at once, only the first one succeeds and the others try the next test.
+
+    With TEST_SHARDS set above 1, the regression tests of a test are split in shards when it's first claimed. Every VM
+    then claims one shard, and the test only runs once all of its shards are claimed.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param kvm_name: name of the VM claiming the test
+    :type kvm_name: str
+    :param platform: operating system of the VM
+    :type platform: TestPlatform
+    :return: the Kvm entry holding the test, or None if there's no test left to run
+    :rtype: Kvm
+    """
+    from run import config, log
+
+    shard_count = config.get('TEST_SHARDS', 1)
+    lost = []  # type: List[int]
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        # Get the next test for this platform, straight from the queue index. The main fork is preferred through its
+        # weight in the priority (see mod_ci.priority).
+        waiting = Test.query.filter(Test.platform == platform, Test.queue_state == TestQueueState.queued)
+        if len(lost) > 0:
+            waiting = waiting.filter(Test.id.notin_(lost))
+        test = waiting.order_by(Test.priority.desc(), Test.id.asc()).first()
+
+        if test is None:
+            log.info('[{platform}] No more tests to run, returning'.format(platform=platform))
+            return None
+
+        if test.test_type == TestType.pull_request and test.pr_nr == 0:
+            log.warn('[{platform}] Test {id} is invalid, deleting'.format(platform=platform, id=test.id))
+            db.delete(test)
+            db.commit()
+            return None
+
+        # A sharded test stays queued until the last of its shards is claimed
+        shards = test.shards
+        if len(shards) == 0 and shard_count > 1:
+            shards = create_shards(db, test, shard_count)
+        shard = next((shard for shard in shards if shard.queue_state == TestQueueState.queued), None)
+        if shard is None:
+            status = Kvm(kvm_name, test.id)
+            test.queue_state = TestQueueState.running
+        else:
+            status = Kvm(kvm_name, test.id, shard=shard.number)
+            shard.queue_state = TestQueueState.running
+            if all(other.queue_state != TestQueueState.queued for other in shards):
+                test.queue_state = TestQueueState.running
+        db.add(status)
+        try:
+            db.commit()
+        except SQLAlchemyIntegrityError:
+            db.rollback()
+            log.info("[{platform}] Test {id} was claimed by another VM".format(platform=platform, id=test.id))
+            # Another VM may have claimed one shard of the test, leaving the others
+            if shard is None:
+                lost.append(test.id)
+            continue
+        return status
+
+    log.warn("[{platform}] Gave up claiming a test after {count} attempts".format(
+        platform=platform, count=MAX_CLAIM_ATTEMPTS))
+    return None
+
+
+def start_test(app, db, vm, status, repository) -> bool:
+    """
+    Prepare the data of a claimed test and launch its VM.
+
+    Creates testing xml files to test the change in main repo.
+    Creates clone with separate branch and merge pr into it.
+
+    :param app: the application
+    :type app: Flask
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param vm: the VM, powered off
+    :type vm: libvirt.virDomain
+    :param status: the Kvm entry holding the test
+    :type status: Kvm
+    :param repository: repository to run tests on
+    :type repository: str
+    :return: whether the VM was launched
+    :rtype: bool
+    """
+    from run import config, log
+
+    test = status.test
+    kvm_name = status.name
+    platform = test.platform
 
     # Reset to snapshot
     if vm.hasCurrentSnapshot() != 1:
         log.critical("[{platform}] VM {name} has no current snapshot set!".format(platform=platform, name=kvm_name))
-        return
+        return False
 
     snapshot = vm.snapshotCurrent()
     if vm.revertToSnapshot(snapshot) == -1:
         log.critical("[{platform}] Failed to revert to {snapshot} for {name}".format(
             platform=platform, snapshot=snapshot.getName(), name=kvm_name)
         )
-        return
+        return False
 
     log.info("[{p}] Reverted to {snap} for {name}".format(p=platform, snap=snapshot.getName(), name=kvm_name))
     log.debug('Starting test {id}'.format(id=test.id))
-    status = Kvm(kvm_name, test.id)
     # Prepare data
     # 0) Write url to file
+    # A shard reports on its own url, so its progress can be merged with the other shards of the test
+    shard = next((shard for shard in test.shards if shard.number == status.shard), None)
     with app.app_context():
-        full_url = url_for('ci.progress_reporter', test_id=test.id, token=test.token, _external=True, _scheme="https")
+        full_url = url_for('ci.progress_reporter', test_id=test.id, token=test.token,
+                           shard=None if shard is None else shard.number, _external=True, _scheme="https")
 
     file_path = os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'vm_data', kvm_name, 'reportURL')
 
     with open(file_path, 'w') as f:
         f.write(full_url)
 
-    # 1) Generate test files
-    base_folder = os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'vm_data', kvm_name, 'ci-tests')
-    categories = Category.query.order_by(Category.id.desc()).all()
-    commit_name = 'fetch_commit_' + platform.value
-    commit_hash = GeneralData.query.filter(GeneralData.key == commit_name).first().value
-    last_commit = Test.query.filter(and_(Test.commit == commit_hash, Test.platform == platform)).first()
-
-    log.debug("[{p}] We will compare against the results of test {id}".format(p=platform, id=last_commit.id))
-
-    regression_ids = test.get_customized_regressiontests()
-
-    # Init collection file
-    multi_test = etree.Element('multitest')
-    for category in categories:
-        # Skip categories without tests
-        if len(category.regression_tests) == 0:
-            continue
-        # Create XML file for test
-        file_name = '{name}.xml'.format(name=category.name)
-        single_test = etree.Element('tests')
-        check_write = False
-        for regression_test in category.regression_tests:
-            if regression_test.id not in regression_ids:
-                log.debug(f'Skipping RT #{regression_test.id} ({category.name}) as not in scope')
-                continue
-            check_write = True
-            entry = etree.SubElement(single_test, 'entry', id=str(regression_test.id))
-            command = etree.SubElement(entry, 'command')
-            command.text = regression_test.command
-            input_node = etree.SubElement(entry, 'input', type=regression_test.input_type.value)
-            # Need a path that is relative to the folder we provide inside the CI environment.
-            input_node.text = regression_test.sample.filename
-            output_node = etree.SubElement(entry, 'output')
-            output_node.text = regression_test.output_type.value
-            compare = etree.SubElement(entry, 'compare')
-            last_files = TestResultFile.query.filter(and_(
-                TestResultFile.test_id == last_commit.id,
-                TestResultFile.regression_test_id == regression_test.id
-            )).subquery()
-
-            for output_file in regression_test.output_files:
-                ignore_file = str(output_file.ignore).lower()
-                file_node = etree.SubElement(compare, 'file', ignore=ignore_file, id=str(output_file.id))
-                last_commit_files = db.query(last_files.c.got).filter(and_(
-                    last_files.c.regression_test_output_id == output_file.id,
-                    last_files.c.got.isnot(None)
-                )).first()
-                correct = etree.SubElement(file_node, 'correct')
-                # Need a path that is relative to the folder we provide inside the CI environment.
-                if last_commit_files is None:
-                    correct.text = output_file.filename_correct
-                else:
-                    correct.text = output_file.create_correct_filename(last_commit_files[0])
-
-                expected = etree.SubElement(file_node, 'expected')
-                expected.text = output_file.filename_expected(regression_test.sample.sha)
-        # check whether category should be included or not
-        if not check_write:
-            continue
-        # Save XML
-        single_test.getroottree().write(
-            os.path.join(base_folder, file_name), encoding='utf-8', xml_declaration=True, pretty_print=True
-        )
-        # Append to collection file
-        test_file = etree.SubElement(multi_test, 'testfile')
-        location = etree.SubElement(test_file, 'location')
-        location.text = file_name
-
-    # Save collection file
-    multi_test.getroottree().write(
-        os.path.join(base_folder, 'TestAll.xml'), encoding='utf-8', xml_declaration=True, pretty_print=True
-    )
-
-    # 2) Create git repo clone and merge PR into it (if necessary)
+    # 1) Check out the commit in the clone of the VM, from the mirror, and merge the PR into it (if necessary)
+    mirror = mirror_from_config(config)
+    fork_id, fork_url = None, None
+    if not check_main_repo(test.fork.github):
+        fork_id, fork_url = test.fork.id, test.fork.github
+    if not mirror.ensure_commit(test.commit, fork_id, fork_url):
+        log.critical("[{platform}] Could not fetch commit {hash} for test {id} into the mirror!".format(
+            platform=platform, hash=test.commit, id=test.id))
+        return False
     try:
-        repo = Repo(os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'vm_data', kvm_name, 'unsafe-ccextractor'))
-    except InvalidGitRepositoryError:
-        log.critical("[{platform}] Could not open CCExtractor's repository copy!".format(platform=platform))
-        return
-
-    # Return to master
-    repo.heads.master.checkout(True)
-    # Update repository from upstream
-    try:
-        fork_id = test.fork.id
-        fork_url = test.fork.github
-        if not check_main_repo(fork_url):
-            existing_remote = [remote.name for remote in repo.remotes]
-            remote = 'fork_{id}'.format(id=fork_id)
-            if remote in existing_remote:
-                origin = repo.remote(remote)
-            else:
-                origin = repo.create_remote(remote, url=fork_url)
-        else:
-            origin = repo.remote('origin')
-    except ValueError:
-        log.critical("[{platform}] Origin remote doesn't exist!".format(platform=platform))
-        return
-
-    fetch_info = origin.fetch()
-    if len(fetch_info) == 0:
-        log.info('[{platform}] Fetch from remote returned no new data...'.format(platform=platform))
-    # Checkout to Remote Master
-    repo.git.checkout(origin.refs.master)
-    # Pull code (finally)
-    pull_info = origin.pull('master')
-    if len(pull_info) == 0:
-        log.info("[{platform}] Pull from remote returned no new data...".format(platform=platform))
-    if pull_info[0].flags > 128:
-        log.critical("[{platform}] Didn't pull any information from remote: {flags}!".format(
-            platform=platform, flags=pull_info[0].flags))
-        return
-
-    # Delete the test branch if it exists, and recreate
+        repo = mirror.clone(os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'vm_data', kvm_name,
+                                         'unsafe-ccextractor'))
+    except (GitCommandError, OSError):
+        log.critical("[{platform}] Could not prepare CCExtractor's repository copy!".format(platform=platform))
+        return False
+
+    # Check out the commit on a new test branch, or the merge of the PR on master made when it was queued
+    merge = None
+    if test.test_type == TestType.pull_request:
+        merge = mirror.premerged(test.commit, test.pr_nr)
     try:
-        repo.delete_head('CI_Branch', force=True)
+        repo.git.checkout('-f', '-B', 'CI_Branch', test.commit if merge is None else merge)
     except GitCommandError:
-        log.warn("[{platform}] Could not delete CI_Branch head".format(platform=platform))
-
-    # Remove possible left rebase-apply directory
-    try:
-        shutil.rmtree(os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'unsafe-ccextractor', '.git', 'rebase-apply'))
-    except OSError:
-        log.warn("[{platform}] Could not delete rebase-apply".format(platform=platform))
-    # If PR, merge, otherwise reset to commit
-    if test.test_type == TestType.pull_request:
-        # Fetch PR (stored under origin/pull/<id>/head)
-        pull_info = origin.fetch('pull/{id}/head:CI_Branch'.format(id=test.pr_nr))
-        if len(pull_info) == 0:
-            log.warn("[{platform}] Didn't pull any information from remote PR!".format(platform=platform))
-
-        if pull_info[0].flags > 128:
-            log.critical("[{platform}] Didn't pull any information from remote PR: {flags}!".format(
-                platform=platform, flags=pull_info[0].flags))
-            return
-
-        try:
-            test_branch = repo.heads['CI_Branch']
-        except IndexError:
-            log.critical('CI_Branch does not exist')
-            return
-
-        test_branch.checkout(True)
+        log.warn("[{platform}] Commit {hash} for test {id} does not exist!".format(
+            platform=platform, hash=test.commit, id=test.id))
+        return False
 
+    # If PR, merge on master, unless it's merged already
+    if test.test_type == TestType.pull_request and merge is None:
         try:
             pull = repository.pulls('{pr_nr}'.format(pr_nr=test.pr_nr)).get()
         except ApiError as a:
             log.error('Got an exception while fetching the PR payload! Message: {message}'.format(message=a.message))
-            return
+            return False
         if pull['mergeable'] is False:
-            progress = TestProgress(test.id, TestStatus.canceled, "Commit could not be merged", datetime.datetime.now())
-            db.add(progress)
-            db.commit()
-            try:
-                with app.app_context():
-                    repository.statuses(test.commit).post(
-                        state=Status.FAILURE,
-                        description="Tests canceled due to merge conflict",
-                        context="CI - {name}".format(name=test.platform.value),
-                        target_url=url_for('test.by_id', test_id=test.id, _external=True)
-                    )
-            except ApiError as a:
-                log.error('Got an exception while posting to GitHub! Message: {message}'.format(message=a.message))
-            return
+            with app.app_context():
+                cancel_merge_conflict(db, test)
+                publish_github_events(db, log, [test.commit])
+            return False
 
         # Merge on master if no conflict
         repo.git.merge('master')
 
-    else:
-        test_branch = repo.create_head('CI_Branch', origin.refs.master)
-        test_branch.checkout(True)
-        try:
-            repo.head.reset(test.commit, working_tree=True)
-        except GitCommandError:
-            log.warn("[{platform}] Commit {hash} for test {id} does not exist!".format(
-                platform=platform, hash=test.commit, id=test.id))
-            return
+    # 2) Generate test files, the regression tests most likely impacted by the change first
+    regression_ids = test.get_customized_regressiontests()
+    if shard is not None:
+        regression_ids = shard.get_regression_ids()
+    record_changed_files(db, test, repo)
+    impacted = [regression_id for regression_id in select_impacted_tests(db, test, config.get('IMPACT_SELECTION', 0))
+                if regression_id in regression_ids]
+    base_folder = os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'vm_data', kvm_name, 'ci-tests')
+    baseline = write_test_files(db, test, regression_ids, base_folder, impacted, cache_from_config(config))
+    if baseline is not None:
+        log.debug("[{p}] We will compare against the results of test {id}".format(p=platform, id=baseline.id))
 
     # Power on machine
     try:
         vm.create()
-        db.add(status)
+        # The runtime of the test starts now, not when it was claimed
+        status.timestamp = datetime.datetime.now()
         db.commit()
     except libvirt.libvirtError:
         log.critical("[{platform}] Failed to launch VM {name}".format(platform=platform, name=kvm_name))
-    except IntegrityError:
-        log.warn("[{platform}] Duplicate entry for {id}".format(platform=platform, id=test.id))
-
-    # Close connection to libvirt
-    conn.close()
+        return False
+    return True
 
 
 def queue_test(db, gh_commit, commit, test_type, branch="master", pr_nr=0) -> None:
@@ -434,7 +480,7 @@ def queue_test(db, gh_commit, commit, test_type, branch="master", pr_nr=0) -> No
 
     :param db: Database connection.
     :type db: sqlalchemy.orm.scoped_session
-    :param gh_commit: The GitHub API call for the commit. Can be None
+    :param gh_commit: The GitHub API call for the commit. Can be None, to not post the status
     :type gh_commit: Any
     :param commit: The commit hash.
     :type commit: str
@@ -447,7 +493,7 @@ def queue_test(db, gh_commit, commit, test_type, branch="master", pr_nr=0) -> No
     :return: Nothing
     :rtype: None
     """
-    from run import log
+    from run import config, log
 
     fork = Fork.query.filter(
         Fork.github.like("%/{owner}/{repo}.git".format(owner=g.github['repository_owner'], repo=g.github['repository']))
@@ -457,31 +503,179 @@ def queue_test(db, gh_commit, commit, test_type, branch="master", pr_nr=0) -> No
         log.debug('pull request test type detected')
         branch = "pull_request"
 
+    weights = load_weights(db)
     linux_test = Test(TestPlatform.linux, test_type, fork.id, branch, commit, pr_nr)
+    assign_priority(db, linux_test, True, weights)
     db.add(linux_test)
     windows_test = Test(TestPlatform.windows, test_type, fork.id, branch, commit, pr_nr)
+    assign_priority(db, windows_test, True, weights)
     db.add(windows_test)
     db.commit()
     add_customized_regression_tests(linux_test.id)
     add_customized_regression_tests(windows_test.id)
 
     if gh_commit is not None:
-        status_entries = {
-            linux_test.platform.value: linux_test.id,
-            windows_test.platform.value: windows_test.id
-        }
-        for platform_name, test_id in status_entries.items():
-            try:
-                gh_commit.post(
-                    state=Status.PENDING,
-                    description="Tests queued",
-                    context="CI - {name}".format(name=platform_name),
-                    target_url=url_for('test.by_id', test_id=test_id, _external=True)
-                )
-            except ApiError as a:
-                log.critical('Could not post to GitHub! Response: {res}'.format(res=a.response))
-
-    log.debug("Created tests, waiting for cron...")
+        for test in [linux_test, windows_test]:
+            queue_test_status(db, test, Status.PENDING, "Tests queued")
+        publish_github_events(db, log, [commit])
+
+    premerge = test_type == TestType.pull_request and config.get('PREMERGE_PULL_REQUESTS', False)
+    if premerge and not can_premerge():
+        log.warn('PREMERGE_PULL_REQUESTS needs git 2.38 or later, the VMs merge PR #{pr_nr} instead'.format(
+            pr_nr=pr_nr))
+        premerge = False
+    if premerge:
+        # The scheduler is notified once the PR is merged on master, so the VMs only check out the merge
+        Thread(target=premerge_pull_request, args=(current_app._get_current_object(), db, commit, pr_nr,
+                                                   [linux_test.id, windows_test.id]), daemon=True).start()
+        log.debug("Created tests, merging PR #{pr_nr} on master".format(pr_nr=pr_nr))
+    elif notify_scheduler(config):
+        log.debug("Created tests, notified the scheduler")
+    else:
+        log.debug("Created tests, waiting for cron...")
+
+
+def premerge_pull_request(app, db, commit, pr_nr, test_ids) -> None:
+    """
+    Merge a queued PR on master in the mirror, ahead of the VMs running its tests, and notify the scheduler.
+
+    The tests of a PR that conflicts with master are canceled before any VM is claimed for them. The VMs check out
+    the merge of the others, instead of asking GitHub whether the PR can be merged and merging it themselves.
+
+    :param app: the application
+    :type app: Flask
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param commit: The commit hash of the PR.
+    :type commit: str
+    :param pr_nr: Pull Request number.
+    :type pr_nr: int
+    :param test_ids: The ids of the tests of the PR.
+    :type test_ids: List[int]
+    :return: Nothing
+    :rtype: None
+    """
+    from run import config, log
+
+    try:
+        mirror = mirror_from_config(config)
+        if not mirror.update():
+            log.warn('Could not update the mirror before merging PR #{pr_nr}'.format(pr_nr=pr_nr))
+        if not mirror.has_commit(commit):
+            log.error('Commit {commit} of PR #{pr_nr} is missing from the mirror'.format(commit=commit, pr_nr=pr_nr))
+            return
+        try:
+            merge = mirror.premerge(commit, pr_nr)
+        except GitCommandError as e:
+            log.error('Could not merge PR #{pr_nr} on master: {error}'.format(pr_nr=pr_nr, error=e))
+            return
+        if merge is not None:
+            log.info('Merged PR #{pr_nr} at {commit} on master as {merge}'.format(
+                pr_nr=pr_nr, commit=commit, merge=merge))
+            return
+
+        log.info('PR #{pr_nr} at {commit} conflicts with master, canceling its tests'.format(
+            pr_nr=pr_nr, commit=commit))
+        tests = Test.query.filter(Test.id.in_(test_ids), Test.queue_state == TestQueueState.queued).all()
+        with app.app_context():
+            for test in tests:
+                cancel_merge_conflict(db, test)
+            publish_github_events(db, log, [commit])
+    finally:
+        db.remove()
+        notify_scheduler(config)
+
+
+def cancel_merge_conflict(db, test) -> None:
+    """
+    Cancel a test of a PR that can't be merged on master, and queue the failure for GitHub.
+
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: The test of the PR.
+    :type test: Test
+    :return: Nothing
+    :rtype: None
+    """
+    progress = TestProgress(test.id, TestStatus.canceled, "Commit could not be merged", datetime.datetime.now())
+    db.add(progress)
+    test.queue_state = TestQueueState.finished
+    db.commit()
+    queue_test_status(db, test, Status.FAILURE, "Tests canceled due to merge conflict")
+
+
+def cancel_superseded_tests(db, pr_nr, commit) -> None:
+    """
+    Cancel the tests of the older commits of a pull request, now that a newer commit supersedes them.
+
+    Queued tests are canceled. Running tests are only stopped when PREEMPT_SUPERSEDED_TESTS is set, which shuts down
+    their VM so it moves on to the next test.
+
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param pr_nr: Pull Request number.
+    :type pr_nr: int
+    :param commit: The new head commit of the pull request.
+    :type commit: str
+    :return: Nothing
+    :rtype: None
+    """
+    from run import config, log
+
+    states = [TestQueueState.queued]
+    if config.get('PREEMPT_SUPERSEDED_TESTS', False):
+        states.append(TestQueueState.running)
+
+    tests = Test.query.filter(
+        Test.test_type == TestType.pull_request,
+        Test.pr_nr == pr_nr,
+        Test.commit != commit,
+        Test.queue_state.in_(states)
+    ).all()
+    for test in tests:
+        if test.queue_state == TestQueueState.running and not preempt_test(db, test):
+            continue
+        progress = TestProgress(test.id, TestStatus.canceled, "Superseded by commit {commit}".format(commit=commit),
+                                datetime.datetime.now())
+        db.add(progress)
+        test.queue_state = TestQueueState.finished
+        db.commit()
+        log.info('Canceled test {id} of PR #{pr_nr}, superseded by {commit}'.format(
+            id=test.id, pr_nr=pr_nr, commit=commit))
+        queue_test_status(db, test, Status.FAILURE, "Tests canceled, superseded by a newer commit")
+    if len(tests) > 0:
+        publish_github_events(db, log, {test.commit for test in tests})
+
+
+def preempt_test(db, test) -> bool:
+    """
+    Stop a running test by shutting down its VMs, one per shard, and releasing them for the next test.
+
+    Tests that didn't report any progress yet are left alone, as the VMs could still be being prepared for them.
+
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: The running test.
+    :type test: Test
+    :return: Whether the test was stopped
+    :rtype: bool
+    """
+    from run import log
+
+    status = Kvm.query.filter(Kvm.test_id == test.id).first()
+    if status is None or len(test.progress) == 0:
+        log.info('Test {id} is being started, not preempting it'.format(id=test.id))
+        return False
+
+    conn = libvirt.open("qemu:///system")
+    if conn is None:
+        log.critical("Couldn't open connection to libvirt to preempt test {id}!".format(id=test.id))
+        return False
+    try:
+        stop_test_vms(db, conn, test)
+    finally:
+        conn.close()
+    return True
 
 
 def inform_mailing_list(mailer, id, title, author, body) -> None:
@@ -623,7 +817,12 @@ def start_ci():
                     )
                     return 'ERROR'
 
-                queue_test(g.db, gh_commit, commit, TestType.pull_request, pr_nr=pr_nr)
+                cancel_superseded_tests(g.db, pr_nr, commit)
+                if Test.query.filter(Test.test_type == TestType.pull_request, Test.pr_nr == pr_nr,
+                                     Test.commit == commit, Test.queue_state != TestQueueState.finished).count() > 0:
+                    g.log.info('Tests of PR #{pr_nr} at {commit} are already queued'.format(pr_nr=pr_nr, commit=commit))
+                else:
+                    queue_test(g.db, gh_commit, commit, TestType.pull_request, pr_nr=pr_nr)
 
             elif payload['action'] == 'closed':
                 g.log.debug('PR was closed, no after hash available')
@@ -635,12 +834,10 @@ def start_ci():
                         continue
                     progress = TestProgress(test.id, TestStatus.canceled, "PR closed", datetime.datetime.now())
                     g.db.add(progress)
-                    repository.statuses(test.commit).post(
-                        state=Status.FAILURE,
-                        description="Tests canceled",
-                        context="CI - {name}".format(name=test.platform.value),
-                        target_url=url_for('test.by_id', test_id=test.id, _external=True)
-                    )
+                    test.queue_state = TestQueueState.finished
+                    g.db.commit()
+                    queue_test_status(g.db, test, Status.FAILURE, "Tests canceled")
+                publish_github_events(g.db, g.log, {test.commit for test in tests})
 
         elif event == "issues":
             g.log.debug('issues event detected')
@@ -712,6 +909,7 @@ def start_ci():
                 g.db.query(RegressionTest.expected_rc).filter(
                     RegressionTest.id == test_result.c.regression_test_id
                 ).values(test_result.c.expected_rc)
+                bump_suite_revision(g.db)
                 g.db.commit()
                 g.log.info("successfully added tests for latest release!")
             else:
@@ -748,8 +946,9 @@ def update_build_badge(status, test) -> None:
         return
 
 
-@mod_ci.route('/progress-reporter/<test_id>/<token>', methods=['POST'])
-def progress_reporter(test_id, token):
+@mod_ci.route('/progress-reporter/<test_id>/<token>', methods=['POST'], defaults={'shard': None})
+@mod_ci.route('/progress-reporter/<test_id>/<token>/<int:shard>', methods=['POST'])
+def progress_reporter(test_id, token, shard=None):
     """
     Handle the progress of a certain test after validating the token. If necessary, update the status on GitHub.
 
@@ -757,6 +956,8 @@ def progress_reporter(test_id, token):
     :type test_id: int
     :param token: The token to check the validity of the request.
     :type token: str
+    :param shard: The number of the shard reporting, None if the test isn't sharded.
+    :type shard: int
     :return: Nothing.
     :rtype: None
     """
@@ -769,7 +970,7 @@ def progress_reporter(test_id, token):
         if 'type' in request.form:
             if request.form['type'] == 'progress':
                 log.info('progress method triggered by progress_reporter')
-                ret_val = progress_type_request(log, test, test_id, request)
+                ret_val = progress_type_request(log, test, test_id, request, shard)
                 if ret_val == "FAIL":
                     return "FAIL"
 
@@ -779,7 +980,7 @@ def progress_reporter(test_id, token):
 
             elif request.form['type'] == 'logupload':
                 log.info('logupload method triggered by progress_reporter')
-                ret_val = logupload_type_request(log, test_id, repo_folder, test, request)
+                ret_val = logupload_type_request(log, test_id, repo_folder, test, request, shard)
                 if ret_val == "EMPTY":
                     return "EMPTY"
 
@@ -793,15 +994,23 @@ def progress_reporter(test_id, token):
                 log.info('finish method triggered by progress_reporter')
                 finish_type_request(log, test_id, test, request)
 
+            elif request.form['type'] == 'batch':
+                log.info('batch method triggered by progress_reporter')
+                ret_val = batch_type_request(log, test_id, test, request)
+                if ret_val == "FAIL":
+                    return "FAIL"
+
             return "OK"
 
     return "FAIL"
 
 
-def progress_type_request(log, test, test_id, request):
+def progress_type_request(log, test, test_id, request, shard=None):
     """
     Handle progress updates for progress reporter.
 
+    The progress of a shard is merged into the progress of its test, see merge_shard_progress.
+
     :param log: logger
     :type log: Logger
     :param test: concerned test
@@ -810,6 +1019,8 @@ def progress_type_request(log, test, test_id, request):
     :type test_id: int
     :param request: Request parameters
     :type request: Request
+    :param shard: The number of the shard reporting, None if the test isn't sharded.
+    :type shard: int
     """
     # Progress, log
     status = TestStatus.from_string(request.form['status'])
@@ -817,8 +1028,18 @@ def progress_type_request(log, test, test_id, request):
     istatus = TestStatus.progress_step(status)
     message = request.form['message']
 
-    if len(test.progress) != 0:
-        laststatus = TestStatus.progress_step(test.progress[-1].status)
+    test_shard = None
+    last_progress = test.progress[-1].status if len(test.progress) != 0 else None
+    if shard is not None:
+        test_shard = next((test_shard for test_shard in test.shards if test_shard.number == shard), None)
+        if test_shard is None or test_shard.queue_state == TestQueueState.finished or \
+                last_progress in [TestStatus.completed, TestStatus.canceled]:
+            return "FAIL"
+        # The steps of a shard follow each other, whatever the other shards reached
+        last_progress = test_shard.status
+
+    if last_progress is not None:
+        laststatus = TestStatus.progress_step(last_progress)
 
         if laststatus in [TestStatus.completed, TestStatus.canceled]:
             return "FAIL"
@@ -829,7 +1050,7 @@ def progress_type_request(log, test, test_id, request):
 
         if laststatus < istatus:
             # get KVM start time for finding KVM preparation time
-            kvm_entry = Kvm.query.filter(Kvm.test_id == test_id).first()
+            kvm_entry = Kvm.query.filter(Kvm.test_id == test_id, Kvm.shard == (shard or 0)).first()
 
             if status == TestStatus.building:
                 log.info('test preparation finished')
@@ -851,12 +1072,30 @@ def progress_type_request(log, test, test_id, request):
                 time_diff = (build_finish_time - kvm_entry.timestamp_prep_finished).total_seconds()
                 set_avg_time(test.platform, "build", time_diff)
 
+    if test_shard is not None:
+        merged = merge_shard_progress(test, test_shard, status, message)
+        if merged is None:
+            if test_shard.queue_state == TestQueueState.finished:
+                # This shard is done before the others, so its VM can run the next test
+                log.debug("Shard {shard} of test {id} has been completed".format(shard=shard, id=test_id))
+                Kvm.query.filter(Kvm.test_id == test_id, Kvm.shard == shard).delete()
+                g.db.commit()
+                gh = GitHub(access_token=g.github['bot_token'])
+                repository = gh.repos(g.github['repository_owner'])(g.github['repository'])
+                start_platforms(g.db, repository, 60, test.platform)
+            else:
+                g.db.commit()
+            return None
+        status, message = merged
+
     progress = TestProgress(test.id, status, message)
     g.db.add(progress)
+    if status in [TestStatus.completed, TestStatus.canceled]:
+        test.queue_state = TestQueueState.finished
+        for other in test.shards:
+            other.queue_state = TestQueueState.finished
     g.db.commit()
 
-    gh = GitHub(access_token=g.github['bot_token'])
-    repository = gh.repos(g.github['repository_owner'])(g.github['repository'])
     # Store the test commit for testing in case of commit
     if status == TestStatus.completed and check_main_repo(test.fork.github):
         commit_name = 'fetch_commit_' + test.platform.value
@@ -872,50 +1111,7 @@ def progress_type_request(log, test, test_id, request):
     # If status is complete, remove the Kvm entry
     if status in [TestStatus.completed, TestStatus.canceled]:
         log.debug("Test {id} has been {status}".format(id=test_id, status=status))
-        var_average = 'average_time_' + test.platform.value
-        current_average = GeneralData.query.filter(GeneralData.key == var_average).first()
-        average_time = 0
-        total_time = 0
-
-        if current_average is None:
-            platform_tests = g.db.query(Test.id).filter(Test.platform == test.platform).subquery()
-            finished_tests = g.db.query(TestProgress.test_id).filter(
-                and_(
-                    TestProgress.status.in_([TestStatus.canceled, TestStatus.completed]),
-                    TestProgress.test_id.in_(platform_tests)
-                )
-            ).subquery()
-            in_progress_statuses = [TestStatus.preparation, TestStatus.completed, TestStatus.canceled]
-            finished_tests_progress = g.db.query(TestProgress).filter(
-                and_(
-                    TestProgress.test_id.in_(finished_tests),
-                    TestProgress.status.in_(in_progress_statuses)
-                )
-            ).subquery()
-            times = g.db.query(
-                finished_tests_progress.c.test_id,
-                label('time', func.group_concat(finished_tests_progress.c.timestamp))
-            ).group_by(finished_tests_progress.c.test_id).all()
-
-            for p in times:
-                parts = p.time.split(',')
-                start = datetime.datetime.strptime(parts[0], '%Y-%m-%d %H:%M:%S')
-                end = datetime.datetime.strptime(parts[-1], '%Y-%m-%d %H:%M:%S')
-                total_time += (end - start).total_seconds()
-
-            if len(times) != 0:
-                average_time = total_time // len(times)
-
-            new_avg = GeneralData(var_average, average_time)
-            log.info(f'new average time {str(average_time)} set successfully')
-            g.db.add(new_avg)
-            g.db.commit()
-
-        else:
-            all_results = TestResult.query.count()
-            regression_test_count = RegressionTest.query.count()
-            number_test = all_results / regression_test_count
-            updated_average = float(current_average.value) * (number_test - 1)
+        if status == TestStatus.completed:
             pr = test.progress_data()
             end_time = pr['end']
             start_time = pr['start']
@@ -926,22 +1122,18 @@ def progress_type_request(log, test, test_id, request):
             if start_time.tzinfo is not None:
                 start_time = start_time.replace(tzinfo=None)
 
-            last_running_test = end_time - start_time
-            updated_average = updated_average + last_running_test.total_seconds()
-            current_average.value = updated_average // number_test
-            g.db.commit()
-            log.info(f'average time updated to {str(current_average.value)}')
-
-        kvm = Kvm.query.filter(Kvm.test_id == test_id).first()
+            set_avg_time(test.platform, "test", (end_time - start_time).total_seconds())
 
-        if kvm is not None:
+        # The VMs of the other shards of a canceled test are reset when they look for their next test
+        for kvm in Kvm.query.filter(Kvm.test_id == test_id).all():
             log.debug("Removing KVM entry")
             g.db.delete(kvm)
-            g.db.commit()
+        g.db.commit()
 
     # Post status update
     state = Status.PENDING
     target_url = url_for('test.by_id', test_id=test.id, _external=True)
+    targets = [test.commit]
     context = "CI - {name}".format(name=test.platform.value)
 
     if status == TestStatus.canceled:
@@ -981,19 +1173,19 @@ def progress_type_request(log, test, test_id, request):
             message = 'Tests completed'
         if test.test_type == TestType.pull_request:
             comment_pr(test.id, state, test.pr_nr, test.platform.name)
+            targets.append(test.pr_nr)
         update_build_badge(state, test)
 
     else:
         message = progress.message
 
-    gh_commit = repository.statuses(test.commit)
-    try:
-        gh_commit.post(state=state, description=message, context=context, target_url=target_url)
-    except ApiError as a:
-        log.error('Got an exception while posting to GitHub! Message: {message}'.format(message=a.message))
+    queue_status(g.db, test.commit, state, message, context, target_url)
+    publish_github_events(g.db, log, targets)
 
     if status in [TestStatus.completed, TestStatus.canceled]:
         # Start next test if necessary, on the same platform
+        gh = GitHub(access_token=g.github['bot_token'])
+        repository = gh.repos(g.github['repository_owner'])(g.github['repository'])
         start_platforms(g.db, repository, 60, test.platform)
 
 
@@ -1024,7 +1216,7 @@ def equality_type_request(log, test_id, test, request):
         g.db.commit()
 
 
-def logupload_type_request(log, test_id, repo_folder, test, request):
+def logupload_type_request(log, test_id, repo_folder, test, request, shard=None):
     """
     Handle logupload request type for progress reporter.
 
@@ -1038,6 +1230,8 @@ def logupload_type_request(log, test_id, repo_folder, test, request):
     :type test: Test
     :param request: Request parameters
     :type request: Request
+    :param shard: The number of the shard uploading its log, None if the test isn't sharded.
+    :type shard: int
     """
     log.debug("Received log file for test {id}".format(id=test_id))
     # File upload, process
@@ -1052,7 +1246,14 @@ def logupload_type_request(log, test_id, repo_folder, test, request):
         uploaded_file.save(temp_path)
         final_path = os.path.join(repo_folder, 'LogFiles', '{id}{ext}'.format(id=test.id, ext='.txt'))
 
-        os.rename(temp_path, final_path)
+        if shard is None:
+            os.rename(temp_path, final_path)
+        else:
+            # The shards of a test share its log file
+            with open(temp_path, 'rb') as shard_log, open(final_path, 'ab') as test_log:
+                test_log.write('===== Shard {shard} =====\n'.format(shard=shard).encode())
+                shutil.copyfileobj(shard_log, test_log)
+            os.remove(temp_path)
         log.debug("Stored log file")
 
 
@@ -1071,6 +1272,8 @@ def upload_type_request(log, test_id, repo_folder, test, request):
     :param request: Request parameters
     :type request: Request
     """
+    from run import config
+
     log.debug('Upload for {t}/{rt}/{rto}'.format(
         t=test_id, rt=request.form['test_id'], rto=request.form['test_file_id'])
     )
@@ -1081,25 +1284,22 @@ def upload_type_request(log, test_id, repo_folder, test, request):
         if filename is '':
             log.warning('empty filename provided for uploading')
             return 'EMPTY'
-        temp_path = os.path.join(repo_folder, 'TempFiles', filename)
-        # Save to temporary location
-        uploaded_file.save(temp_path)
-        # Get hash and check if it's already been submitted
-        hash_sha256 = hashlib.sha256()
-        with open(temp_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        file_hash = hash_sha256.hexdigest()
         filename, file_extension = os.path.splitext(filename)
-        final_path = os.path.join(
-            repo_folder, 'TestResults', '{hash}{ext}'.format(hash=file_hash, ext=file_extension)
-        )
-        os.rename(temp_path, final_path)
+        # Hash the upload while it's received, and only write it if no identical result is stored yet. The results
+        # of commits of the main repository can become the baseline, which the VMs read, so they stay uncompressed.
+        baseline_candidate = test.test_type == TestType.commit and check_main_repo(test.fork.github)
+        file_hash, written = store_upload(uploaded_file.stream, result_store_from_config(config),
+                                          os.path.join(repo_folder, 'TempFiles'), file_extension,
+                                          compress=not baseline_candidate)
+        if not written:
+            log.debug('Result {hash}{ext} is stored already'.format(hash=file_hash, ext=file_extension))
         rto = RegressionTestOutput.query.filter(
             RegressionTestOutput.id == request.form['test_file_id']).first()
         result_file = TestResultFile(test.id, request.form['test_id'], rto.id, rto.correct, file_hash)
         g.db.add(result_file)
         g.db.commit()
+        if queue_diffs(config, result_file):
+            log.debug('queued diffs of {t}/{rt}/{rto}'.format(t=test_id, rt=result_file.regression_test_id, rto=rto.id))
 
 
 def finish_type_request(log, test_id, test, request):
@@ -1126,45 +1326,107 @@ def finish_type_request(log, test_id, test, request):
         g.db.commit()
     except IntegrityError as e:
         log.error('Could not save the results: {msg}'.format(msg=e))
+    report_impacted_tests(log, test)
+
+
+def batch_type_request(log, test_id, test, request):
+    """
+    Handle batch request type for progress reporter.
+
+    The records (see mod_ci.ingest) are posted in the records field, or as an uploaded file.
+
+    :param log: logger
+    :type log: Logger
+    :param test_id: The id of the test to update.
+    :type test_id: int
+    :param test: concerned test
+    :type test: Test
+    :param request: Request parameters
+    :type request: Request
+    """
+    try:
+        if 'file' in request.files:
+            records = parse_records(request.files['file'].read().decode('utf-8'))
+        else:
+            records = parse_records(request.form.get('records', ''))
+    except ValueError as e:
+        log.error('Invalid batch for test {id}: {error}'.format(id=test_id, error=e))
+        return "FAIL"
+    stored = store_records(g.db, test.id, records)
+    log.debug('Batch for {t}: stored {stored} of {count} records'.format(t=test_id, stored=stored, count=len(records)))
+    if any(record['type'] == 'finish' for record in records):
+        report_impacted_tests(log, test)
+
+
+def report_impacted_tests(log, test) -> None:
+    """
+    Post the results of the regression tests a test most likely impacts to GitHub, once they all finished.
+
+    The other regression tests keep running, so the status stays pending.
+
+    :param log: logger
+    :type log: Logger
+    :param test: concerned test
+    :type test: Test
+    """
+    selection = test.selection
+    if selection is None or selection.reported:
+        return
+    selected = selection.get_regression_ids()
+    finished = g.db.query(count(TestResult.regression_test_id)).filter(
+        TestResult.test_id == test.id,
+        TestResult.regression_test_id.in_(selected)
+    ).scalar()
+    if finished < len(selected):
+        return
+    failed = set(regression_id for _, regression_id in failed_regression_tests(g.db, [test.id]))
+    failed_selected = len(failed.intersection(selected))
+    selection.reported = True
+    g.db.commit()
+
+    if failed_selected > 0:
+        message = '{failed} of the {total} tests most likely impacted failed, running the rest'.format(
+            failed=failed_selected, total=len(selected))
+    else:
+        message = 'The {total} tests most likely impacted passed, running the rest'.format(total=len(selected))
+    queue_test_status(g.db, test, Status.PENDING, message)
+    publish_github_events(g.db, log, [test.commit])
 
 
 def set_avg_time(platform: Test.platform, process_type: str, time_taken: int) -> None:
     """
-    Set average platform preparation time.
+    Add the time a phase of a test took to the statistics of its platform.
 
     :param platform: platform to which the average time belongs
     :type platform: TestPlatform
-    :param process_type: process to save the average time for
+    :param process_type: phase to save the time for, 'prep', 'build' or 'test'
     :type process_type: str
     :param time_taken: time taken to complete the process
     :type time_taken: int
     """
-    val_key = "avg_" + str(process_type) + "_time_" + platform.value
-    count_key = "avg_" + str(process_type) + "_count_" + platform.value
-
-    current_avg_count = GeneralData.query.filter(GeneralData.key == count_key).first()
+    query = PlatformStats.query.filter(PlatformStats.platform == platform, PlatformStats.phase == process_type)
+    stats = query.with_for_update().first()
 
     # adding average data the first time
-    if current_avg_count is None:
-        avg_count_GD = GeneralData(count_key, str(1))
-        avg_time_GD = GeneralData(val_key, str(time_taken))
-        g.db.add(avg_count_GD)
-        g.db.add(avg_time_GD)
-
-    else:
-        current_average = GeneralData.query.filter(GeneralData.key == val_key).first()
-        avg_count = int(current_avg_count.value)
-        avg_value = int(float(current_average.value))
-        new_average = ((avg_value * avg_count) + time_taken) / (avg_count + 1)
-        current_avg_count.value = str(avg_count + 1)
-        current_average.value = str(new_average)
+    if stats is None:
+        stats = PlatformStats(platform, process_type)
+        g.db.add(stats)
+        stats.add(time_taken)
+        try:
+            g.db.commit()
+            return
+        except SQLAlchemyIntegrityError:
+            # Another test of the platform added them in the meantime, add the time to those instead
+            g.db.rollback()
+            stats = query.with_for_update().one()
 
+    stats.add(time_taken)
     g.db.commit()
 
 
 def comment_pr(test_id, state, pr_nr, platform) -> None:
     """
-    Upload the test report to the github PR as comment.
+    Queue the test report for the github PR, as a comment replacing the previous report of the platform.
 
     :param test_id: The identity of Test whose report will be uploaded
     :type test_id: str
@@ -1205,28 +1467,47 @@ def comment_pr(test_id, state, pr_nr, platform) -> None:
     message = template.render(tests=tot, failed_tests=regression_testid_failed, test_id=test_id,
                               state=state, platform=platform)
     log.debug('Github PR Comment Message Created for Test_id: {test_id}'.format(test_id=test_id))
-    try:
-        gh = GitHub(access_token=g.github['bot_token'])
-        repository = gh.repos(g.github['repository_owner'])(g.github['repository'])
-        # Pull requests are just issues with code, so github consider pr comments in issues
-        pull_request = repository.issues(pr_nr)
-        comments = pull_request.comments().get()
-        bot_name = g.github['bot_name']
-        comment_id = None
-        for comment in comments:
-            if comment['user']['login'] == bot_name and platform in comment['body']:
-                comment_id = comment['id']
-                break
-        log.debug('Github PR Comment ID Fetched for Test_id: {test_id}'.format(test_id=test_id))
-        if comment_id is None:
-            comment = pull_request.comments().post(body=message)
-            comment_id = comment['id']
-        else:
-            repository.issues().comments(comment_id).post(body=message)
-        log.debug('Github PR Comment ID {comment} Uploaded for Test_id: {test_id}'.format(
-            comment=comment_id, test_id=test_id))
-    except Exception as e:
-        log.error('Github PR Comment Failed for Test_id: {test_id} with Exception {e}'.format(test_id=test_id, e=e))
+    queue_comment(g.db, pr_nr, platform, message)
+    log.debug('Github PR Comment queued for Test_id: {test_id}'.format(test_id=test_id))
+
+
+def queue_test_status(db, test, state, description) -> None:
+    """
+    Queue the status of a test for its commit, replacing the one waiting for the platform of the test.
+
+    Every status of a test goes through the queue, so an older one can't be delivered after a newer one.
+
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: the test
+    :type test: Test
+    :param state: state of the status
+    :type state: str
+    :param description: description of the status
+    :type description: str
+    """
+    queue_status(db, test.commit, state, description, "CI - {name}".format(name=test.platform.value),
+                 url_for('test.by_id', test_id=test.id, _external=True))
+
+
+def publish_github_events(db, log, targets) -> None:
+    """
+    Deliver the statuses and comments a request queued to GitHub straight away, unless the publisher does.
+
+    Only the events of the given commits and pull requests are delivered; the cron retries the others.
+
+    :param db: Database connection.
+    :type db: sqlalchemy.orm.scoped_session
+    :param log: logger
+    :type log: Logger
+    :param targets: the commits and pull request numbers the request queued statuses or comments for
+    :type targets: list
+    """
+    from run import config, get_github_config
+    if config.get('GITHUB_PUBLISHER', False):
+        return
+    github_config = get_github_config(config)
+    deliver_due(db, client_from_config(github_config), github_config['bot_name'], log, targets=targets)
 
 
 @mod_ci.route('/show_maintenance')
@@ -1237,11 +1518,14 @@ def show_maintenance():
     """
     Get list of Virtual Machines under maintenance.
 
-    :return: platforms in maintenance
+    :return: platforms in maintenance, and the metrics of the scheduler if it runs
     :rtype: dict
     """
+    from run import config
+
     return {
-        'platforms': MaintenanceMode.query.all()
+        'platforms': MaintenanceMode.query.all(),
+        'scheduler': scheduler_metrics(config)
     }
 
 
@@ -1299,17 +1583,10 @@ def blocked_users():
                         continue
                     progress = TestProgress(test.id, TestStatus.canceled, "PR closed", datetime.datetime.now())
                     g.db.add(progress)
+                    test.queue_state = TestQueueState.finished
                     g.db.commit()
-                    try:
-                        repository.statuses(test.commit).post(
-                            state=Status.FAILURE,
-                            description="Tests canceled since user blacklisted",
-                            context="CI - {name}".format(name=test.platform.value),
-                            target_url=url_for('test.by_id', test_id=test.id, _external=True)
-                        )
-                    except ApiError as a:
-                        g.log.error('Got an exception while posting to GitHub! Message: {message}'.format(
-                            message=a.message))
+                    queue_test_status(g.db, test, Status.FAILURE, "Tests canceled since user blacklisted")
+                publish_github_events(g.db, g.log, {test.commit for test in tests})
         except ApiError as a:
             g.log.error('Pull Requests of Blocked User could not be fetched: {res}'.format(res=a.response))
 
@@ -1336,6 +1613,70 @@ def blocked_users():
     }
 
 
+@mod_ci.route('/queue_priority', methods=['GET', 'POST'])
+@login_required
+@check_access_rights([Role.admin])
+@template_renderer()
+def queue_priority():
+    """
+    Render the queue_priority template.
+
+    This returns the weights the priority of queued tests is computed from, the overridden fork weights and the queued
+    tests in the order they'll run. Also defines processing of the forms to change the weights, which apply to the tests
+    queued from then on.
+    """
+    weights = load_weights(g.db)
+    names = {
+        'commit': type_key(TestType.commit),
+        'pull_request': type_key(TestType.pull_request),
+        'main_fork': MAIN_FORK,
+        'other_forks': OTHER_FORKS,
+        'fair_share': FAIR_SHARE,
+        'aging': AGING
+    }
+
+    weights_form = QueueWeightsForm()
+    if weights_form.save.data and weights_form.validate_on_submit():
+        for field, name in names.items():
+            g.db.merge(QueueWeight(name, getattr(weights_form, field).data))
+        g.db.commit()
+        flash('Weights saved.')
+        return redirect(url_for('.queue_priority'))
+    if not weights_form.is_submitted():
+        for field, name in names.items():
+            getattr(weights_form, field).data = weights[name]
+
+    fork_form = ForkWeightForm()
+    if fork_form.set_fork.data and fork_form.validate_on_submit():
+        if Fork.query.filter(Fork.id == fork_form.fork_id.data).first() is None:
+            flash('No such fork.')
+            return redirect(url_for('.queue_priority'))
+        name = fork_key(fork_form.fork_id.data)
+        if fork_form.weight.data is None:
+            QueueWeight.query.filter(QueueWeight.name == name).delete()
+            flash('Fork weight removed.')
+        else:
+            g.db.merge(QueueWeight(name, fork_form.weight.data))
+            flash('Fork weight saved.')
+        g.db.commit()
+        return redirect(url_for('.queue_priority'))
+
+    fork_weights = []
+    for fork in Fork.query.order_by(Fork.id).all():
+        if fork_key(fork.id) in weights:
+            fork_weights.append((fork, weights[fork_key(fork.id)]))
+
+    queued = Test.query.filter(Test.queue_state == TestQueueState.queued).order_by(
+        Test.platform, Test.priority.desc(), Test.id.asc()).all()
+
+    return {
+        'weightsForm': weights_form,
+        'forkForm': fork_form,
+        'fork_weights': fork_weights,
+        'queued': queued
+    }
+
+
 @mod_ci.route('/toggle_maintenance/<platform>/<status>')
 @login_required
 @check_access_rights([Role.admin])
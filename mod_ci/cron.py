@@ -11,22 +11,32 @@ sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
 def cron(testing=False):
     """Script to run from cron for Sampleplatform."""
     from mod_ci.controllers import start_platforms, kvm_processor, TestPlatform
+    from mod_ci.mirror import mirror_from_config
+    from mod_ci.publisher import client_from_config, deliver_due
+    from mod_ci.scheduler import kvm_names
     from flask import current_app
-    from run import config, log
+    from run import config, log, get_github_config
     from database import create_session
     from github import GitHub
 
     log.info('Run the cron for kicking off CI platform(s).')
+    # Keep the mirror up to date, so the VMs check out their tests locally
+    if not mirror_from_config(config).update():
+        log.error('Could not update the mirror of the repository')
     # Create session
     db = create_session(config['DATABASE_URI'])
     gh = GitHub(access_token=config['GITHUB_TOKEN'])
     repository = gh.repos(config['GITHUB_OWNER'])(config['GITHUB_REPOSITORY'])
 
     if testing is True:
-        kvm_processor(current_app._get_current_object(), db, config.get('KVM_LINUX_NAME', ''), TestPlatform.linux,
-                      repository, None)
+        kvm_name = (kvm_names(config, TestPlatform.linux) or [''])[0]
+        kvm_processor(current_app._get_current_object(), db, kvm_name, TestPlatform.linux, repository, None)
     else:
         start_platforms(db, repository)
+        if not config.get('GITHUB_PUBLISHER', False):
+            # Retry the statuses and comments for GitHub the requests failed to deliver
+            github_config = get_github_config(config)
+            deliver_due(db, client_from_config(github_config), github_config['bot_name'], log)
 
 
 cron()
@@ -2,7 +2,8 @@
 
 from flask_wtf import FlaskForm
 from wtforms import IntegerField, StringField, SubmitField
-from wtforms.validators import DataRequired
+from wtforms.validators import (DataRequired, InputRequired, NumberRange,
+                                Optional)
 
 
 class AddUsersToBlacklist(FlaskForm):
@@ -18,3 +19,29 @@ class RemoveUsersFromBlacklist(FlaskForm):
 
     user_id = IntegerField('User ID', [DataRequired(message='GitHub User ID not filled in')])
     remove = SubmitField('Remove User')
+
+
+class QueueWeightsForm(FlaskForm):
+    """Form to set the weights of the queue priority."""
+
+    commit = IntegerField('Commit', [InputRequired(message='Weight of commit tests not filled in')])
+    pull_request = IntegerField('Pull Request', [InputRequired(message='Weight of pull request tests not filled in')])
+    main_fork = IntegerField('Main repository', [InputRequired(message='Weight of the main repository not filled in')])
+    other_forks = IntegerField('Other forks', [InputRequired(message='Weight of the other forks not filled in')])
+    fair_share = IntegerField('Fair share (per waiting test of the same fork)', [
+        InputRequired(message='Fair share weight not filled in'),
+        NumberRange(min=0, message='Fair share weight can not be negative')
+    ])
+    aging = IntegerField('Aging (minutes per unit of weight)', [
+        InputRequired(message='Aging not filled in'),
+        NumberRange(min=1, message='Aging must be at least one minute')
+    ])
+    save = SubmitField('Save Weights')
+
+
+class ForkWeightForm(FlaskForm):
+    """Form to override the weight of a fork."""
+
+    fork_id = IntegerField('Fork ID', [DataRequired(message='Fork ID not filled in')])
+    weight = IntegerField('Weight (empty to use the default)', [Optional()])
+    set_fork = SubmitField('Set Fork Weight')
@@ -0,0 +1,195 @@
+"""
+Select the regression tests a change most likely impacts, from the history of the tests that changed the same files.
+
+Every test records the source files it changes. A regression test scores, for every file a change touches, the share
+of the earlier tests changing that file it failed in (crashed, or gave another output than expected). The regression
+tests with the highest score run first, in a file of their own, and their results are posted to GitHub as soon as they
+all finished; the other regression tests run after them.
+"""
+
+from typing import Dict, Iterable, List, Set, Tuple
+
+from git import GitCommandError
+from sqlalchemy.exc import IntegrityError
+
+from mod_regression.models import RegressionTest
+from mod_test.models import (Test, TestChangedFile, TestQueueState, TestResult,
+                             TestResultFile, TestSelection, TestType)
+
+# number of earlier tests changing the same files the score is computed from
+HISTORY_LIMIT = 500
+
+
+def changed_files(repo, test) -> List[str]:
+    """
+    Get the source files a test changes, from the repository checked out for it.
+
+    :param repo: the repository, with the change checked out
+    :type repo: git.Repo
+    :param test: the test
+    :type test: Test
+    :return: the paths of the changed files
+    :rtype: List[str]
+    """
+    try:
+        if test.test_type == TestType.pull_request:
+            # The pull request is merged on master
+            diff = repo.git.diff('--name-only', 'master', 'HEAD')
+        else:
+            diff = repo.git.diff('--name-only', '{commit}~1'.format(commit=test.commit), test.commit)
+    except GitCommandError:
+        return []
+    return sorted(set(path for path in diff.splitlines() if path != ''))
+
+
+def record_changed_files(db, test, repo) -> None:
+    """
+    Store the source files a test changes, unless they're stored already.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: the test
+    :type test: Test
+    :param repo: the repository, with the change checked out
+    :type repo: git.Repo
+    """
+    if len(test.changed_files) > 0:
+        return
+    db.add_all([TestChangedFile(test.id, path) for path in changed_files(repo, test)])
+    try:
+        db.commit()
+    except IntegrityError:
+        # stored by the VM of another shard of the test in the meantime
+        db.rollback()
+
+
+def failed_regression_tests(db, test_ids: Iterable[int]) -> Set[Tuple[int, int]]:
+    """
+    Get the regression tests that failed in tests, because they crashed or gave another output than expected.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test_ids: ids of the tests
+    :type test_ids: Iterable[int]
+    :return: the (test id, regression test id) pairs that failed
+    :rtype: set
+    """
+    test_ids = list(test_ids)
+    if len(test_ids) == 0:
+        return set()
+    crashes = db.query(TestResult.test_id, TestResult.regression_test_id).filter(
+        TestResult.test_id.in_(test_ids),
+        TestResult.exit_code != TestResult.expected_rc
+    ).all()
+    mismatches = db.query(TestResultFile.test_id, TestResultFile.regression_test_id).join(
+        RegressionTest, RegressionTest.id == TestResultFile.regression_test_id
+    ).filter(
+        TestResultFile.test_id.in_(test_ids),
+        TestResultFile.got.isnot(None),
+        RegressionTest.expected_rc == 0
+    ).distinct().all()
+    return set((test_id, regression_id) for test_id, regression_id in crashes + mismatches)
+
+
+def failure_history(db, test) -> Tuple[Dict[str, int], Dict[str, Dict[int, int]]]:
+    """
+    Get how often the regression tests failed in the earlier tests changing the same files as a test.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: the test
+    :type test: Test
+    :return: the number of earlier tests by file, and the number of them each regression test failed in by file
+    :rtype: tuple
+    """
+    paths = [changed.path for changed in test.changed_files]
+    if len(paths) == 0:
+        return {}, {}
+    earlier = db.query(TestChangedFile.test_id).join(Test, Test.id == TestChangedFile.test_id).filter(
+        Test.platform == test.platform,
+        Test.queue_state == TestQueueState.finished,
+        Test.id != test.id,
+        TestChangedFile.path.in_(paths)
+    ).distinct().order_by(TestChangedFile.test_id.desc()).limit(HISTORY_LIMIT).subquery()
+    changes = db.query(TestChangedFile.path, TestChangedFile.test_id).filter(
+        TestChangedFile.path.in_(paths),
+        TestChangedFile.test_id.in_(db.query(earlier.c.test_id))
+    ).all()
+
+    failed = {}  # type: Dict[int, List[int]]
+    for test_id, regression_id in failed_regression_tests(db, set(test_id for _, test_id in changes)):
+        failed.setdefault(test_id, []).append(regression_id)
+
+    runs = {}  # type: Dict[str, int]
+    failures = {}  # type: Dict[str, Dict[int, int]]
+    for path, test_id in changes:
+        runs[path] = runs.get(path, 0) + 1
+        path_failures = failures.setdefault(path, {})
+        for regression_id in failed.get(test_id, []):
+            path_failures[regression_id] = path_failures.get(regression_id, 0) + 1
+    return runs, failures
+
+
+def impact_scores(runs: Dict[str, int], failures: Dict[str, Dict[int, int]]) -> Dict[int, float]:
+    """
+    Score the regression tests by how likely a change impacts them.
+
+    :param runs: the number of earlier tests by changed file
+    :type runs: dict
+    :param failures: the number of earlier tests each regression test failed in, by changed file
+    :type failures: dict
+    :return: the score of every regression test that failed before, by regression test id
+    :rtype: dict
+    """
+    scores = {}  # type: Dict[int, float]
+    for path, path_failures in failures.items():
+        for regression_id, count in path_failures.items():
+            scores[regression_id] = scores.get(regression_id, 0.0) + count / runs[path]
+    return scores
+
+
+def rank_impacted(scores: Dict[int, float], size: int) -> List[int]:
+    """
+    Get the regression tests with the highest scores.
+
+    :param scores: the score by regression test id
+    :type scores: dict
+    :param size: the number of regression tests to select at most
+    :type size: int
+    :return: the ids of the selected regression tests, the highest score first
+    :rtype: List[int]
+    """
+    return sorted(scores, key=lambda regression_id: (-scores[regression_id], regression_id))[:size]
+
+
+def select_impacted_tests(db, test, size: int) -> List[int]:
+    """
+    Select the regression tests a pull request most likely impacts, once for all the VMs running it.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: the test, with its changed files recorded
+    :type test: Test
+    :param size: the number of regression tests to select at most, 0 to select none
+    :type size: int
+    :return: the ids of the selected regression tests, the most likely impacted one first
+    :rtype: List[int]
+    """
+    if size <= 0 or test.test_type != TestType.pull_request:
+        return []
+    selection = test.selection
+    if selection is None:
+        in_scope = set(test.get_customized_regressiontests())
+        scores = impact_scores(*failure_history(db, test))
+        selected = rank_impacted({key: value for key, value in scores.items() if key in in_scope}, size)
+        if len(selected) == 0:
+            return []
+        selection = TestSelection(test.id, selected)
+        db.add(selection)
+        try:
+            db.commit()
+        except IntegrityError:
+            # stored by the VM of another shard of the test in the meantime, which all shards use
+            db.rollback()
+            selection = db.query(TestSelection).filter(TestSelection.test_id == test.id).one()
+    return selection.get_regression_ids()
@@ -0,0 +1,164 @@
+"""
+Bulk ingestion of the results the CI test runner reports in batches.
+
+Instead of a request per regression test, the runner can post many ``equality`` and ``finish`` records at once, as a
+JSON array or as newline delimited JSON (one object per line). A record holds the same fields as the form of the
+single requests. All new results of a batch are inserted with one statement per table, in a single transaction.
+Results stored already (by an earlier attempt of the same batch, or by single requests) are skipped, so the runner
+can safely post a batch again when it didn't get an answer.
+"""
+
+import json
+from typing import Any, Dict, List, Set, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from mod_regression.models import RegressionTest, RegressionTestOutput
+from mod_test.models import TestResult, TestResultFile
+
+# types of the records a batch can hold
+RECORD_TYPES = ['equality', 'finish']
+
+# fields every type of record needs
+RECORD_FIELDS = {
+    'equality': ['test_id', 'test_file_id'],
+    'finish': ['test_id', 'runTime', 'exitCode'],
+}
+
+
+def parse_records(payload: str) -> List[Dict[str, Any]]:
+    """
+    Parse the records of a batch.
+
+    :param payload: a JSON array of records, or a record per line
+    :type payload: str
+    :raises ValueError: if the payload isn't valid JSON, or a record has an unknown type or misses a field
+    :return: the records, with their fields converted to numbers
+    :rtype: List[dict]
+    """
+    payload = payload.strip()
+    if payload.startswith('['):
+        records = json.loads(payload)
+    else:
+        records = [json.loads(line) for line in payload.splitlines() if line.strip() != '']
+    for record in records:
+        if not isinstance(record, dict) or record.get('type') not in RECORD_TYPES:
+            raise ValueError('Unknown record: {record}'.format(record=record))
+        missing = [field for field in RECORD_FIELDS[record['type']] if field not in record]
+        if len(missing) > 0:
+            raise ValueError('Record {record} misses {fields}'.format(record=record, fields=', '.join(missing)))
+        try:
+            for field in RECORD_FIELDS[record['type']]:
+                record[field] = int(record[field])
+        except (TypeError, ValueError):
+            raise ValueError('Record {record} has a field that is not a number'.format(record=record))
+    return records
+
+
+def result_rows(db, test_id: int, records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Get the rows of the results a batch adds, leaving out the ones stored already.
+
+    Records of unknown regression tests or output files are left out too, like the single requests do for an output
+    file that's ignored.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test_id: id of the test the batch is for
+    :type test_id: int
+    :param records: the records of the batch
+    :type records: List[dict]
+    :return: the new rows of the test_result and test_result_file tables
+    :rtype: tuple
+    """
+    equalities = [record for record in records if record['type'] == 'equality']
+    finishes = [record for record in records if record['type'] == 'finish']
+
+    outputs = {}  # type: Dict[int, str]
+    output_ids = set(record['test_file_id'] for record in equalities)
+    if len(output_ids) > 0:
+        outputs = dict(db.query(RegressionTestOutput.id, RegressionTestOutput.correct).filter(
+            RegressionTestOutput.id.in_(output_ids)).all())
+    expected_rcs = {}  # type: Dict[int, int]
+    regression_ids = set(record['test_id'] for record in finishes)
+    if len(regression_ids) > 0:
+        expected_rcs = dict(db.query(RegressionTest.id, RegressionTest.expected_rc).filter(
+            RegressionTest.id.in_(regression_ids)).all())
+
+    stored_files = set()  # type: Set[Tuple[int, int]]
+    if len(outputs) > 0:
+        stored_files = set(db.query(
+            TestResultFile.regression_test_id, TestResultFile.regression_test_output_id
+        ).filter(
+            TestResultFile.test_id == test_id,
+            TestResultFile.regression_test_output_id.in_(outputs.keys())
+        ).all())
+    stored_results = set()  # type: Set[int]
+    if len(expected_rcs) > 0:
+        stored_results = set(row[0] for row in db.query(TestResult.regression_test_id).filter(
+            TestResult.test_id == test_id,
+            TestResult.regression_test_id.in_(expected_rcs.keys())
+        ).all())
+
+    new_files = []
+    for record in equalities:
+        regression_id, output_id = record['test_id'], record['test_file_id']
+        if output_id not in outputs or (regression_id, output_id) in stored_files:
+            continue
+        stored_files.add((regression_id, output_id))
+        new_files.append({'test_id': test_id, 'regression_test_id': regression_id,
+                          'regression_test_output_id': output_id, 'expected': outputs[output_id], 'got': None})
+    new_results = []
+    for record in finishes:
+        regression_id = record['test_id']
+        if regression_id not in expected_rcs or regression_id in stored_results:
+            continue
+        stored_results.add(regression_id)
+        new_results.append({'test_id': test_id, 'regression_test_id': regression_id,
+                            'runtime': record['runTime'], 'exit_code': record['exitCode'],
+                            'expected_rc': expected_rcs[regression_id]})
+    return new_results, new_files
+
+
+def store_records(db, test_id: int, records: List[Dict[str, Any]]) -> int:
+    """
+    Store the new results of a batch in a single transaction.
+
+    When a concurrent request stores some of the same results first, the transaction is rolled back and the results
+    it stored are left out on a second attempt.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test_id: id of the test the batch is for
+    :type test_id: int
+    :param records: the records of the batch
+    :type records: List[dict]
+    :return: the number of results stored
+    :rtype: int
+    """
+    try:
+        return insert_rows(db, *result_rows(db, test_id, records))
+    except IntegrityError:
+        db.rollback()
+        return insert_rows(db, *result_rows(db, test_id, records))
+
+
+def insert_rows(db, results: List[Dict[str, Any]], files: List[Dict[str, Any]]) -> int:
+    """
+    Insert the rows of new results, with a statement per table, and commit them.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param results: the rows of the test_result table
+    :type results: List[dict]
+    :param files: the rows of the test_result_file table
+    :type files: List[dict]
+    :return: the number of rows inserted
+    :rtype: int
+    """
+    if len(results) > 0:
+        db.execute(TestResult.__table__.insert(), results)
+    if len(files) > 0:
+        db.execute(TestResultFile.__table__.insert(), files)
+    db.commit()
+    return len(results) + len(files)
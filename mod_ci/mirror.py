@@ -0,0 +1,257 @@
+"""
+Bare mirror of the CCExtractor repository, shared by the clones the VMs build from.
+
+The mirror holds the branches and the pull requests of the main repository, and the branches of every fork a test ran
+for, each fork under ``refs/forks/<id>/heads``. The cron keeps it up to date, and a test updates it only when its
+commit is missing. The clone of every VM borrows the objects of the mirror (like ``git clone --reference``), so
+preparing a test only fetches refs and checks out locally, and the VMs are prepared independently from each other.
+Updates of the mirror itself are serialized with a file lock, as they may run from several processes.
+
+Pull requests are merged on master in the mirror as soon as they're queued, under ``refs/merged/<pr number>``, so a
+conflict cancels their tests before any VM is claimed for them, and a VM only checks out the merge when its turn comes.
+"""
+
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from git import (Git, GitCommandError, InvalidGitRepositoryError,
+                 NoSuchPathError, Repo)
+
+# refs fetched from the main repository
+MAIN_REFSPECS = ['+refs/heads/*:refs/heads/*', '+refs/pull/*/head:refs/pull/*/head']
+
+# identity of the merges of pull requests made in the mirror
+MERGE_IDENTITY = {
+    'GIT_AUTHOR_NAME': 'CCExtractor CI platform',
+    'GIT_AUTHOR_EMAIL': 'ci@ccextractor.org',
+    'GIT_COMMITTER_NAME': 'CCExtractor CI platform',
+    'GIT_COMMITTER_EMAIL': 'ci@ccextractor.org',
+}
+
+# first version of git merging without a working tree (merge-tree --write-tree), which premerging relies on
+PREMERGE_GIT_VERSION = (2, 38)
+
+
+def can_premerge() -> bool:
+    """
+    Check whether the installed git can merge pull requests in the mirror, see Mirror.premerge.
+
+    :return: True if git is recent enough
+    :rtype: bool
+    """
+    return Git().version_info[:2] >= PREMERGE_GIT_VERSION
+
+
+def fork_refspec(fork_id: int) -> str:
+    """
+    Get the refspec fetching the branches of a fork into the mirror.
+
+    :param fork_id: id of the fork
+    :type fork_id: int
+    :return: the refspec
+    :rtype: str
+    """
+    return '+refs/heads/*:refs/forks/{id}/heads/*'.format(id=fork_id)
+
+
+def merge_ref(pr_nr: int) -> str:
+    """
+    Get the ref holding the merge of a pull request on master in the mirror.
+
+    :param pr_nr: number of the pull request
+    :type pr_nr: int
+    :return: the ref
+    :rtype: str
+    """
+    return 'refs/merged/{pr_nr}'.format(pr_nr=pr_nr)
+
+
+def mirror_from_config(config: Dict[str, Any]) -> 'Mirror':
+    """
+    Create the mirror of the main repository, in the sample repository.
+
+    :param config: the platform configuration
+    :type config: dict
+    :return: the mirror
+    :rtype: Mirror
+    """
+    return Mirror(
+        os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'ccextractor-mirror.git'),
+        'https://github.com/{owner}/{repo}.git'.format(
+            owner=config.get('GITHUB_OWNER', ''), repo=config.get('GITHUB_REPOSITORY', ''))
+    )
+
+
+class Mirror:
+    """Bare mirror of the main repository and the forks tests ran for."""
+
+    def __init__(self, path: str, url: str) -> None:
+        self.path = path
+        self.url = url
+
+    def open(self) -> Repo:
+        """
+        Open the mirror, creating it if it doesn't exist yet.
+
+        :return: the bare repository
+        :rtype: git.Repo
+        """
+        try:
+            return Repo(self.path)
+        except (InvalidGitRepositoryError, NoSuchPathError):
+            repo = Repo.init(self.path, bare=True)
+            # The clones of the VMs borrow objects of the mirror, so they must never be pruned
+            repo.git.config('gc.pruneExpire', 'never')
+            return repo
+
+    def update(self, fork_id: Optional[int] = None, fork_url: Optional[str] = None) -> bool:
+        """
+        Fetch the branches and pull requests of the main repository, and the branches of a fork.
+
+        :param fork_id: id of the fork to fetch too, None for the main repository only
+        :type fork_id: int
+        :param fork_url: url of the fork to fetch too
+        :type fork_url: str
+        :return: True if everything was fetched, False otherwise
+        :rtype: bool
+        """
+        with self.locked():
+            try:
+                repo = self.open()
+                repo.git.fetch('--prune', self.url, *MAIN_REFSPECS)
+                if fork_id is not None and fork_url is not None:
+                    repo.git.fetch('--prune', fork_url, fork_refspec(fork_id))
+            except GitCommandError:
+                return False
+        return True
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Hold the lock of the mirror, so only one process changes its refs at a time."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def has_commit(self, commit: str) -> bool:
+        """
+        Check whether the mirror holds a commit.
+
+        :param commit: hash of the commit
+        :type commit: str
+        :return: True if the commit is in the mirror, False otherwise
+        :rtype: bool
+        """
+        try:
+            Repo(self.path).git.cat_file('-e', '{commit}^{{commit}}'.format(commit=commit))
+        except (GitCommandError, InvalidGitRepositoryError, NoSuchPathError):
+            return False
+        return True
+
+    def ensure_commit(self, commit: str, fork_id: Optional[int] = None, fork_url: Optional[str] = None) -> bool:
+        """
+        Make sure the mirror holds a commit, updating it if it doesn't.
+
+        :param commit: hash of the commit
+        :type commit: str
+        :param fork_id: id of the fork the commit may come from, None for the main repository
+        :type fork_id: int
+        :param fork_url: url of the fork the commit may come from
+        :type fork_url: str
+        :return: True if the mirror holds the commit, False otherwise
+        :rtype: bool
+        """
+        if self.has_commit(commit):
+            return True
+        return self.update(fork_id, fork_url) and self.has_commit(commit)
+
+    def premerge(self, commit: str, pr_nr: int) -> Optional[str]:
+        """
+        Merge master into the commit of a pull request in the mirror, as a VM would in its clone.
+
+        The merge is made without a working tree, which needs git 2.38 or later (see can_premerge), and stored under
+        the ref of the pull request, replacing the merge of its previous commit.
+
+        :param commit: hash of the commit of the pull request, which must be in the mirror
+        :type commit: str
+        :param pr_nr: number of the pull request
+        :type pr_nr: int
+        :return: the hash of the merge, or None if the commit conflicts with master
+        :rtype: str
+        """
+        with self.locked():
+            repo = Repo(self.path)
+            master = repo.git.rev_parse('refs/heads/master')
+            status, tree, error = repo.git.merge_tree(
+                '--write-tree', commit, master, with_extended_output=True, with_exceptions=False)
+            if status == 1:
+                return None
+            if status != 0:
+                raise GitCommandError(['git', 'merge-tree', '--write-tree', commit, master], status, error)
+            merge = repo.git.commit_tree(
+                tree.splitlines()[0], '-p', commit, '-p', master, '-m', "Merge branch 'master' into CI_Branch",
+                env=MERGE_IDENTITY
+            )
+            repo.git.update_ref(merge_ref(pr_nr), merge)
+        return merge
+
+    def premerged(self, commit: str, pr_nr: int) -> Optional[str]:
+        """
+        Get the merge of a pull request made by premerge, if it's still up to date.
+
+        :param commit: hash of the commit of the pull request
+        :type commit: str
+        :param pr_nr: number of the pull request
+        :type pr_nr: int
+        :return: the hash of the merge, or None if the commit or master changed since, or there's no merge
+        :rtype: str
+        """
+        ref = merge_ref(pr_nr)
+        try:
+            merge, first, second, master = Repo(self.path).git.rev_parse(
+                ref, ref + '^1', ref + '^2', 'refs/heads/master').split()
+        except (GitCommandError, InvalidGitRepositoryError, NoSuchPathError, ValueError):
+            return None
+        if first != commit or second != master:
+            return None
+        return merge
+
+    def clone(self, path: str) -> Repo:
+        """
+        Open the clone of a VM, borrowing the objects of the mirror, and update its master branch from the mirror.
+
+        A missing clone is created from the mirror, an existing one gets the mirror added to its alternates.
+
+        :param path: the folder of the clone
+        :type path: str
+        :return: the clone
+        :rtype: git.Repo
+        """
+        try:
+            repo = Repo(path)
+        except (InvalidGitRepositoryError, NoSuchPathError):
+            repo = Repo.clone_from(self.path, path, reference=self.path, no_checkout=True)
+
+        objects = os.path.join(self.path, 'objects')
+        alternates = os.path.join(repo.git_dir, 'objects', 'info', 'alternates')
+        borrowed = []  # type: List[str]
+        if os.path.isfile(alternates):
+            with open(alternates) as f:
+                borrowed = f.read().splitlines()
+        if objects not in borrowed:
+            os.makedirs(os.path.dirname(alternates), exist_ok=True)
+            with open(alternates, 'a') as f:
+                f.write(objects + '\n')
+
+        # Drop whatever a previous test left behind: changes, a merge or a rebase
+        if repo.head.is_valid():
+            repo.git.reset('--hard')
+        shutil.rmtree(os.path.join(repo.git_dir, 'rebase-apply'), ignore_errors=True)
+        repo.git.fetch('--update-head-ok', self.path, '+refs/heads/master:refs/heads/master')
+        return repo
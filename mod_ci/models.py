@@ -4,19 +4,24 @@ Maintain all database related virtual machines and their status.
 List of models corresponding to mysql tables:
 [
     'Kvm' => 'kvm',
-    'Maintenance mode' => 'maintenance_mode'
+    'Maintenance mode' => 'maintenance_mode',
+    'Queue weight' => 'queue_weight',
+    'GitHub event' => 'github_event',
+    'Platform stats' => 'platform_stats'
 ]
 """
 
 import datetime
-from typing import Any, Dict, Type
+import json
+import math
+from typing import Any, Dict, List, Type
 
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, String,
-                        Text)
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Integer,
+                        String, Text, UniqueConstraint)
 from sqlalchemy.orm import relationship
 
 import mod_test.models
-from database import Base
+from database import Base, DeclEnum
 from mod_test.models import Test, TestPlatform
 
 
@@ -43,15 +48,21 @@ class Kvm(Base):
     """Model to store KVMs."""
 
     __tablename__ = 'kvm'
-    __table_args__ = {'mysql_engine': 'InnoDB'}
     name = Column(String(64), primary_key=True)
     test_id = Column(Integer, ForeignKey(Test.id, onupdate="CASCADE", ondelete="RESTRICT"))
     test = relationship('Test', uselist=False)
+    # Number of the shard of the test the VM runs, 0 for a test that isn't sharded
+    shard = Column(Integer, nullable=False, default=0)
     timestamp = Column(DateTime(), nullable=False)
     timestamp_prep_finished = Column(DateTime(), nullable=True)
     timestamp_build_finished = Column(DateTime(), nullable=True)
+    # A shard of a test is held by one VM at most, which is what makes claiming a test atomic
+    __table_args__ = (
+        UniqueConstraint(test_id, shard, name='kvm_test_shard'),
+        {'mysql_engine': 'InnoDB'}
+    )
 
-    def __init__(self, name, test_id, timestamp=None) -> None:
+    def __init__(self, name, test_id, timestamp=None, shard=0) -> None:
         """
         Parametrized constructor for the Kvm model.
 
@@ -62,12 +73,15 @@ class Kvm(Base):
         :param timestamp: The value of the 'timestamp' field of TestProgress
          model (None by default)
         :type timestamp: datetime
+        :param shard: The value of the 'shard' field of Kvm model (0 by default)
+        :type shard: int
         """
         self.name = name
         self.test_id = test_id
         if timestamp is None:
             timestamp = datetime.datetime.now()
         self.timestamp = timestamp
+        self.shard = shard
 
     def __repr__(self) -> str:
         """
@@ -111,3 +125,213 @@ class MaintenanceMode(Base):
         :rtype str(platform, status): str
         """
         return '<Platform {p}, maintenance {status}>'.format(p=self.platform.description, status=self.disabled)
+
+
+class QueueWeight(Base):
+    """Model to store the weights the priority of queued tests is computed from."""
+
+    __tablename__ = 'queue_weight'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    name = Column(String(64), primary_key=True)
+    weight = Column(Integer, nullable=False)
+
+    def __init__(self, name, weight) -> None:
+        """
+        Parametrized constructor for the QueueWeight model.
+
+        :param name: The value of the 'name' field of QueueWeight model
+        :type name: str
+        :param weight: The value of the 'weight' field of QueueWeight model
+        :type weight: int
+        """
+        self.name = name
+        self.weight = weight
+
+    def __repr__(self) -> str:
+        """
+        Represent a QueueWeight Model by its name and weight Field.
+
+        :return str(name, weight): Returns the string containing
+         'name' and 'weight' field of the QueueWeight model
+        :rtype str(name, weight): str
+        """
+        return '<QueueWeight {name}: {weight}>'.format(name=self.name, weight=self.weight)
+
+
+class GitHubEventKind(DeclEnum):
+    """Enum to specify the kind of update a GitHub event delivers."""
+
+    status = "status", "Commit status"
+    comment = "comment", "Pull request comment"
+
+
+class GitHubEvent(Base):
+    """Model to store the updates waiting to be delivered to GitHub."""
+
+    __tablename__ = 'github_event'
+    id = Column(Integer, primary_key=True)
+    kind = Column(GitHubEventKind.db_type(), nullable=False)
+    # The commit of a status, or the number of the pull request of a comment
+    target = Column(String(64), nullable=False)
+    # The context of a status, or the platform a comment reports on
+    context = Column(String(64), nullable=False)
+    payload = Column(Text(), nullable=False)
+    # Bumped when a newer update replaces the payload, so a delivery of the older one doesn't remove it
+    revision = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt = Column(DateTime(), nullable=False, index=True)
+    # A single update per commit and context (or pull request and platform) waits at once, the latest
+    __table_args__ = (
+        UniqueConstraint(kind, target, context, name='github_event_key'),
+        {'mysql_engine': 'InnoDB'}
+    )
+
+    def __init__(self, kind, target, context, payload, next_attempt=None) -> None:
+        """
+        Parametrized constructor for the GitHubEvent model.
+
+        :param kind: The value of the 'kind' field of GitHubEvent model
+        :type kind: GitHubEventKind
+        :param target: The value of the 'target' field of GitHubEvent model
+        :type target: str
+        :param context: The value of the 'context' field of GitHubEvent model
+        :type context: str
+        :param payload: The value of the 'payload' field of GitHubEvent model
+        :type payload: str
+        :param next_attempt: The value of the 'next_attempt' field of GitHubEvent model (now by default)
+        :type next_attempt: datetime
+        """
+        self.kind = kind
+        self.target = target
+        self.context = context
+        self.payload = payload
+        self.revision = 0
+        self.attempts = 0
+        if next_attempt is None:
+            next_attempt = datetime.datetime.now()
+        self.next_attempt = next_attempt
+
+    def __repr__(self) -> str:
+        """
+        Represent a GitHubEvent Model by its kind, target and context Field.
+
+        :return str(kind, target, context): Returns the string containing
+         'kind', 'target' and 'context' field of the GitHubEvent model
+        :rtype str(kind, target, context): str
+        """
+        return '<GitHubEvent {kind} {target} {context}>'.format(
+            kind=self.kind.value, target=self.target, context=self.context)
+
+
+class PlatformStats(Base):
+    """
+    Model to store the statistics of the durations of a phase of the tests of a platform.
+
+    The mean and variance are updated with every new duration (Welford's algorithm), the percentiles are those of the
+    last WINDOW_SIZE durations, so they follow the platform as it gets faster or slower.
+    """
+
+    # durations the percentiles are computed over
+    WINDOW_SIZE = 100
+
+    __tablename__ = 'platform_stats'
+    id = Column(Integer, primary_key=True)
+    platform = Column(TestPlatform.db_type(), nullable=False)
+    # 'prep' and 'build' for the preparation and build of a VM, 'test' for a whole test
+    phase = Column(String(16), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0.0)
+    # Sum of the squared differences from the mean
+    m2 = Column(Float, nullable=False, default=0.0)
+    # JSON list of the last durations, oldest first
+    window = Column(Text(), nullable=False)
+    median = Column(Float, nullable=False, default=0.0)
+    p90 = Column(Float, nullable=False, default=0.0)
+    __table_args__ = (
+        UniqueConstraint(platform, phase, name='platform_stats_phase'),
+        {'mysql_engine': 'InnoDB'}
+    )
+
+    def __init__(self, platform, phase) -> None:
+        """
+        Parametrized constructor for the PlatformStats model.
+
+        :param platform: The value of the 'platform' field of PlatformStats model
+        :type platform: TestPlatform
+        :param phase: The value of the 'phase' field of PlatformStats model
+        :type phase: str
+        """
+        self.platform = platform
+        self.phase = phase
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.window = '[]'
+        self.median = 0.0
+        self.p90 = 0.0
+
+    def __repr__(self) -> str:
+        """
+        Represent a PlatformStats Model by its platform, phase and mean Field.
+
+        :return str(platform, phase, mean): Returns the string containing
+         'platform', 'phase' and 'mean' field of the PlatformStats model
+        :rtype str(platform, phase, mean): str
+        """
+        return '<PlatformStats {platform} {phase}: {mean}>'.format(
+            platform=self.platform.value, phase=self.phase, mean=self.mean)
+
+    @property
+    def variance(self) -> float:
+        """
+        Get the sample variance of the durations.
+
+        :return: the variance, 0 when there are less than two durations
+        :rtype: float
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self) -> float:
+        """
+        Get the sample standard deviation of the durations.
+
+        :return: the standard deviation
+        :rtype: float
+        """
+        return math.sqrt(self.variance)
+
+    def add(self, duration: float) -> None:
+        """
+        Add a duration to the statistics.
+
+        :param duration: the duration in seconds
+        :type duration: float
+        """
+        self.count += 1
+        delta = duration - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (duration - self.mean)
+
+        window = json.loads(self.window)[-(self.WINDOW_SIZE - 1):] + [duration]
+        self.window = json.dumps(window)
+        self.median = percentile(window, 0.5)
+        self.p90 = percentile(window, 0.9)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Get a percentile of values, interpolating between the two closest ones.
+
+    :param values: the values, not empty
+    :type values: List[float]
+    :param fraction: the percentile, between 0 and 1
+    :type fraction: float
+    :return: the percentile
+    :rtype: float
+    """
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
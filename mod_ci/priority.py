@@ -0,0 +1,151 @@
+"""
+Priority of the tests waiting in the queue of a platform.
+
+A test gets its priority once, when it's queued. Its weight is the weight of its test type plus the weight of its fork
+(the main fork, another fork, or an override for that fork), minus the fair share weight for every test of the same
+fork already waiting on the platform, so a burst of tests of one fork doesn't push the others back. The priority is
+that weight, times the aging in minutes, minus the minute the test was queued at. The VMs run the test with the highest
+priority first: a test with one more unit of weight overtakes the tests queued up to aging minutes before it, but no
+earlier ones, so every waiting test eventually runs.
+
+As the priority doesn't change while a test waits, it's stored on the test and the queue index finds the next test to
+run without computing anything.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+from mod_ci.models import QueueWeight
+from mod_test.models import Test, TestQueueState
+
+AGING = 'aging'
+FAIR_SHARE = 'fair_share'
+MAIN_FORK = 'fork_main'
+OTHER_FORKS = 'fork_other'
+
+DEFAULT_WEIGHTS = {
+    # by test type, see type_key
+    'type_commit': 1,
+    'type_pr': 2,
+    MAIN_FORK: 2,
+    OTHER_FORKS: 0,
+    FAIR_SHARE: 1,
+    # minutes a test of one more unit of weight gets ahead of the others
+    AGING: 30,
+}
+
+
+def type_key(test_type: Any) -> str:
+    """
+    Get the name of the weight of a test type.
+
+    :param test_type: type of the test
+    :type test_type: TestType
+    :return: name of the weight
+    :rtype: str
+    """
+    return 'type_' + test_type.value
+
+
+def fork_key(fork_id: int) -> str:
+    """
+    Get the name of the weight overriding the weight of a fork.
+
+    :param fork_id: id of the fork
+    :type fork_id: int
+    :return: name of the weight
+    :rtype: str
+    """
+    return 'fork_{id}'.format(id=fork_id)
+
+
+def load_weights(db) -> Dict[str, int]:
+    """
+    Get the weights, the stored ones replacing the defaults.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :return: weights by name
+    :rtype: dict
+    """
+    weights = dict(DEFAULT_WEIGHTS)
+    for row in db.query(QueueWeight).all():
+        weights[row.name] = row.weight
+    return weights
+
+
+def is_main_fork(fork_url: str, github_config: Dict[str, str]) -> bool:
+    """
+    Check whether a fork is the main repository.
+
+    :param fork_url: url of the fork
+    :type fork_url: str
+    :param github_config: GitHub configuration, with the owner and name of the main repository
+    :type github_config: dict
+    :return: whether the fork is the main repository
+    :rtype: bool
+    """
+    return '/{owner}/{repo}.git'.format(
+        owner=github_config['repository_owner'], repo=github_config['repository']) in fork_url
+
+
+def weight_of(weights: Dict[str, int], test_type: Any, fork_id: int, main_fork: bool) -> int:
+    """
+    Get the weight of a test, before its fair share.
+
+    :param weights: weights by name
+    :type weights: dict
+    :param test_type: type of the test
+    :type test_type: TestType
+    :param fork_id: id of the fork of the test
+    :type fork_id: int
+    :param main_fork: whether the fork is the main repository
+    :type main_fork: bool
+    :return: weight of the test
+    :rtype: int
+    """
+    fork_weight = weights.get(fork_key(fork_id), weights[MAIN_FORK] if main_fork else weights[OTHER_FORKS])
+    return weights[type_key(test_type)] + fork_weight
+
+
+def compute_priority(weights: Dict[str, int], weight: int, waiting: int, now: Optional[float] = None) -> int:
+    """
+    Compute the priority of a test being queued.
+
+    :param weights: weights by name
+    :type weights: dict
+    :param weight: weight of the test, before its fair share
+    :type weight: int
+    :param waiting: number of tests of the same fork already waiting on the platform
+    :type waiting: int
+    :param now: time the test is queued at, in seconds since the epoch (now by default)
+    :type now: float
+    :return: priority of the test, the highest one running first
+    :rtype: int
+    """
+    minute = int((time.time() if now is None else now) // 60)
+    return (weight - weights[FAIR_SHARE] * waiting) * weights[AGING] - minute
+
+
+def assign_priority(db, test, main_fork: bool, weights: Optional[Dict[str, int]] = None) -> None:
+    """
+    Set the priority of a test that is being queued.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: test being queued
+    :type test: Test
+    :param main_fork: whether the fork of the test is the main repository
+    :type main_fork: bool
+    :param weights: weights by name, loaded from the database if None
+    :type weights: dict
+    """
+    if weights is None:
+        weights = load_weights(db)
+    waiting = db.query(Test.id).filter(
+        Test.platform == test.platform,
+        Test.queue_state == TestQueueState.queued,
+        Test.fork_id == test.fork_id,
+        Test.id != test.id
+    ).count()
+    test.priority = compute_priority(weights, weight_of(weights, test.test_type, test.fork_id, main_fork), waiting)
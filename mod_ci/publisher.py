@@ -0,0 +1,364 @@
+"""
+Deliver the commit statuses and pull request comments of the CI platform to GitHub, outside of the requests.
+
+The progress reporter used to post to GitHub while the VM waited for its answer. Updates are now queued in the
+github_event table and delivered by a worker (`python manage.py publisher`), which retries failed deliveries with an
+increasing delay. A single update waits per commit and status context (or per pull request and platform): a newer
+one replaces the payload of the one waiting, as only the latest state matters. The worker keeps its HTTP connections
+to GitHub open between deliveries.
+
+Without the worker (GITHUB_PUBLISHER disabled), the request queueing an update delivers the ones waiting for the same
+commits or pull requests itself, and the cron retries the others. A deliverer claims an event before calling GitHub,
+so concurrent deliverers don't post it twice.
+"""
+
+import datetime
+import json
+import time
+from logging import Logger
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy.exc import IntegrityError
+
+from mod_ci.models import GitHubEvent, GitHubEventKind
+
+GITHUB_API = 'https://api.github.com'
+
+# seconds to wait for an answer of GitHub
+TIMEOUT = 10
+
+# connections kept open to GitHub
+POOL_SIZE = 4
+
+# events delivered at most per round, oldest first
+BATCH_SIZE = 50
+
+# failed deliveries after which an event is dropped
+MAX_ATTEMPTS = 8
+
+# seconds an event stays claimed by the deliverer calling GitHub for it, longer than the calls of a delivery take
+CLAIM_TIMEOUT = 6 * TIMEOUT
+
+# seconds before the first retry, doubled at every next one up to MAX_RETRY_DELAY
+RETRY_DELAY = 15
+MAX_RETRY_DELAY = 60 * 60
+
+# seconds the worker waits between two rounds
+DEFAULT_POLL_INTERVAL = 2
+
+
+class PublishError(Exception):
+    """Raised when GitHub doesn't accept an update."""
+
+    def __init__(self, message: str, retry: bool) -> None:
+        """
+        Create the error.
+
+        :param message: what went wrong
+        :type message: str
+        :param retry: whether delivering the update again may succeed
+        :type retry: bool
+        """
+        super().__init__(message)
+        self.retry = retry
+
+
+class GitHubClient:
+    """Client of the GitHub API for a repository, keeping its connections open."""
+
+    def __init__(self, token: str, owner: str, repository: str, pool_size: int = POOL_SIZE) -> None:
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            'Accept': 'application/vnd.github.v3+json',
+            'Authorization': 'token {token}'.format(token=token),
+        })
+        self.url = '{api}/repos/{owner}/{repository}'.format(api=GITHUB_API, owner=owner, repository=repository)
+
+    def request(self, method: str, path: str, **kwargs: Any) -> Any:
+        """
+        Send a request about the repository.
+
+        :param method: HTTP method
+        :type method: str
+        :param path: path below the URL of the repository
+        :type path: str
+        :raises PublishError: when GitHub can't be reached or refuses the request
+        :return: the decoded answer, None when it's empty
+        :rtype: Any
+        """
+        try:
+            response = self.session.request(method, self.url + path, timeout=TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            raise PublishError('{method} {path} failed: {error}'.format(method=method, path=path, error=e), True)
+        if response.status_code >= 400:
+            # rate limits answer with 403 or 429, and are lifted after a while
+            raise PublishError('{method} {path} answered {status}: {text}'.format(
+                method=method, path=path, status=response.status_code, text=response.text[:200]
+            ), response.status_code >= 500 or response.status_code in [403, 429])
+        return response.json() if len(response.content) > 0 else None
+
+    def post_status(self, commit: str, payload: Dict[str, Any]) -> None:
+        """
+        Set a status of a commit.
+
+        :param commit: the commit
+        :type commit: str
+        :param payload: state, description, context and target_url of the status
+        :type payload: dict
+        """
+        self.request('POST', '/statuses/{commit}'.format(commit=commit), json=payload)
+
+    def post_comment(self, pr_nr: str, platform: str, body: str, bot_name: str) -> None:
+        """
+        Post the report of a platform on a pull request, replacing the previous report of that platform.
+
+        :param pr_nr: number of the pull request
+        :type pr_nr: str
+        :param platform: name of the platform, which the reports mention
+        :type platform: str
+        :param body: the report
+        :type body: str
+        :param bot_name: login of the bot posting the reports
+        :type bot_name: str
+        """
+        # Pull requests are just issues with code, so github consider pr comments in issues
+        comments = self.request('GET', '/issues/{pr_nr}/comments'.format(pr_nr=pr_nr), params={'per_page': 100})
+        comment_id = next((comment['id'] for comment in comments or []
+                           if comment['user']['login'] == bot_name and platform in comment['body']), None)
+        if comment_id is None:
+            self.request('POST', '/issues/{pr_nr}/comments'.format(pr_nr=pr_nr), json={'body': body})
+        else:
+            self.request('PATCH', '/issues/comments/{id}'.format(id=comment_id), json={'body': body})
+
+
+# clients by token and repository, so the connections of a process are reused from one request to the next
+_clients = {}  # type: Dict[Tuple[str, str, str], GitHubClient]
+
+
+def client_from_config(github_config: Dict[str, str]) -> GitHubClient:
+    """
+    Get the client of the repository the platform tests.
+
+    :param github_config: the GitHub configuration, see run.get_github_config
+    :type github_config: dict
+    :return: the client, the same one for every call of a process
+    :rtype: GitHubClient
+    """
+    key = (github_config['bot_token'], github_config['repository_owner'], github_config['repository'])
+    if key not in _clients:
+        _clients[key] = GitHubClient(*key)
+    return _clients[key]
+
+
+def queue_event(db, kind, target: str, context: str, payload: Dict[str, Any]) -> None:
+    """
+    Queue an update, replacing the one waiting for the same target and context, and commit it.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param kind: kind of the update
+    :type kind: GitHubEventKind
+    :param target: commit of a status, or number of the pull request of a comment
+    :type target: str
+    :param context: context of a status, or platform of a comment
+    :type context: str
+    :param payload: content of the update
+    :type payload: dict
+    """
+    values = {
+        'payload': json.dumps(payload),
+        'attempts': 0,
+        'next_attempt': datetime.datetime.now(),
+        'revision': GitHubEvent.revision + 1,
+    }
+    match = [GitHubEvent.kind == kind, GitHubEvent.target == target, GitHubEvent.context == context]
+    for _ in range(2):
+        if db.query(GitHubEvent).filter(*match).update(values, synchronize_session=False) > 0:
+            db.commit()
+            return
+        try:
+            db.execute(GitHubEvent.__table__.insert(), {
+                'kind': kind, 'target': target, 'context': context, 'payload': values['payload'], 'revision': 0,
+                'attempts': 0, 'next_attempt': values['next_attempt']
+            })
+            db.commit()
+            return
+        except IntegrityError:
+            # queued by a concurrent request in the meantime, replace that one instead
+            db.rollback()
+
+
+def queue_status(db, commit: str, state: str, description: str, context: str, target_url: str) -> None:
+    """
+    Queue a status of a commit, replacing the one waiting for the same context.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param commit: the commit
+    :type commit: str
+    :param state: state of the status
+    :type state: str
+    :param description: description of the status
+    :type description: str
+    :param context: context of the status
+    :type context: str
+    :param target_url: URL the status links to
+    :type target_url: str
+    """
+    queue_event(db, GitHubEventKind.status, commit, context, {
+        'state': state, 'description': description, 'context': context, 'target_url': target_url
+    })
+
+
+def queue_comment(db, pr_nr: int, platform: str, body: str) -> None:
+    """
+    Queue the report of a platform on a pull request, replacing the one waiting.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param pr_nr: number of the pull request
+    :type pr_nr: int
+    :param platform: name of the platform
+    :type platform: str
+    :param body: the report
+    :type body: str
+    """
+    queue_event(db, GitHubEventKind.comment, str(pr_nr), platform, {'body': body})
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Get the delay before delivering an event again.
+
+    :param attempts: failed deliveries of the event so far
+    :type attempts: int
+    :return: the delay in seconds
+    :rtype: float
+    """
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def deliver(client: GitHubClient, bot_name: str, kind, target: str, context: str,
+            payload: Dict[str, Any]) -> None:
+    """
+    Deliver an update to GitHub.
+
+    :param client: the GitHub client
+    :type client: GitHubClient
+    :param bot_name: login of the bot posting the comments
+    :type bot_name: str
+    :param kind: kind of the update
+    :type kind: GitHubEventKind
+    :param target: commit of a status, or number of the pull request of a comment
+    :type target: str
+    :param context: context of a status, or platform of a comment
+    :type context: str
+    :param payload: content of the update
+    :type payload: dict
+    :raises PublishError: when GitHub doesn't accept the update
+    """
+    if kind == GitHubEventKind.status:
+        client.post_status(target, payload)
+    else:
+        client.post_comment(target, context, payload['body'], bot_name)
+
+
+def deliver_due(db, client: GitHubClient, bot_name: str, log: Logger, limit: int = BATCH_SIZE,
+                now: Optional[datetime.datetime] = None, targets: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+    """
+    Deliver the events that are due, oldest first.
+
+    No transaction stays open while GitHub is called. Every event is claimed first, by moving its next attempt
+    beyond the time the delivery takes; one claimed by a concurrent deliverer is skipped. A delivered event is
+    removed, unless a newer update replaced its payload in the meantime; that one is delivered next.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param client: the GitHub client
+    :type client: GitHubClient
+    :param bot_name: login of the bot posting the comments
+    :type bot_name: str
+    :param log: logger
+    :type log: Logger
+    :param limit: events delivered at most
+    :type limit: int
+    :param now: the current time, now by default
+    :type now: datetime
+    :param targets: only deliver the events of these commits and pull request numbers, None for all events
+    :type targets: Iterable[str]
+    :return: the number of events delivered, and of failed deliveries
+    :rtype: tuple
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    due = db.query(GitHubEvent).filter(GitHubEvent.next_attempt <= now)
+    if targets is not None:
+        due = due.filter(GitHubEvent.target.in_([str(target) for target in targets]))
+    events = [(event.id, event.revision, event.attempts, event.kind, event.target, event.context, event.payload)
+              for event in due.order_by(GitHubEvent.id).limit(limit).all()]
+    db.commit()
+    delivered = 0
+    failed = 0
+    for event_id, revision, attempts, kind, target, context, payload in events:
+        same_revision = db.query(GitHubEvent).filter(GitHubEvent.id == event_id, GitHubEvent.revision == revision)
+        claimed = same_revision.filter(GitHubEvent.next_attempt <= now).update({
+            'next_attempt': datetime.datetime.now() + datetime.timedelta(seconds=CLAIM_TIMEOUT)
+        }, synchronize_session=False)
+        db.commit()
+        if claimed == 0:
+            # delivered, claimed or replaced by a concurrent deliverer in the meantime
+            continue
+        try:
+            deliver(client, bot_name, kind, target, context, json.loads(payload))
+        except PublishError as e:
+            failed += 1
+            if not e.retry or attempts + 1 >= MAX_ATTEMPTS:
+                log.error('Dropping the {kind} of {target} ({context}) for GitHub: {error}'.format(
+                    kind=kind.value, target=target, context=context, error=e))
+                same_revision.delete(synchronize_session=False)
+            else:
+                log.warning('Delivering the {kind} of {target} ({context}) to GitHub failed, retrying: {error}'.format(
+                    kind=kind.value, target=target, context=context, error=e))
+                same_revision.update({
+                    'attempts': attempts + 1,
+                    'next_attempt': now + datetime.timedelta(seconds=retry_delay(attempts + 1)),
+                }, synchronize_session=False)
+        else:
+            delivered += 1
+            same_revision.delete(synchronize_session=False)
+        db.commit()
+    return delivered, failed
+
+
+def run_publisher(config, log: Logger) -> None:
+    """
+    Deliver the queued events until interrupted.
+
+    :param config: the application configuration
+    :type config: dict
+    :param log: logger
+    :type log: Logger
+    """
+    from database import create_session
+    from run import get_github_config
+
+    db = create_session(config['DATABASE_URI'])
+    github_config = get_github_config(config)
+    client = client_from_config(github_config)
+    poll_interval = config.get('GITHUB_PUBLISH_INTERVAL', DEFAULT_POLL_INTERVAL)
+    log.info('Publisher delivering GitHub events every {interval} seconds'.format(interval=poll_interval))
+    try:
+        while True:
+            try:
+                delivered, _ = deliver_due(db, client, github_config['bot_name'], log)
+            except Exception:
+                log.exception('Delivering GitHub events failed')
+                db.rollback()
+                delivered = 0
+            if delivered < BATCH_SIZE:
+                time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        db.remove()
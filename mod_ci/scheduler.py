@@ -0,0 +1,410 @@
+"""
+Long running scheduler of the CI platforms.
+
+The scheduler owns the virtual machines: one worker thread per VM waits on a local queue of notifications
+(a test was queued or finished) and starts the next test as soon as one arrives, instead of forking a process that
+sleeps for a fixed delay. Notifications come in over a local socket, so the web application and the cron script only
+send a small message. Workers also run when no notification came in for a while, as the cron used to do. Every
+worker keeps its libvirt connection open between tests.
+"""
+
+import queue
+import threading
+import time
+from logging import Logger
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional
+
+from database import EnumSymbol
+from mod_test.models import TestPlatform
+
+# seconds a worker waits for a notification before checking its VM anyway
+DEFAULT_POLL_INTERVAL = 60
+
+# seconds a client waits for the scheduler to answer
+CLIENT_TIMEOUT = 5
+
+# configuration keys of the names of the VMs of every platform
+KVM_NAME_KEYS = {
+    'linux': 'KVM_LINUX_NAME',
+    'windows': 'KVM_WINDOWS_NAME',
+}
+
+
+class SchedulerMetrics:
+    """Thread safe counters of the dispatches of the scheduler."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.dispatched = {}  # type: Dict[str, int]
+        self.failed = {}  # type: Dict[str, int]
+        self.latency_total = {}  # type: Dict[str, float]
+        self.latency_last = {}  # type: Dict[str, float]
+        self.latency_max = {}  # type: Dict[str, float]
+
+    def record(self, kvm_name: str, latency: float, failed: bool = False) -> None:
+        """
+        Record a dispatch.
+
+        :param kvm_name: name of the VM
+        :type kvm_name: str
+        :param latency: seconds between the oldest notification served and the start of the dispatch
+        :type latency: float
+        :param failed: whether the dispatch raised an exception
+        :type failed: bool
+        """
+        with self.lock:
+            self.dispatched[kvm_name] = self.dispatched.get(kvm_name, 0) + 1
+            if failed:
+                self.failed[kvm_name] = self.failed.get(kvm_name, 0) + 1
+            self.latency_total[kvm_name] = self.latency_total.get(kvm_name, 0.0) + latency
+            self.latency_last[kvm_name] = latency
+            self.latency_max[kvm_name] = max(self.latency_max.get(kvm_name, 0.0), latency)
+
+    def snapshot(self, depths: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the current metrics of every VM.
+
+        :param depths: number of pending notifications, by VM name
+        :type depths: dict
+        :return: queue depth, dispatch count, failures and dispatch latency in milliseconds, by VM name
+        :rtype: dict
+        """
+        metrics = {}
+        with self.lock:
+            for kvm_name, depth in depths.items():
+                dispatched = self.dispatched.get(kvm_name, 0)
+                metrics[kvm_name] = {
+                    'queue_depth': depth,
+                    'dispatched': dispatched,
+                    'failed': self.failed.get(kvm_name, 0),
+                    'latency_last_ms': round(self.latency_last.get(kvm_name, 0.0) * 1000, 1),
+                    'latency_mean_ms': round(self.latency_total.get(kvm_name, 0.0) * 1000 / max(dispatched, 1), 1),
+                    'latency_max_ms': round(self.latency_max.get(kvm_name, 0.0) * 1000, 1),
+                }
+        return metrics
+
+
+class Scheduler:
+    """Dispatch the tests of every virtual machine from a queue of notifications."""
+
+    def __init__(self, dispatch: Callable[[EnumSymbol, str], None], vms: Dict[str, EnumSymbol], log: Logger,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+        """
+        Create a scheduler.
+
+        :param dispatch: function starting the next test of a platform on a VM, if any; it's called by one thread per VM
+        :type dispatch: Callable
+        :param vms: platform of every VM, by name
+        :type vms: dict
+        :param log: logger
+        :type log: Logger
+        :param poll_interval: seconds a worker waits for a notification before dispatching anyway
+        :type poll_interval: float
+        """
+        self.dispatch = dispatch
+        self.vms = vms
+        self.log = log
+        self.poll_interval = poll_interval
+        self.queues = {kvm_name: queue.Queue() for kvm_name in vms}  # type: Dict[str, queue.Queue]
+        self.metrics = SchedulerMetrics()
+        self.stopped = threading.Event()
+        self.threads = []  # type: List[threading.Thread]
+
+    def notify(self, platform: Optional[EnumSymbol] = None, delay: Optional[float] = None) -> None:
+        """
+        Notify the workers that a test was queued or finished.
+
+        Every VM of the platform is notified; the ones that are busy find they still are, and the others claim the
+        waiting tests.
+
+        :param platform: platform of the test, None for all platforms
+        :type platform: TestPlatform
+        :param delay: seconds the workers wait before dispatching, e.g. while a finished VM still uploads its results
+        :type delay: float
+        """
+        due = time.monotonic() + (delay or 0)
+        for kvm_name, notifications in self.queues.items():
+            if platform is None or platform == self.vms[kvm_name]:
+                notifications.put(due)
+
+    def depths(self) -> Dict[str, int]:
+        """
+        Get the number of pending notifications of every VM.
+
+        :return: the number of notifications, by VM name
+        :rtype: dict
+        """
+        return {kvm_name: notifications.qsize() for kvm_name, notifications in self.queues.items()}
+
+    def run_once(self, kvm_name: str, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for notifications of a VM, then dispatch once for all of them.
+
+        Notifications that came in while the previous test was dispatched are served together: a dispatch starts the
+        oldest waiting test, whichever notification announced it. The dispatch waits until the latest of them is due,
+        so a VM that just finished isn't reset while it still uploads its results.
+
+        :param kvm_name: name of the VM
+        :type kvm_name: str
+        :param timeout: seconds to wait for a notification, after which the VM is checked anyway
+        :type timeout: float
+        :return: whether a notification came in
+        :rtype: bool
+        """
+        notifications = self.queues[kvm_name]
+        try:
+            dues = [notifications.get(timeout=timeout)]
+            notified = True
+        except queue.Empty:
+            dues = [time.monotonic()]
+            notified = False
+        while True:
+            try:
+                dues.append(notifications.get_nowait())
+            except queue.Empty:
+                break
+        oldest = min(dues)
+        due = max(dues)
+        if due > time.monotonic():
+            self.stopped.wait(due - time.monotonic())
+            oldest = due
+        if self.stopped.is_set():
+            return notified
+
+        platform = self.vms[kvm_name]
+        latency = time.monotonic() - oldest
+        try:
+            self.dispatch(platform, kvm_name)
+        except Exception:
+            self.log.exception('[{platform}] Dispatching the next test on {name} failed'.format(
+                platform=platform, name=kvm_name))
+            self.metrics.record(kvm_name, latency, failed=True)
+        else:
+            self.metrics.record(kvm_name, latency)
+        return notified
+
+    def _work(self, kvm_name: str) -> None:
+        while not self.stopped.is_set():
+            self.run_once(kvm_name, self.poll_interval)
+
+    def start(self) -> None:
+        """Start a worker thread for every VM, checking every VM once straight away."""
+        self.notify()
+        for kvm_name in self.queues:
+            thread = threading.Thread(target=self._work, args=(kvm_name,), name='scheduler-' + kvm_name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the workers once they finish their current dispatch."""
+        self.stopped.set()
+        self.notify()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the current metrics of every VM, along with its platform.
+
+        :return: the metrics, by VM name
+        :rtype: dict
+        """
+        metrics = self.metrics.snapshot(self.depths())
+        for kvm_name, values in metrics.items():
+            values['platform'] = self.vms[kvm_name].value
+        return metrics
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Handle a message of a client.
+
+        :param message: either {'type': 'notify', 'platform': value or None, 'delay': seconds or None} or
+            {'type': 'metrics'}
+        :type message: dict
+        :return: the answer to the client
+        :rtype: dict
+        """
+        if message.get('type') == 'notify':
+            platform = message.get('platform')
+            self.notify(None if platform is None else TestPlatform.from_string(platform), message.get('delay'))
+            return {'status': 'ok'}
+        if message.get('type') == 'metrics':
+            return {'status': 'ok', 'metrics': self.snapshot()}
+        return {'status': 'error', 'message': 'unknown message'}
+
+    def serve_forever(self, address: str, authkey: Optional[bytes] = None) -> None:
+        """
+        Start the workers and answer the messages of clients until stopped.
+
+        :param address: path of the socket to listen on
+        :type address: str
+        :param authkey: key clients authenticate with, None to skip authentication
+        :type authkey: bytes
+        """
+        self.start()
+        with Listener(address, family='AF_UNIX', authkey=authkey) as listener:
+            self.log.info('Scheduler listening on {address}'.format(address=address))
+            while not self.stopped.is_set():
+                try:
+                    connection = listener.accept()
+                    try:
+                        connection.send(self.handle(connection.recv()))
+                    finally:
+                        connection.close()
+                except (OSError, EOFError, ValueError, AuthenticationError) as e:
+                    self.log.warn('Scheduler dropped a client message: {error}'.format(error=e))
+
+
+def kvm_names(config, platform) -> List[str]:
+    """
+    Get the names of the VMs of a platform.
+
+    The configuration holds either a single name, a comma separated list of names or a list of names.
+
+    :param config: the application configuration
+    :type config: dict
+    :param platform: the platform
+    :type platform: TestPlatform
+    :return: the names, empty if the platform has no VM
+    :rtype: List[str]
+    """
+    names = config.get(KVM_NAME_KEYS[platform.value], '')
+    if isinstance(names, str):
+        names = names.split(',')
+    return [name.strip() for name in names if name.strip() != '']
+
+
+def libvirt_dispatcher(app, db, repository) -> Callable[[EnumSymbol, str], None]:
+    """
+    Create the dispatch function running kvm_processor, keeping one libvirt connection open per VM.
+
+    :param app: the application
+    :type app: Flask
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param repository: repository to run tests on
+    :type repository: str
+    :return: the dispatch function
+    :rtype: Callable
+    """
+    import libvirt
+    from mod_ci.controllers import kvm_processor
+
+    connections = {}  # type: Dict[str, Any]
+
+    def dispatch(platform: EnumSymbol, kvm_name: str) -> None:
+        conn = connections.get(kvm_name)
+        if conn is None or conn.isAlive() != 1:
+            conn = connections[kvm_name] = libvirt.open('qemu:///system')
+        try:
+            with app.app_context():
+                kvm_processor(app, db, kvm_name, platform, repository, None, conn=conn)
+        finally:
+            # the session is scoped to the worker thread; don't keep its objects around until the next test
+            db.remove()
+
+    return dispatch
+
+
+def scheduler_from_config(app, config) -> Scheduler:
+    """
+    Create the scheduler of all configured VMs.
+
+    :param app: the application
+    :type app: Flask
+    :param config: the application configuration
+    :type config: dict
+    :return: the scheduler
+    :rtype: Scheduler
+    """
+    from database import create_session
+    from github import GitHub
+    from run import log
+
+    db = create_session(config['DATABASE_URI'])
+    gh = GitHub(access_token=config['GITHUB_TOKEN'])
+    repository = gh.repos(config['GITHUB_OWNER'])(config['GITHUB_REPOSITORY'])
+    vms = {}  # type: Dict[str, Any]
+    for platform in [TestPlatform.linux, TestPlatform.windows]:
+        for kvm_name in kvm_names(config, platform):
+            vms[kvm_name] = platform
+    return Scheduler(libvirt_dispatcher(app, db, repository), vms, log,
+                     config.get('SCHEDULER_POLL_INTERVAL', DEFAULT_POLL_INTERVAL))
+
+
+def _authkey(config) -> Optional[bytes]:
+    key = config.get('HMAC_KEY', '')
+    return key.encode('utf-8') if key != '' else None
+
+
+def _request(config, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    address = config.get('SCHEDULER_SOCKET', '')
+    if address == '':
+        return None
+    try:
+        connection = Client(address, family='AF_UNIX', authkey=_authkey(config))
+        try:
+            connection.send(message)
+            if not connection.poll(CLIENT_TIMEOUT):
+                return None
+            return connection.recv()
+        finally:
+            connection.close()
+    except (OSError, EOFError, AuthenticationError):
+        return None
+
+
+def notify_scheduler(config, platform: Optional[EnumSymbol] = None, delay: Optional[float] = None) -> bool:
+    """
+    Notify the scheduler that a test was queued or finished.
+
+    :param config: the application configuration
+    :type config: dict
+    :param platform: platform of the test, None for all platforms
+    :type platform: TestPlatform
+    :param delay: seconds the scheduler waits before starting the next test, None to start it straight away
+    :type delay: float
+    :return: whether the scheduler got the notification; False when it's not configured or not running
+    :rtype: bool
+    """
+    answer = _request(config, {
+        'type': 'notify', 'platform': None if platform is None else platform.value, 'delay': delay
+    })
+    return answer is not None and answer.get('status') == 'ok'
+
+
+def scheduler_metrics(config) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Get the metrics of the running scheduler.
+
+    :param config: the application configuration
+    :type config: dict
+    :return: the metrics by platform value, or None when the scheduler is not configured or not running
+    :rtype: dict
+    """
+    answer = _request(config, {'type': 'metrics'})
+    if answer is None or answer.get('status') != 'ok':
+        return None
+    return answer['metrics']
+
+
+def run_scheduler(app, config) -> None:
+    """
+    Run the scheduler until interrupted.
+
+    :param app: the application
+    :type app: Flask
+    :param config: the application configuration
+    :type config: dict
+    """
+    import os
+
+    address = config['SCHEDULER_SOCKET']
+    if os.path.exists(address):
+        # left behind by a scheduler that didn't shut down cleanly
+        os.remove(address)
+    scheduler = scheduler_from_config(app, config)
+    try:
+        scheduler.serve_forever(address, _authkey(config))
+    except KeyboardInterrupt:
+        scheduler.stop()
@@ -0,0 +1,121 @@
+"""
+Split the regression tests of a test in shards, each running on its own VM of the platform.
+
+The shards are balanced by the historical runtime of their regression tests: the longest regression tests are handed
+out first, each one to the shard with the least runtime so far. Every shard reports its progress on its own, which is
+merged into the progress of the test, so the test only completes (and its status is only posted to GitHub) once all
+its shards did.
+"""
+
+import heapq
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from mod_test.models import (Test, TestQueueState, TestResult, TestShard,
+                             TestStatus)
+
+# runtime, in ms, of a regression test that never ran when nothing else ran either
+DEFAULT_RUNTIME = 1000.0
+
+
+def balance_shards(runtimes: Dict[int, float], count: int) -> List[List[int]]:
+    """
+    Split regression tests in shards of about the same total runtime.
+
+    :param runtimes: expected runtime by regression test id
+    :type runtimes: dict
+    :param count: number of shards to split in
+    :type count: int
+    :return: the sorted regression test ids of every shard, leaving out empty shards
+    :rtype: List[List[int]]
+    """
+    heap = [(0.0, number) for number in range(max(count, 1))]
+    shards = [[] for _ in heap]  # type: List[List[int]]
+    for regression_id in sorted(runtimes, key=lambda regression_id: (-runtimes[regression_id], regression_id)):
+        total, number = heapq.heappop(heap)
+        shards[number].append(regression_id)
+        heapq.heappush(heap, (total + runtimes[regression_id], number))
+    return [sorted(shard) for shard in shards if len(shard) > 0]
+
+
+def regression_runtimes(db, platform: Any, regression_ids: List[int]) -> Dict[int, float]:
+    """
+    Get the expected runtime of regression tests, from their average runtime on a platform.
+
+    Regression tests that never ran on the platform get the average of the others.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param platform: platform the tests will run on
+    :type platform: TestPlatform
+    :param regression_ids: ids of the regression tests
+    :type regression_ids: list
+    :return: the expected runtime in ms, by regression test id
+    :rtype: dict
+    """
+    averages = db.query(TestResult.regression_test_id, func.avg(TestResult.runtime)).join(
+        Test, Test.id == TestResult.test_id
+    ).filter(
+        Test.platform == platform,
+        TestResult.regression_test_id.in_(regression_ids),
+        TestResult.runtime.isnot(None)
+    ).group_by(TestResult.regression_test_id).all()
+    known = {regression_id: float(runtime) for regression_id, runtime in averages}
+    default = sum(known.values()) / len(known) if len(known) > 0 else DEFAULT_RUNTIME
+    return {regression_id: known.get(regression_id, default) for regression_id in regression_ids}
+
+
+def create_shards(db, test, count: int) -> List[TestShard]:
+    """
+    Split the regression tests of a test in shards, if there's more than one.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param test: the test to split
+    :type test: Test
+    :param count: the number of shards to split in at most
+    :type count: int
+    :return: the shards, not committed yet, or an empty list if the test runs on one VM
+    :rtype: List[TestShard]
+    """
+    runtimes = regression_runtimes(db, test.platform, test.get_customized_regressiontests())
+    split = balance_shards(runtimes, count)
+    if len(split) < 2:
+        return []
+    shards = [TestShard(test.id, number, regression_ids) for number, regression_ids in enumerate(split)]
+    db.add_all(shards)
+    return shards
+
+
+def merge_shard_progress(test, shard, status: Any, message: str) -> Optional[Tuple[Any, str]]:
+    """
+    Store the progress of a shard, and get the progress of its test it leads to.
+
+    A test takes the step the first of its shards reached, is canceled as soon as one shard is canceled and completes
+    once all its shards completed.
+
+    :param test: the sharded test
+    :type test: Test
+    :param shard: the shard reporting its progress
+    :type shard: TestShard
+    :param status: the status the shard reported
+    :type status: TestStatus
+    :param message: the message the shard reported
+    :type message: str
+    :return: the status and message to store for the test, None if the progress of the test doesn't change
+    :rtype: tuple
+    """
+    shard.status = status
+    if status in [TestStatus.completed, TestStatus.canceled]:
+        shard.queue_state = TestQueueState.finished
+
+    if status == TestStatus.canceled:
+        return status, message
+    if status == TestStatus.completed:
+        if all(other.status == TestStatus.completed for other in test.shards):
+            return status, message
+        return None
+    if len(test.progress) == 0 or TestStatus.progress_step(test.progress[-1].status) < TestStatus.progress_step(status):
+        return status, message
+    return None
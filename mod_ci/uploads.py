@@ -0,0 +1,76 @@
+"""
+Store the result files the VMs upload, named by the SHA-256 of their content.
+
+The upload is hashed while it's read, in large chunks, so it's read only once. Results are mostly identical from one
+test to the next, so an upload is kept in memory up to a limit: when a result with the same hash is stored already,
+nothing is written at all. A larger upload is written to a temporary file as it's read, and handed over to the result
+store (see mod_test.result_store) once its hash is known.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+from typing import IO, Optional, Tuple
+
+from mod_test.result_store import ResultStore
+
+# bytes read from an upload at once
+CHUNK_SIZE = 1024 * 1024
+
+# bytes of an upload kept in memory before it's written to a temporary file
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def store_upload(stream: IO[bytes], store: ResultStore, temp_folder: str, extension: str, compress: bool = True,
+                 spool_size: int = SPOOL_SIZE) -> Tuple[str, bool]:
+    """
+    Store an uploaded result under its hash, unless a result with the same content is stored already.
+
+    :param stream: the content of the upload
+    :type stream: IO[bytes]
+    :param store: the store of the results
+    :type store: ResultStore
+    :param temp_folder: folder of the uploads being received
+    :type temp_folder: str
+    :param extension: extension of the result file, with its dot
+    :type extension: str
+    :param compress: False to keep the result uncompressed, as the VMs read it
+    :type compress: bool
+    :param spool_size: bytes of the upload kept in memory before it's written to a temporary file
+    :type spool_size: int
+    :return: the hash of the content, and whether it was written (False if it was stored already)
+    :rtype: tuple
+    """
+    file_hash = hashlib.sha256()
+    buffer = bytearray()
+    spill = None  # type: Optional[IO[bytes]]
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+            if spill is None and len(buffer) + len(chunk) <= spool_size:
+                buffer += chunk
+                continue
+            if spill is None:
+                spill = tempfile.NamedTemporaryFile(dir=temp_folder, delete=False)
+                spill.write(buffer)
+                buffer = bytearray()
+            spill.write(chunk)
+
+        digest = file_hash.hexdigest()
+        name = '{hash}{ext}'.format(hash=digest, ext=extension)
+        if store.exists(name):
+            if not compress:
+                store.materialize(name)
+            return digest, False
+        if spill is None:
+            store.put(name, io.BytesIO(buffer), compress)
+        else:
+            spill.close()
+            store.put_file(name, spill.name, compress)
+        return digest, True
+    finally:
+        if spill is not None:
+            spill.close()
+            if os.path.exists(spill.name):
+                os.remove(spill.name)
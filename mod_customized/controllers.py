@@ -11,6 +11,7 @@ from decorators import get_menu_entries, template_renderer
 from mod_auth.controllers import (check_access_rights,
                                   fetch_username_from_token, login_required)
 from mod_auth.models import Role, User
+from mod_ci.priority import assign_priority, is_main_fork, load_weights
 from mod_customized.forms import TestForkForm
 from mod_customized.models import CustomizedTest, TestFork
 from mod_regression.models import (Category, RegressionTest,
@@ -126,9 +127,12 @@ def add_test_to_kvm(username, commit_hash, platforms, regression_tests) -> None:
         fork = Fork(fork_url)
         g.db.add(fork)
         g.db.commit()
+    main_fork = is_main_fork(fork_url, g.github)
+    weights = load_weights(g.db)
     for platform in platforms:
         platform = TestPlatform.from_string(platform)
         test = Test(platform, TestType.commit, fork.id, 'master', commit_hash)
+        assign_priority(g.db, test, main_fork, weights)
         g.db.add(test)
         g.db.commit()
         for regression_test in regression_tests:
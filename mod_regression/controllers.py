@@ -6,6 +6,7 @@ from flask import (Blueprint, abort, flash, g, jsonify,
 from decorators import template_renderer
 from mod_auth.controllers import check_access_rights, login_required
 from mod_auth.models import Role
+from mod_ci.ci_files import bump_suite_revision
 from mod_regression.forms import AddCategoryForm, AddTestForm, ConfirmationForm, EditTestForm
 from mod_regression.models import (Category, InputType, OutputType,
                                    RegressionTest, RegressionTestOutput)
@@ -105,6 +106,7 @@ def test_delete(regression_id):
 
     if form.validate_on_submit():
         g.db.delete(test)
+        bump_suite_revision(g.db)
         g.db.commit()
         g.log.warning(f'regression test with id: {regression_id} deleted!')
         flash('Regression Test Deleted')
@@ -153,6 +155,7 @@ def test_edit(regression_id):
         test.expected_rc = form.expected_rc.data
         test.input_type = InputType.from_string(form.input_type.data)
         test.output_type = OutputType.from_string(form.output_type.data)
+        bump_suite_revision(g.db)
 
         g.db.commit()
         g.log.info(f'regression test with id: {regression_id} updated!')
@@ -230,6 +233,7 @@ def test_add():
         g.db.add(new_test)
         category = Category.query.filter(Category.id == form.category_id.data).first()
         category.regression_tests.append(new_test)
+        bump_suite_revision(g.db)
         g.db.commit()
         return redirect(url_for('.index'))
     return {'form': form}
@@ -258,6 +262,7 @@ def category_delete(category_id):
 
     if form.validate_on_submit():
         g.db.delete(category)
+        bump_suite_revision(g.db)
         g.db.commit()
         g.log.warning(f'category with id: {category_id} deleted!')
         return redirect(url_for('.index'))
@@ -290,6 +295,7 @@ def category_edit(category_id):
     if form.validate():
         test.name = form.category_name.data
         test.description = form.category_description.data
+        bump_suite_revision(g.db)
         g.db.commit()
         g.log.info(f'category with id: {category_id} updated!')
         flash('Category Updated')
@@ -12,6 +12,7 @@ from flask import Blueprint, g, make_response, redirect, request, url_for
 from decorators import template_renderer
 from mod_auth.controllers import check_access_rights, login_required
 from mod_auth.models import Role
+from mod_ci.ci_files import bump_suite_revision
 from mod_home.models import CCExtractorVersion, GeneralData
 from mod_regression.models import RegressionTest
 from mod_sample.forms import (DeleteAdditionalSampleForm, DeleteSampleForm,
@@ -318,6 +319,8 @@ def delete_sample(sample_id):
 
             os.remove(os.path.join(basedir, sample.filename))
             g.db.delete(sample)
+            # The regression tests of the sample are deleted along with it
+            bump_suite_revision(g.db)
             g.db.commit()
             g.log.warning(f'sample with id: {sample_id} deleted')
             return redirect(url_for('.index'))
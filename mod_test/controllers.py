@@ -3,10 +3,10 @@
 import os
 from datetime import datetime
 from exceptions import TestNotFoundException
-from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
 
 from flask import (Blueprint, Response, abort, g, jsonify, make_response,
-                   redirect, request, url_for)
+                   redirect, request, stream_with_context, url_for)
 from github import GitHub
 from sqlalchemy import and_, func
 from sqlalchemy.sql import label
@@ -14,17 +14,27 @@ from sqlalchemy.sql import label
 from decorators import template_renderer
 from mod_auth.controllers import check_access_rights, login_required
 from mod_auth.models import Role
-from mod_ci.models import Kvm
+from mod_ci.models import Kvm, PlatformStats
+from mod_ci.priority import assign_priority, is_main_fork
 from mod_customized.models import CustomizedTest, TestFork
 from mod_home.models import CCExtractorVersion, GeneralData
 from mod_regression.models import (Category, RegressionTestOutput,
                                    regressionTestLinkTable)
+from mod_test.diff_cache import (DiffCache, diff_cache_from_config, diff_mode,
+                                 read_cached_diff)
 from mod_test.models import (Fork, Test, TestPlatform, TestProgress,
-                             TestResult, TestResultFile, TestStatus, TestType)
+                             TestQueueState, TestResult, TestResultFile,
+                             TestSelection, TestShard, TestStatus, TestType)
+from mod_test.nicediff.cache import region_cache
+from mod_test.nicediff.captions import DEFAULT_TOLERANCE
+from mod_test.nicediff.diff import MAX_NUMBER_OF_LINES_TO_VIEW
 from utility import serve_file_download
 
 mod_test = Blueprint('test', __name__)
 
+# maximum number of diffs in one page of a diff
+MAX_DIFF_PAGE_SIZE = 500
+
 
 @mod_test.before_app_request
 def before_app_request() -> None:
@@ -85,13 +95,11 @@ def get_data_for_test(test, title=None) -> Dict[str, Any]:
     calculates time in minutes and hours
     """
     if len(test.progress) == 0:
-        var_average = 'average_time_' + test.platform.value
-
-        # get average build and prep time.
-        prep_average_key = 'avg_prep_time_' + test.platform.value
-        build_average_key = 'avg_build_time_' + test.platform.value
-        average_prep_time = int(float(GeneralData.query.filter(GeneralData.key == prep_average_key).first().value))
-        average_build_time = int(float(GeneralData.query.filter(GeneralData.key == build_average_key).first().value))
+        # get average build, prep and test time.
+        averages = {stats.phase: stats.mean for stats in PlatformStats.query.filter(
+            PlatformStats.platform == test.platform).all()}
+        average_prep_time = int(averages.get('prep', 0.0))
+        average_build_time = int(averages.get('build', 0.0))
 
         queued_kvm = g.db.query(Kvm.test_id).filter(Kvm.test_id < test.id).subquery()
         queued_kvm_entries = g.db.query(Test.id).filter(
@@ -103,7 +111,7 @@ def get_data_for_test(test, title=None) -> Dict[str, Any]:
         number_kvm_test = g.db.query(Test.id).filter(
             and_(Test.id.in_(queued_kvm), Test.platform == test.platform)
         ).count()
-        average_duration = float(GeneralData.query.filter(GeneralData.key == var_average).first().value)
+        average_duration = averages.get('test', 0.0)
         queued_tests = number_kvm_test
         time_run = 0.00
         for pr_test in kvm_test:
@@ -316,7 +324,9 @@ def generate_diff(test_id: int, regression_test_id: int, output_id: int, to_view
     The function is invoked in two modes: to view and to download. In the 'to view' a max of 50 diffs are returned,
     and in 'to download' all the diffs are returned but as a downloadable HTML.
 
-    We check for XHR when the request is to simply view the diff.
+    We check for XHR when the request is to simply view the diff. Further diffs can be viewed page by page, by passing
+    an offset and a limit (at most MAX_DIFF_PAGE_SIZE) in the query string. The total number of diffs is returned in
+    the X-Diff-Total header of those pages.
 
     :param test_id: id of the test
     :type test_id: int
@@ -340,29 +350,105 @@ def generate_diff(test_id: int, regression_test_id: int, output_id: int, to_view
 
     if result is not None:
         path = os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'TestResults')
+        cache = diff_cache_from_config(config)
 
         if request.is_xhr and to_view == 1:
-            return result.generate_html_diff(path)
+            if 'offset' in request.args or 'limit' in request.args:
+                return _serve_diff_page(cache, result, path)
+            return _serve_diff(cache, result, path, to_view=True)
         elif to_view == 0:
-            diff_html_text = result.generate_html_diff(path, to_view=False)
-            return Response(
-                diff_html_text,
-                mimetype='text/html',
-                headers={
-                    "Content-disposition":
-                        "attachment; filename=test{testid}_regression{regrid}_output{outid}.html".format(
-                            testid=test_id,
-                            regrid=regression_test_id,
-                            outid=output_id
-                        )
-                }
+            response = _serve_diff(cache, result, path, to_view=False)
+            file_name = "test{testid}_regression{regrid}_output{outid}.html".format(
+                testid=test_id,
+                regrid=regression_test_id,
+                outid=output_id
             )
+            response.headers['Content-disposition'] = "attachment; filename={name}".format(name=file_name)
+            return response
         else:
             abort(403, 'generate_diff')
 
     abort(404)
 
 
+def _serve_diff(cache: DiffCache, result: TestResultFile, path: str, to_view: bool) -> Response:
+    """
+    Serve the diff of a result file from the on-disk cache, rendering and caching it on a miss.
+
+    Cached diffs are handed over to nginx when the client accepts gzip, and decompressed on the fly otherwise.
+
+    :param cache: cache of rendered diffs
+    :type cache: DiffCache
+    :param result: the result file to show the diff of
+    :type result: TestResultFile
+    :param path: folder holding the result files
+    :type path: str
+    :param to_view: True if the diff is to be shown in the browser, False for the full diff
+    :type to_view: bool
+    :return: the streamed diff
+    :rtype: Flask response
+    """
+    from run import config
+
+    extension = result.regression_test_output.correct_extension
+    caption_tolerance = config.get('DIFF_CAPTION_TOLERANCE', DEFAULT_TOLERANCE)
+    mode = diff_mode(to_view, extension, caption_tolerance)
+    cached = cache.lookup(result.expected, result.got, mode)
+    if cached is None:
+        chunks = result.stream_html_diff(path, to_view, caption_tolerance)
+        chunks = cache.store(result.expected, result.got, mode, chunks)
+        return Response(stream_with_context(_log_cache_stats(chunks)), mimetype='text/html')
+
+    g.log.debug(f'serving diff from cache: {cached}')
+    if 'gzip' in request.accept_encodings:
+        response = make_response()
+        response.headers['Content-Type'] = 'text/html'
+        response.headers['X-Accel-Redirect'] = '/' + os.path.join(
+            'diffcache-download', cache.relative_path(result.expected, result.got, mode))
+        return response
+    return Response(read_cached_diff(cached), mimetype='text/html')
+
+
+def _serve_diff_page(cache: DiffCache, result: TestResultFile, path: str) -> Response:
+    """
+    Serve the page of the diff of a result file requested through the offset and limit arguments.
+
+    :param cache: cache of rendered diffs, which also keeps the indexes to render pages from
+    :type cache: DiffCache
+    :param result: the result file to show the diff of
+    :type result: TestResultFile
+    :param path: folder holding the result files
+    :type path: str
+    :return: the streamed page
+    :rtype: Flask response
+    """
+    from run import config
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', MAX_NUMBER_OF_LINES_TO_VIEW, type=int), 0), MAX_DIFF_PAGE_SIZE)
+    caption_tolerance = config.get('DIFF_CAPTION_TOLERANCE', DEFAULT_TOLERANCE)
+    total, chunks = result.stream_html_diff_page(
+        path, offset, limit, caption_tolerance, cache.index_path(result.expected, result.got))
+    return Response(
+        stream_with_context(_log_cache_stats(chunks)),
+        mimetype='text/html',
+        headers={'X-Diff-Total': str(total)}
+    )
+
+
+def _log_cache_stats(chunks: Iterator[str]) -> Iterator[str]:
+    """
+    Pass through the chunks of a diff, logging the region cache metrics once it's been sent.
+
+    :param chunks: the HTML chunks of the diff
+    :type chunks: Iterator[str]
+    :return: the same chunks
+    :rtype: Iterator[str]
+    """
+    yield from chunks
+    g.log.debug(f'nicediff region cache: {region_cache.stats()}')
+
+
 @mod_test.route('/log-files/<test_id>')
 def download_build_log_file(test_id):
     """
@@ -409,6 +495,10 @@ def restart_test(test_id):
     TestResultFile.query.filter(TestResultFile.test_id == test.id).delete()
     TestResult.query.filter(TestResult.test_id == test.id).delete()
     TestProgress.query.filter(TestProgress.test_id == test.id).delete()
+    TestShard.query.filter(TestShard.test_id == test.id).delete()
+    TestSelection.query.filter(TestSelection.test_id == test.id).delete()
+    test.queue_state = TestQueueState.queued
+    assign_priority(g.db, test, is_main_fork(test.fork.github, g.github))
     g.db.commit()
     g.log.info(f'test with id: {test_id} restarted')
     return redirect(url_for('.by_id', test_id=test.id))
@@ -435,6 +525,7 @@ def stop_test(test_id):
         message = "Canceled by admin"
     test_progress = TestProgress(test.id, TestStatus.canceled, message)
     g.db.add(test_progress)
+    test.queue_state = TestQueueState.finished
     g.db.commit()
     g.log.info(f'test with id: {test_id} stopped')
     return redirect(url_for('.by_id', test_id=test.id))
@@ -0,0 +1,276 @@
+"""
+Persistent on-disk cache of rendered diffs.
+
+A rendered diff only depends on the content of both files, which are stored under their SHA-256 hash, and on the view
+mode. Rendered diffs are therefore stored gzipped as ``<expected>_<got>_<mode>.html.gz`` and never have to be
+invalidated; the folder is only kept under a maximum size by evicting the least recently used files. The format
+version of the generated HTML is part of the folder name, so a change to nicediff's output doesn't serve stale diffs.
+
+The total size of the cache is kept in a file next to it, shared by all processes storing diffs, so the folder is only
+walked once that total exceeds the maximum size (or isn't known yet). Indexes aren't counted until the next walk.
+"""
+
+import fcntl
+import gzip
+import os
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from mod_test.nicediff.captions import parser_for
+
+# bump this whenever the HTML generated by nicediff changes
+FORMAT_VERSION = 1
+
+# default maximum size of the cache folder, in bytes
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# file in the root of the cache holding its total size in bytes
+SIZE_FILE = 'size'
+
+# number of bytes read at a time when decompressing a cached diff
+CHUNK_SIZE = 64 * 1024
+
+# view modes of a diff
+MODE_VIEW = 'view'
+MODE_FULL = 'full'
+
+
+def diff_mode(to_view: bool, extension: str = '', caption_tolerance: Optional[int] = None) -> str:
+    """
+    Get the cache mode of a diff.
+
+    :param to_view: True if the diff is truncated to be viewed in the browser, False for the full diff
+    :type to_view: bool
+    :param extension: extension of the compared files
+    :type extension: str
+    :param caption_tolerance: timing tolerance of caption files in milliseconds, None to compare them as text
+    :type caption_tolerance: int
+    :return: the mode used in the name of the cached file
+    :rtype: str
+    """
+    mode = MODE_VIEW if to_view else MODE_FULL
+    if caption_tolerance is not None and parser_for(extension) is not None:
+        mode += '-captions{tolerance}'.format(tolerance=caption_tolerance)
+    return mode
+
+
+def diff_cache_from_config(config: Dict[str, Any]) -> 'DiffCache':
+    """
+    Create the diff cache of the sample repository.
+
+    :param config: the platform configuration
+    :type config: dict
+    :return: the diff cache
+    :rtype: DiffCache
+    """
+    return DiffCache(
+        os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'DiffCache'),
+        config.get('DIFF_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)
+    )
+
+
+class DiffCache:
+    """Folder of gzipped, rendered diffs, bounded in size."""
+
+    def __init__(self, root: str, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.root = root
+        self.max_size = max_size
+        self.folder = os.path.join(root, 'v{version}'.format(version=FORMAT_VERSION))
+
+    @staticmethod
+    def file_name(expected: str, got: str, mode: str) -> str:
+        """
+        Get the name of the cached diff of two result files.
+
+        :param expected: hash of the expected file
+        :type expected: str
+        :param got: hash of the obtained file
+        :type got: str
+        :param mode: view mode of the diff
+        :type mode: str
+        :return: name of the cached file
+        :rtype: str
+        """
+        return '{expected}_{got}_{mode}.html.gz'.format(expected=expected, got=got, mode=mode)
+
+    def path(self, expected: str, got: str, mode: str) -> str:
+        """
+        Get the path of the cached diff of two result files.
+
+        :param expected: hash of the expected file
+        :type expected: str
+        :param got: hash of the obtained file
+        :type got: str
+        :param mode: view mode of the diff
+        :type mode: str
+        :return: path of the cached file
+        :rtype: str
+        """
+        return os.path.join(self.folder, self.file_name(expected, got, mode))
+
+    def index_path(self, expected: str, got: str) -> str:
+        """
+        Get the path of the index of the differing rows of two result files, used to render the diff page by page.
+
+        :param expected: hash of the expected file
+        :type expected: str
+        :param got: hash of the obtained file
+        :type got: str
+        :return: path of the index
+        :rtype: str
+        """
+        return os.path.join(self.folder, '{expected}_{got}.index'.format(expected=expected, got=got))
+
+    def relative_path(self, expected: str, got: str, mode: str) -> str:
+        """
+        Get the path of the cached diff relative to the root of the cache, as used for the X-Accel-Redirect location.
+
+        :param expected: hash of the expected file
+        :type expected: str
+        :param got: hash of the obtained file
+        :type got: str
+        :param mode: view mode of the diff
+        :type mode: str
+        :return: relative path of the cached file
+        :rtype: str
+        """
+        return os.path.relpath(self.path(expected, got, mode), self.root)
+
+    def lookup(self, expected: str, got: str, mode: str) -> Optional[str]:
+        """
+        Look up a cached diff, marking it as recently used.
+
+        :param expected: hash of the expected file
+        :type expected: str
+        :param got: hash of the obtained file
+        :type got: str
+        :param mode: view mode of the diff
+        :type mode: str
+        :return: path of the cached file, or None on a miss
+        :rtype: str
+        """
+        path = self.path(expected, got, mode)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, expected: str, got: str, mode: str, chunks: Iterator[str]) -> Iterator[str]:
+        """
+        Pass through the chunks of a diff, while writing them to the cache.
+
+        The diff is written to a temporary file which is only moved in place once all chunks went through, so a
+        partially sent diff (e.g. the client went away) never ends up in the cache.
+
+        :param expected: hash of the expected file
+        :type expected: str
+        :param got: hash of the obtained file
+        :type got: str
+        :param mode: view mode of the diff
+        :type mode: str
+        :param chunks: the HTML chunks of the diff
+        :type chunks: Iterator[str]
+        :return: the same chunks
+        :rtype: Iterator[str]
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        completed = False
+        try:
+            with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+                for chunk in chunks:
+                    compressed.write(chunk.encode('utf-8'))
+                    yield chunk
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, self.path(expected, got, mode))
+            completed = True
+        finally:
+            if not completed:
+                os.remove(temp_path)
+        total = self.update_size(added=size)
+        if total is None or total > self.max_size:
+            self.evict()
+
+    def update_size(self, added: int = 0, total: Optional[int] = None) -> Optional[int]:
+        """
+        Add to the total size of the cache, or set it, while no other process changes it.
+
+        :param added: number of bytes stored
+        :type added: int
+        :param total: the total size found by walking the cache, None to add to the known total
+        :type total: int
+        :return: the new total size, None if it isn't known yet
+        :rtype: int
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, SIZE_FILE), 'a+') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            if total is None:
+                f.seek(0)
+                try:
+                    total = int(f.read()) + added
+                except ValueError:
+                    return None
+            f.seek(0)
+            f.truncate()
+            f.write(str(total))
+        return total
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used diffs and indexes until the cache fits in its maximum size.
+
+        Files of older format versions are never used anymore, so they are the first ones to go. The total size of the
+        cache is updated with the one found.
+
+        :return: the number of removed files
+        :rtype: int
+        """
+        entries = []  # type: List[Tuple[float, int, str]]
+        total = 0
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(('.html.gz', '.index')):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        if total <= self.max_size:
+            self.update_size(total=total)
+            return 0
+
+        removed = 0
+        entries.sort(key=lambda entry: (os.path.dirname(entry[2]) == self.folder, entry[0]))
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.update_size(total=total)
+        return removed
+
+
+def read_cached_diff(path: str) -> Iterator[str]:
+    """
+    Stream a cached diff, decompressing it chunk by chunk.
+
+    :param path: path of the cached file
+    :type path: str
+    :return: the HTML chunks of the diff
+    :rtype: Iterator[str]
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
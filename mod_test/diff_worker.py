@@ -0,0 +1,202 @@
+"""
+Background precomputation of diffs.
+
+Nobody needs the diff of a mismatching result until someone opens the test page, who then has to wait for it to be
+rendered. When enabled through ``DIFF_PRECOMPUTE_WORKERS``, the diffs of every uploaded mismatching result are rendered
+into the diff cache by a pool of worker processes as soon as the result is stored. The number of pending diffs is
+bounded by ``DIFF_PRECOMPUTE_QUEUE_SIZE``; results that don't fit in the queue are simply rendered on demand.
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from logging import Logger
+from typing import Any, Dict, Optional
+
+from mod_test.diff_cache import DiffCache, diff_cache_from_config, diff_mode
+from mod_test.models import TestResultFile
+from mod_test.nicediff import diff
+from mod_test.nicediff.captions import DEFAULT_TOLERANCE
+
+# default number of diffs that can wait for a worker
+DEFAULT_QUEUE_SIZE = 64
+
+
+def render_diffs(cache: DiffCache, base_path: str, expected: str, got: str, extension: str,
+                 caption_tolerance: Optional[int] = None) -> int:
+    """
+    Render the view and download diffs of a result into the cache, unless they're cached already.
+
+    :param cache: cache of rendered diffs
+    :type cache: DiffCache
+    :param base_path: folder holding the result files
+    :type base_path: str
+    :param expected: hash of the expected file
+    :type expected: str
+    :param got: hash of the obtained file
+    :type got: str
+    :param extension: extension of the result files
+    :type extension: str
+    :param caption_tolerance: timing tolerance of caption files in milliseconds, None to compare them as text
+    :type caption_tolerance: int
+    :return: the number of rendered diffs
+    :rtype: int
+    """
+    file_ok = os.path.join(base_path, expected + extension)
+    file_fail = os.path.join(base_path, got + extension)
+    rendered = 0
+    for to_view in (True, False):
+        mode = diff_mode(to_view, extension, caption_tolerance)
+        if cache.lookup(expected, got, mode) is not None:
+            continue
+        chunks = diff.generate_file_diff(file_ok, file_fail, to_view, caption_tolerance)
+        for _ in cache.store(expected, got, mode, chunks):
+            pass
+        rendered += 1
+    return rendered
+
+
+def _render_in_worker(cache_root: str, max_size: int, base_path: str, expected: str, got: str, extension: str,
+                      caption_tolerance: Optional[int]) -> int:
+    return render_diffs(DiffCache(cache_root, max_size), base_path, expected, got, extension, caption_tolerance)
+
+
+class DiffPrecomputer:
+    """Pool of worker processes rendering diffs into the cache, with a bounded number of pending diffs."""
+
+    def __init__(self, workers: int, log: Logger, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.workers = workers
+        self.log = log
+        self.queue_size = queue_size
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pool = None  # type: Optional[ProcessPoolExecutor]
+        self.pending = 0
+        self.dropped = 0
+
+    def _check_fork(self) -> None:
+        """Start a forked process without the pool of its parent; a new one is started on the first submit."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._pool = None
+            self.pending = 0
+            self.dropped = 0
+
+    def submit(self, cache: DiffCache, base_path: str, result_file: TestResultFile,
+               caption_tolerance: Optional[int] = None) -> bool:
+        """
+        Queue the diffs of a mismatching result for rendering.
+
+        :param cache: cache of rendered diffs
+        :type cache: DiffCache
+        :param base_path: folder holding the result files
+        :type base_path: str
+        :param result_file: the stored result
+        :type result_file: TestResultFile
+        :param caption_tolerance: timing tolerance of caption files in milliseconds, None to compare them as text
+        :type caption_tolerance: int
+        :return: True if the result was queued, False if the queue is full
+        :rtype: bool
+        """
+        self._check_fork()
+        with self._lock:
+            if self.pending >= self.queue_size:
+                self.dropped += 1
+                return False
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            future = self._pool.submit(
+                _render_in_worker, cache.root, cache.max_size, base_path, result_file.expected, result_file.got,
+                result_file.regression_test_output.correct_extension, caption_tolerance
+            )
+            self.pending += 1
+        future.add_done_callback(self._done)
+        return True
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self.pending -= 1
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            self.log.error('Precomputing a diff failed: {error}'.format(error=error), exc_info=error)
+
+    def shutdown(self) -> None:
+        """Wait for the pending diffs and stop the worker processes."""
+        self._check_fork()
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+_precomputer = None  # type: Optional[DiffPrecomputer]
+
+
+def get_precomputer(config: Dict[str, Any]) -> Optional[DiffPrecomputer]:
+    """
+    Get the diff precomputer of this process, if enabled.
+
+    :param config: the platform configuration
+    :type config: dict
+    :return: the precomputer, or None if precomputing diffs is disabled
+    :rtype: DiffPrecomputer
+    """
+    global _precomputer
+    workers = config.get('DIFF_PRECOMPUTE_WORKERS', 0)
+    if workers <= 0:
+        return None
+    if _precomputer is None:
+        from run import log
+        _precomputer = DiffPrecomputer(workers, log, config.get('DIFF_PRECOMPUTE_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+    return _precomputer
+
+
+def queue_diffs(config: Dict[str, Any], result_file: TestResultFile) -> bool:
+    """
+    Precompute the diffs of a stored result in the background, if it differs from the expected output.
+
+    :param config: the platform configuration
+    :type config: dict
+    :param result_file: the stored result
+    :type result_file: TestResultFile
+    :return: True if the diffs were queued
+    :rtype: bool
+    """
+    if result_file.got is None or result_file.got == result_file.expected:
+        return False
+    precomputer = get_precomputer(config)
+    if precomputer is None:
+        return False
+    base_path = os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'TestResults')
+    caption_tolerance = config.get('DIFF_CAPTION_TOLERANCE', DEFAULT_TOLERANCE)
+    return precomputer.submit(diff_cache_from_config(config), base_path, result_file, caption_tolerance)
+
+
+def backfill_diffs(db, config: Dict[str, Any], test_id: int) -> int:
+    """
+    Render the missing diffs of all mismatching results of a test.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoping.scoped_session
+    :param config: the platform configuration
+    :type config: dict
+    :param test_id: id of the test
+    :type test_id: int
+    :return: the number of rendered diffs
+    :rtype: int
+    """
+    cache = diff_cache_from_config(config)
+    base_path = os.path.join(config.get('SAMPLE_REPOSITORY', ''), 'TestResults')
+    caption_tolerance = config.get('DIFF_CAPTION_TOLERANCE', DEFAULT_TOLERANCE)
+    result_files = db.query(TestResultFile).filter(
+        TestResultFile.test_id == test_id, TestResultFile.got.isnot(None)).all()
+    rendered = 0
+    for result_file in result_files:
+        if result_file.got == result_file.expected:
+            continue
+        rendered += render_diffs(
+            cache, base_path, result_file.expected, result_file.got,
+            result_file.regression_test_output.correct_extension, caption_tolerance
+        )
+    return rendered
@@ -5,6 +5,9 @@ List of models corresponding to mysql tables:
     [
         'Fork' => 'fork',
         'TestProgress' => 'test_progress',
+        'TestShard' => 'test_shard',
+        'TestChangedFile' => 'test_changed_file',
+        'TestSelection' => 'test_selection',
         'TestResult' => 'test_result',
         'TestResultFile' => 'test_result_file'
     ]
@@ -13,10 +16,11 @@ List of models corresponding to mysql tables:
 import datetime
 import os
 import string
-from typing import Any, Dict, List, Tuple, Type, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
 
 import pytz
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text, orm
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        String, Text, UniqueConstraint, orm)
 from sqlalchemy.orm import relationship
 from tzlocal import get_localzone
 
@@ -24,7 +28,7 @@ import database
 import mod_regression.models
 from database import Base, DeclEnum
 from mod_regression.models import RegressionTest
-from mod_test.nicediff import diff
+from mod_test.nicediff import diff, pages
 
 
 class TestPlatform(DeclEnum):
@@ -77,6 +81,14 @@ class TestStatus(DeclEnum):
                 TestStatus.testing, TestStatus.completed]
 
 
+class TestQueueState(DeclEnum):
+    """Enum to specify where a test is in the queue of its platform."""
+
+    queued = "queued", "Queued"
+    running = "running", "Running"
+    finished = "finished", "Finished"
+
+
 class Fork(Base):
     """Model to store and manage fork."""
 
@@ -108,7 +120,6 @@ class Test(Base):
     """Model to store and manage test."""
 
     __tablename__ = 'test'
-    __table_args__ = {'mysql_engine': 'InnoDB'}
     id = Column(Integer, primary_key=True)
     platform = Column(TestPlatform.db_type(), nullable=False)
     test_type = Column(TestType.db_type(), nullable=False)
@@ -121,6 +132,16 @@ class Test(Base):
     customized_tests = relationship('CustomizedTest', back_populates='test')
     progress = relationship('TestProgress', back_populates='test', order_by='TestProgress.id')
     results = relationship('TestResult', back_populates='test')
+    shards = relationship('TestShard', back_populates='test', order_by='TestShard.number')
+    changed_files = relationship('TestChangedFile', back_populates='test')
+    selection = relationship('TestSelection', uselist=False, back_populates='test')
+    # Denormalized from the progress and the Kvm entries, so the next test to run is found with one index lookup
+    queue_state = Column(TestQueueState.db_type(), nullable=False, default=TestQueueState.queued)
+    priority = Column(Integer(), nullable=False, default=0)
+    __table_args__ = (
+        Index('ix_test_queue', platform, queue_state, priority.desc(), id),
+        {'mysql_engine': 'InnoDB'}
+    )
 
     def __init__(self, platform, test_type, fork_id, branch, commit, pr_nr=0, token=None) -> None:
         """
@@ -147,6 +168,8 @@ class Test(Base):
         self.branch = branch
         self.commit = commit
         self.pr_nr = pr_nr
+        self.queue_state = TestQueueState.queued
+        self.priority = 0
         if token is None:
             # Auto-generate token
             token = self.create_token(64)
@@ -319,6 +342,134 @@ class TestProgress(Base):
         self.timestamp = pytz.utc.localize(self.timestamp, is_dst=None)
 
 
+class TestShard(Base):
+    """Model to store a part of the regression tests of a test, which runs on its own VM."""
+
+    __tablename__ = 'test_shard'
+    id = Column(Integer, primary_key=True)
+    test_id = Column(Integer, ForeignKey('test.id', onupdate="CASCADE", ondelete="CASCADE"), nullable=False)
+    test = relationship('Test', uselist=False, back_populates='shards')
+    number = Column(Integer, nullable=False)
+    # Comma separated ids of the regression tests of the shard
+    regression_ids = Column(Text(), nullable=False)
+    queue_state = Column(TestQueueState.db_type(), nullable=False, default=TestQueueState.queued)
+    # Last progress the shard reported, None until it reports
+    status = Column(TestStatus.db_type(), nullable=True)
+    __table_args__ = (
+        UniqueConstraint(test_id, number),
+        {'mysql_engine': 'InnoDB'}
+    )
+
+    def __init__(self, test_id, number, regression_ids) -> None:
+        """
+        Parametrized constructor for the TestShard model.
+
+        :param test_id: The value of the 'test_id' field of TestShard model
+        :type test_id: int
+        :param number: The value of the 'number' field of TestShard model
+        :type number: int
+        :param regression_ids: The ids of the regression tests of the shard
+        :type regression_ids: list
+        """
+        self.test_id = test_id
+        self.number = number
+        self.regression_ids = ','.join(str(regression_id) for regression_id in regression_ids)
+        self.queue_state = TestQueueState.queued
+        self.status = None
+
+    def __repr__(self) -> str:
+        """
+        Represent a TestShard Model by its 'test_id' and 'number' Field.
+
+        :return: Returns the string containing 'test_id' and 'number' field of the TestShard model
+        :rtype: str
+        """
+        return '<TestShard {id}/{number}>'.format(id=self.test_id, number=self.number)
+
+    def get_regression_ids(self) -> List[int]:
+        """
+        Output the regression ids of the shard.
+
+        :return: Regression IDs
+        :rtype: list
+        """
+        return [int(regression_id) for regression_id in self.regression_ids.split(',') if regression_id != '']
+
+
+class TestChangedFile(Base):
+    """Model to store the source files a test changes, which tells which regression tests it likely impacts."""
+
+    __tablename__ = 'test_changed_file'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    test_id = Column(Integer, ForeignKey('test.id', onupdate="CASCADE", ondelete="CASCADE"), primary_key=True)
+    test = relationship('Test', uselist=False, back_populates='changed_files')
+    path = Column(String(255), primary_key=True, index=True)
+
+    def __init__(self, test_id, path) -> None:
+        """
+        Parametrized constructor for the TestChangedFile model.
+
+        :param test_id: The value of the 'test_id' field of TestChangedFile model
+        :type test_id: int
+        :param path: The value of the 'path' field of TestChangedFile model
+        :type path: str
+        """
+        self.test_id = test_id
+        self.path = path
+
+    def __repr__(self) -> str:
+        """
+        Represent a TestChangedFile Model by its 'test_id' and 'path' Field.
+
+        :return: Returns the string containing 'test_id' and 'path' field of the TestChangedFile model
+        :rtype: str
+        """
+        return '<TestChangedFile {id}: {path}>'.format(id=self.test_id, path=self.path)
+
+
+class TestSelection(Base):
+    """Model to store the regression tests most likely impacted by a test, which run and are reported first."""
+
+    __tablename__ = 'test_selection'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    test_id = Column(Integer, ForeignKey('test.id', onupdate="CASCADE", ondelete="CASCADE"), primary_key=True)
+    test = relationship('Test', uselist=False, back_populates='selection')
+    # Comma separated ids of the selected regression tests, the most likely impacted one first
+    regression_ids = Column(Text(), nullable=False)
+    reported = Column(Boolean(), nullable=False, default=False)
+
+    def __init__(self, test_id, regression_ids) -> None:
+        """
+        Parametrized constructor for the TestSelection model.
+
+        :param test_id: The value of the 'test_id' field of TestSelection model
+        :type test_id: int
+        :param regression_ids: The ids of the selected regression tests
+        :type regression_ids: list
+        """
+        self.test_id = test_id
+        self.regression_ids = ','.join(str(regression_id) for regression_id in regression_ids)
+        self.reported = False
+
+    def __repr__(self) -> str:
+        """
+        Represent a TestSelection Model by its 'test_id' Field.
+
+        :return: Returns the string containing 'test_id' field of the TestSelection model
+        :rtype: str
+        """
+        return '<TestSelection {id}>'.format(id=self.test_id)
+
+    def get_regression_ids(self) -> List[int]:
+        """
+        Output the selected regression ids, the most likely impacted one first.
+
+        :return: Regression IDs
+        :rtype: list
+        """
+        return [int(regression_id) for regression_id in self.regression_ids.split(',') if regression_id != '']
+
+
 class TestResult(Base):
     """Model to store and manage test result."""
 
@@ -440,9 +591,49 @@ class TestResultFile(Base):
         :return: An HTML formatted string.
         :rtype: str
         """
+        return ''.join(self.stream_html_diff(base_path, to_view))
+
+    def stream_html_diff(self, base_path: str, to_view: bool = True,
+                         caption_tolerance: Optional[int] = None) -> Iterator[str]:
+        """
+        Generate diff between correct and test regression_test_output, chunk by chunk.
+
+        Both files are read lazily (once to align them, once to render the differing lines), so neither the files nor
+        the generated HTML have to fit in memory at once.
+
+        :param base_path: The base path for the files location.
+        :type base_path: str
+        :param to_view: True if the diff is to be viewed in browser, False if it is to be downloaded.
+        :type base_path: bool
+        :param caption_tolerance: Timing tolerance in milliseconds when comparing caption files cue by cue, None to
+            compare them line by line.
+        :type caption_tolerance: int
+        :return: An iterator over HTML formatted chunks.
+        :rtype: Iterator[str]
+        """
         file_ok = os.path.join(base_path, self.expected + self.regression_test_output.correct_extension)
         file_fail = os.path.join(base_path, self.got + self.regression_test_output.correct_extension)
-        lines_ok = open(file_ok, 'U').readlines()
-        lines_fail = open(file_fail, 'U').readlines()
+        return diff.generate_file_diff(file_ok, file_fail, to_view, caption_tolerance)
+
+    def stream_html_diff_page(self, base_path: str, offset: int, limit: int, caption_tolerance: Optional[int] = None,
+                              index_path: Optional[str] = None) -> Tuple[int, Iterator[str]]:
+        """
+        Generate one page of the diff between correct and test regression_test_output.
 
-        return diff.get_html_diff(lines_ok, lines_fail, to_view)
+        :param base_path: The base path for the files location.
+        :type base_path: str
+        :param offset: The number of differing lines to skip.
+        :type offset: int
+        :param limit: The maximum number of differing lines to show.
+        :type limit: int
+        :param caption_tolerance: Timing tolerance in milliseconds when comparing caption files cue by cue, None to
+            compare them line by line.
+        :type caption_tolerance: int
+        :param index_path: Where to keep the index of the differing lines between pages, None to not keep it.
+        :type index_path: str
+        :return: The total number of differing lines, and an iterator over the HTML formatted chunks of the page.
+        :rtype: Tuple[int, Iterator[str]]
+        """
+        file_ok = os.path.join(base_path, self.expected + self.regression_test_output.correct_extension)
+        file_fail = os.path.join(base_path, self.got + self.regression_test_output.correct_extension)
+        return pages.generate_file_diff_page(file_ok, file_fail, offset, limit, caption_tolerance, index_path)
@@ -0,0 +1,149 @@
+"""
+Bounded memoization of the line level results of nicediff.
+
+Each worker process keeps one cache, bounded both by number of entries and by (estimated) size in bytes. The least
+recently used entries are evicted first. Keys are compact digests of the compared token sequences, so the cache never
+holds on to the (possibly huge) lines themselves.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence
+
+# default bounds of the cache
+MAX_ENTRIES = 4096
+MAX_BYTES = 16 * 1024 * 1024
+
+
+def make_key(*sequences: Sequence[str]) -> bytes:
+    """
+    Create a compact key for a number of token sequences.
+
+    :param sequences: the token sequences
+    :type sequences: Sequence[str]
+    :return: a 16 byte digest
+    :rtype: bytes
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for sequence in sequences:
+        # The length prefix keeps ('a', 'b') and ('a\x00b',) apart
+        digest.update(len(sequence).to_bytes(8, 'little'))
+        digest.update('\x00'.join(sequence).encode('utf-8', 'surrogatepass'))
+    return digest.digest()
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estimate the memory footprint of a cached value, one level deep.
+
+    :param value: the value to estimate
+    :type value: Any
+    :return: estimated size in bytes
+    :rtype: int
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """Thread safe least recently used cache with entry and byte bounds."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # type: OrderedDict
+        self.clear()
+
+    def _check_fork(self) -> None:
+        """Start a forked process with a fresh lock and an empty cache, instead of a copy of the parent's one."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self.clear()
+
+    def clear(self) -> None:
+        """Drop all entries and reset the metrics."""
+        self._check_fork()
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, key: bytes) -> Optional[Any]:
+        """
+        Get a value from the cache, marking it as recently used.
+
+        :param key: key of the entry
+        :type key: bytes
+        :return: the cached value, or None if absent
+        :rtype: Any
+        """
+        self._check_fork()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: bytes, value: Any) -> None:
+        """
+        Store a value in the cache, evicting the least recently used entries if a bound is exceeded.
+
+        :param key: key of the entry
+        :type key: bytes
+        :param value: value to store
+        :type value: Any
+        """
+        size = estimate_size(value) + sys.getsizeof(key)
+        if size > self.max_bytes:
+            return
+        self._check_fork()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def __len__(self) -> int:
+        """Get the number of entries."""
+        self._check_fork()
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the usage metrics of the cache.
+
+        :return: number of entries, estimated footprint, hits, misses, evictions and hit rate
+        :rtype: dict
+        """
+        self._check_fork()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0
+            }
+
+
+region_cache = LRUCache()
@@ -0,0 +1,215 @@
+"""
+Structured comparison of caption files.
+
+Subtitle outputs (SRT, WebVTT, DFXP/TTML) are parsed into cues, which are aligned on their text with the Myers engine.
+Aligned cues whose timings differ by no more than a tolerance are considered equal, so a small timestamp drift doesn't
+turn every cue of a file into a difference.
+"""
+
+import re
+import xml.etree.ElementTree as ElementTree
+from array import array
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from mod_test.nicediff.myers import matching_blocks
+from mod_test.result_store import open_blob
+
+Cue = NamedTuple('Cue', [('start', int), ('end', int), ('text', str), ('line', int), ('timing', str)])
+
+TIMESTAMP = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})')
+TIMING_LINE = re.compile(r'^\s*(\S+)\s+-->\s+(\S+)')
+CLOCK_TIME = re.compile(r'^(\d+):(\d{2}):(\d{2})(?:\.(\d+))?(?::(\d+))?$')
+OFFSET_TIME = re.compile(r'^(\d+(?:\.\d+)?)(h|m|s|ms)$')
+OFFSET_UNITS = {'h': 3600000, 'm': 60000, 's': 1000, 'ms': 1}
+
+# default maximum timing difference of equal cues, in milliseconds
+DEFAULT_TOLERANCE = 0
+
+
+class CaptionParseError(ValueError):
+    """Raised when a file can't be parsed as captions of its type."""
+
+
+def parse_timestamp(value: str) -> int:
+    """
+    Parse an SRT (00:00:12,340) or WebVTT (00:00:12.340 or 00:12.340) timestamp.
+
+    :param value: the timestamp
+    :type value: str
+    :raises CaptionParseError: when the timestamp is malformed
+    :return: the timestamp in milliseconds
+    :rtype: int
+    """
+    match = TIMESTAMP.fullmatch(value)
+    if match is None:
+        raise CaptionParseError('invalid timestamp: {value}'.format(value=value))
+    hours, minutes, seconds, fraction = match.groups()
+    milliseconds = int(fraction.ljust(3, '0'))
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + milliseconds
+
+
+def parse_time_expression(value: str) -> int:
+    """
+    Parse a TTML time expression, either clock time (00:00:12.340) or an offset (12.34s, 340ms).
+
+    Frames of a clock time are ignored, as the frame rate isn't known here.
+
+    :param value: the time expression
+    :type value: str
+    :raises CaptionParseError: when the time expression is malformed
+    :return: the time in milliseconds
+    :rtype: int
+    """
+    value = value.strip()
+    match = CLOCK_TIME.match(value)
+    if match is not None:
+        hours, minutes, seconds, fraction, _ = match.groups()
+        milliseconds = int((fraction or '0')[:3].ljust(3, '0'))
+        return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + milliseconds
+    match = OFFSET_TIME.match(value)
+    if match is not None:
+        return int(round(float(match.group(1)) * OFFSET_UNITS[match.group(2)]))
+    raise CaptionParseError('invalid time expression: {value}'.format(value=value))
+
+
+def parse_srt(path: str) -> List[Cue]:
+    """
+    Parse the cues of a SubRip or WebVTT file.
+
+    Cues are blocks separated by blank lines, of which the timing line is recognized by its arrow; blocks without one
+    (the WEBVTT header, NOTE and STYLE blocks) are skipped. Cue identifiers are not part of the cue.
+
+    :param path: path of the file
+    :type path: str
+    :raises CaptionParseError: when a timing line is malformed, or the file holds no cues at all
+    :return: the cues, in order
+    :rtype: List[Cue]
+    """
+    cues = []  # type: List[Cue]
+    timing = None  # type: Optional[Tuple[int, int, str, int]]
+    text = []  # type: List[str]
+    with open_blob(path, 'r', encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, start=1):
+            line = line.rstrip('\r\n')
+            if timing is None:
+                match = TIMING_LINE.match(line) if '-->' in line else None
+                if match is not None:
+                    timing = parse_timestamp(match.group(1)), parse_timestamp(match.group(2)), line.strip(), number
+            elif line.strip() == '':
+                cues.append(Cue(timing[0], timing[1], '\n'.join(text), timing[3], timing[2]))
+                timing = None
+                text = []
+            else:
+                text.append(line)
+    if timing is not None:
+        cues.append(Cue(timing[0], timing[1], '\n'.join(text), timing[3], timing[2]))
+    if len(cues) == 0:
+        raise CaptionParseError('no cues found in {path}'.format(path=path))
+    return cues
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def _ttml_text(element: ElementTree.Element) -> str:
+    parts = [element.text or '']
+    for child in element:
+        if _local_name(child.tag) == 'br':
+            parts.append('\n')
+        else:
+            parts.append(_ttml_text(child))
+        parts.append(child.tail or '')
+    return ''.join(parts)
+
+
+def parse_dfxp(path: str) -> List[Cue]:
+    """
+    Parse the cues (timed paragraphs) of a DFXP/TTML file.
+
+    Paragraphs are read as the file is parsed and discarded afterwards, so the document tree is never built in full.
+    The line of a cue is its number, as the XML parser doesn't report line numbers.
+
+    :param path: path of the file
+    :type path: str
+    :raises CaptionParseError: when the file isn't valid XML, or holds no cues at all
+    :return: the cues, in order
+    :rtype: List[Cue]
+    """
+    cues = []  # type: List[Cue]
+    try:
+        with open_blob(path) as f:
+            for _, element in ElementTree.iterparse(f):
+                if _local_name(element.tag) != 'p':
+                    continue
+                attributes = {_local_name(key): value for key, value in element.attrib.items()}
+                if 'begin' in attributes and 'end' in attributes:
+                    start = parse_time_expression(attributes['begin'])
+                    end = parse_time_expression(attributes['end'])
+                    timing = '{begin} --> {end}'.format(begin=attributes['begin'], end=attributes['end'])
+                    cues.append(Cue(start, end, _ttml_text(element).strip(), len(cues) + 1, timing))
+                element.clear()
+    except ElementTree.ParseError as e:
+        raise CaptionParseError('invalid DFXP file {path}: {msg}'.format(path=path, msg=e))
+    if len(cues) == 0:
+        raise CaptionParseError('no cues found in {path}'.format(path=path))
+    return cues
+
+
+PARSERS = {
+    '.srt': parse_srt,
+    '.vtt': parse_srt,
+    '.webvtt': parse_srt,
+    '.dfxp': parse_dfxp,
+    '.ttml': parse_dfxp,
+}  # type: Dict[str, Callable[[str], List[Cue]]]
+
+
+def parser_for(extension: str) -> Optional[Callable[[str], List[Cue]]]:
+    """
+    Get the caption parser of a file extension.
+
+    :param extension: the extension, including the dot
+    :type extension: str
+    :return: the parser, or None if files with this extension aren't captions
+    :rtype: Callable
+    """
+    return PARSERS.get(extension.lower())
+
+
+def differing_cues(correct: List[Cue], result: List[Cue],
+                   tolerance: int = 0) -> Iterator[Tuple[Optional[Cue], Optional[Cue]]]:
+    """
+    Compare two lists of cues, aligning them on their text.
+
+    :param correct: the expected cues
+    :type correct: List[Cue]
+    :param result: the obtained cues
+    :type result: List[Cue]
+    :param tolerance: maximum difference in milliseconds between the start and end times of equal cues
+    :type tolerance: int
+    :return: pairs of differing (expected, obtained) cues, either one being None for a missing or extra cue
+    :rtype: Iterator[Tuple[Optional[Cue], Optional[Cue]]]
+    """
+    ids = {}  # type: Dict[str, int]
+    correct_ids = array('I', [ids.setdefault(cue.text, len(ids)) for cue in correct])
+    result_ids = array('I', [ids.setdefault(cue.text, len(ids)) for cue in result])
+    blocks = matching_blocks(correct_ids, result_ids)
+    blocks.append((len(correct), len(result), 0))
+
+    correct_idx = result_idx = 0
+    for correct_begin, result_begin, size in blocks:
+        # cues with a different text are paired up in order
+        for offset in range(max(correct_begin - correct_idx, result_begin - result_idx)):
+            correct_cue = correct[correct_idx + offset] if correct_idx + offset < correct_begin else None
+            result_cue = result[result_idx + offset] if result_idx + offset < result_begin else None
+            yield correct_cue, result_cue
+        # cues with the same text only differ if their timing drifted too far
+        for offset in range(size):
+            correct_cue = correct[correct_begin + offset]
+            result_cue = result[result_begin + offset]
+            drift = max(abs(correct_cue.start - result_cue.start), abs(correct_cue.end - result_cue.end))
+            if drift > tolerance:
+                yield correct_cue, result_cue
+        correct_idx = correct_begin + size
+        result_idx = result_begin + size
@@ -1,76 +1,46 @@
 import html
+import os
 import re
-from typing import Any, List, Optional, Tuple, Union
+from array import array
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from mod_test.nicediff.cache import make_key, region_cache
+from mod_test.nicediff.captions import (CaptionParseError, Cue, differing_cues,
+                                        parser_for)
+from mod_test.nicediff.myers import matching_blocks
+from mod_test.result_store import open_blob
 
 # number of lines to show in view mode
 MAX_NUMBER_OF_LINES_TO_VIEW = 50
 
-index: dict = dict()  # for optimization
-
-
-def zip_(ls: List[str]) -> str:
-    return ''.join(ls)
-
 
 # compress words and digits to one list
 def compress(s: str) -> List[str]:
     return re.split(r'(\W)', s)
 
 
-# equality factor
-def eq(a: List[str], b: List[str], same_regions: Optional[List[List[int]]] = None,
-       delta_a: int = 0, delta_b: int = 0) -> Union[List[int], List[Union[int, List[str]]]]:
-    if index.get(zip_(a), dict()).get(zip_(b), None) is None:
-        e = 0
-        rez = []    # type: Union[int, Any, List[str]]
-        best_len, a_iter, b_iter = -1, -1, -1
-        find = False
-        for l in range(min(len(a), len(b)), 0, -1):
-            if find:
-                break
-
-            for i in range(len(a) - l + 1):
-                if find:
-                    break
-
-                for j in range(len(b) - l + 1):
-                    if a[i:i + l] != b[j:j + l]:
-                        continue
-
-                    find = True
-                    sub_a_beg = a[0:i]
-                    sub_b_beg = b[0:j]
-                    _e1 = eq(sub_a_beg, sub_b_beg)[0]
-                    sub_a_end = a[i + l:]
-                    sub_b_end = b[j + l:]
-                    _e2 = eq(sub_a_end, sub_b_end)[0]
-
-                    if _e1 + _e2 + l > e:   # type: ignore
-                        e = _e1 + _e2 + l   # type: ignore
-                        best_len = l
-                        a_iter = i
-                        b_iter = j
-                        rez = (eq(sub_a_beg, sub_b_beg)[1] + a[i: i + l] + eq(sub_a_end, sub_b_end)[1])  # type: ignore
-
-        index[zip_(a)] = index.get(zip_(a), dict())
-        index[zip_(a)][zip_(b)] = [e, rez, a_iter, b_iter, best_len]
-
-    if same_regions is not None and index[zip_(a)][zip_(b)][0] > 1:
-        a_iter, b_iter, best_len = index[zip_(a)][zip_(b)][2:]
-        # print(delta)
-        same_regions.append([
-            a_iter + delta_a, a_iter + best_len + delta_a,
-            b_iter + delta_b, b_iter + best_len + delta_b
-        ])
-        sub_a_beg = a[0:a_iter]
-        sub_b_beg = b[0:b_iter]
-        sub_a_end = a[a_iter + best_len:]
-        sub_b_end = b[b_iter + best_len:]
-
-        eq(sub_a_beg, sub_b_beg, same_regions, delta_a, delta_b)
-        eq(sub_a_end, sub_b_end, same_regions, delta_a + a_iter + best_len, delta_b + b_iter + best_len)
-
-    return index[zip_(a)][zip_(b)]
+# map the tokens of both lines to compact integer ids, equal tokens getting equal ids
+def intern_tokens(a: Sequence[str], b: Sequence[str]) -> Tuple[array, array]:
+    ids = {}  # type: Dict[str, int]
+    a_ids = array('I', [ids.setdefault(token, len(ids)) for token in a])
+    b_ids = array('I', [ids.setdefault(token, len(ids)) for token in b])
+    return a_ids, b_ids
+
+
+# common token runs of both lines, as [begin_a, end_a, begin_b, end_b], numbered from the longest one down
+def same_regions(a: List[str], b: List[str]) -> List[List[int]]:
+    key = make_key(a, b)
+    regions = region_cache.get(key)
+    if regions is None:
+        blocks = matching_blocks(*intern_tokens(a, b))
+        # lines sharing at most one token have nothing worth highlighting
+        if sum(size for _, _, size in blocks) <= 1:
+            blocks = []
+        blocks.sort(key=lambda block: -block[2])
+        regions = tuple((i, i + size, j, j + size) for i, j, size in blocks)
+        region_cache.put(key, regions)
+    return [list(region) for region in regions]
 
 
 # processing one line
@@ -79,8 +49,7 @@ def _process(test_result: str, correct: str, suffix_id: str) -> Tuple[str, str]:
     correct = html.escape(correct)
     tr_compr = compress(test_result)
     cr_compr = compress(correct)
-    regions = []    # type: List[List[int]]
-    eq(tr_compr, cr_compr, same_regions=regions)
+    regions = same_regions(tr_compr, cr_compr)
 
     events_test = []    # type: List[List[object]]
     events_correct = []
@@ -126,13 +95,7 @@ def _process(test_result: str, correct: str, suffix_id: str) -> Tuple[str, str]:
     return '<div class="diff-div-text">' + html_test + '</div>', '<div class="diff-div-text">' + html_correct + '</div>'
 
 
-# return generated difference in HTML formatted table
-def get_html_diff(test_correct_lines: List[str], test_res_lines: List[str], to_view: bool = True) -> str:
-
-    # variable to keep count of diff lines noted
-    number_of_noted_diff_lines = 0
-
-    html = """
+HEADER_TABLE = """
     <table>
         <tr>
             <td class="diff-table-td" style="width: 30px;">n&deg;</td>
@@ -144,29 +107,8 @@ def get_html_diff(test_correct_lines: List[str], test_res_lines: List[str], to_v
         </tr>
     </table>"""
 
-    res_len = len(test_res_lines)
-    correct_len = len(test_correct_lines)
-
-    if res_len <= correct_len:
-        use = res_len
-        till = correct_len
-
-    else:
-        use = correct_len
-        till = res_len
-
-    for line in range(use):
-        # stop at 50 lines if test-data for viewing
-        if to_view and number_of_noted_diff_lines >= MAX_NUMBER_OF_LINES_TO_VIEW:
-            break
-
-        if test_correct_lines[line] == test_res_lines[line]:
-            continue
-        html += """
-    <table>"""
-        actual, expected = _process(test_res_lines[line], test_correct_lines[line], suffix_id=str(line))
-
-        html += """
+LINE_TABLE = """
+    <table>
         <tr>
             <td class="diff-table-td" style="width: 30px;">{line_id}</td>
             <td class="diff-table-td">{a}</td>
@@ -174,52 +116,153 @@ def get_html_diff(test_correct_lines: List[str], test_res_lines: List[str], to_v
         <tr>
             <td class="diff-table-td" style="width: 30px;"></td>
             <td class="diff-table-td">{b}</td>
-        </tr>""".format(line_id=line + 1, a=actual, b=expected)
-        html += """
+        </tr>
     </table>"""
 
-        # increase noted diff line by one
-        number_of_noted_diff_lines += 1
-
-    # processing remaining lines
-    for line in range(use, till):
-
-        # stop at 50 lines if test-data for viewing
-        if to_view and number_of_noted_diff_lines >= MAX_NUMBER_OF_LINES_TO_VIEW:
-            break
-
-        html += """
-    <table>"""
-
-        if till == res_len:
-            output, _ = _process(test_res_lines[line], " ", suffix_id=str(line))
-            html += """
-            <tr>
-                <td class="diff-table-td" style="width: 30px;">{line_id}</td>
-                <td class="diff-table-td">{a}</td>
-            </tr>
-            <tr>
-                <td class="diff-table-td" style="width: 30px;"></td>
-                <td class="diff-table-td"></td>
-            </tr>
-            """.format(line_id=line + 1, a=output)
-        else:
-            _, output = _process(" ", test_correct_lines[line], suffix_id=str(line))
-            html += """
-            <tr>
-                <td class="diff-table-td" style="width: 30px;">{line_id}</td>
-                <td class="diff-table-td"></td>
-            </tr>
-            <tr>
-                <td class="diff-table-td" style="width: 30px;"></td>
-                <td class="diff-table-td">{b}</td>
-            </tr>
-            """.format(line_id=line + 1, b=output)
-
-        html += """
-    <table>"""
-
-        # increase noted diff line by one
-        number_of_noted_diff_lines += 1
-
-    return html
+
+# lines of a file that can be iterated over more than once, without keeping them in memory
+class FileLines:
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def __iter__(self) -> Iterator[str]:
+        with open_blob(self.path, 'r') as f:
+            yield from f
+
+
+# one hash per line, which is all the line level alignment needs to keep in memory
+def line_hashes(lines: Iterable[str]) -> array:
+    return array('q', (hash(line) for line in lines))
+
+
+# differing parts of both sides as (begin_correct, end_correct, begin_result, end_result), given their line hashes
+def hunks_from_hashes(correct_hashes: Sequence[int],
+                      result_hashes: Sequence[int]) -> Iterator[Tuple[int, int, int, int]]:
+    correct_idx = result_idx = 0
+    blocks = matching_blocks(correct_hashes, result_hashes)
+    blocks.append((len(correct_hashes), len(result_hashes), 0))
+    for correct_begin, result_begin, size in blocks:
+        if correct_idx < correct_begin or result_idx < result_begin:
+            yield correct_idx, correct_begin, result_idx, result_begin
+        correct_idx = correct_begin + size
+        result_idx = result_begin + size
+
+
+# differing parts of both sides as (begin_correct, end_correct, begin_result, end_result), skipping identical lines
+def changed_hunks(test_correct_lines: Iterable[str],
+                  test_res_lines: Iterable[str]) -> Iterator[Tuple[int, int, int, int]]:
+    return hunks_from_hashes(line_hashes(test_correct_lines), line_hashes(test_res_lines))
+
+
+# one table for a differing row, given the (0 based) line numbers on both sides. A side is None when the row only has
+# a line on the other side.
+def render_row(result: Optional[str], result_line: int, correct: Optional[str], correct_line: int) -> str:
+    if correct is None:
+        # line only present in the result
+        output, _ = _process(result or '', " ", suffix_id=str(result_line))
+        return LINE_TABLE.format(line_id=result_line + 1, a=output, b='')
+    if result is None:
+        # line only present in the expected output
+        _, output = _process(" ", correct, suffix_id='{line}_expected'.format(line=correct_line))
+        return LINE_TABLE.format(line_id=correct_line + 1, a='', b=output)
+    actual, expected = _process(result, correct, suffix_id=str(result_line))
+    return LINE_TABLE.format(line_id=result_line + 1, a=actual, b=expected)
+
+
+# yield the difference in HTML formatted tables, one table per differing line. Lines are first aligned, so an inserted
+# or deleted line only shows up once instead of shifting every line after it. Both sides are iterated twice: once to
+# align them, once to render the differing lines.
+def generate_html_diff(test_correct_lines: Iterable[str], test_res_lines: Iterable[str],
+                       to_view: bool = True) -> Iterator[str]:
+
+    # variable to keep count of diff lines noted
+    number_of_noted_diff_lines = 0
+
+    yield HEADER_TABLE
+
+    correct_iter = iter(test_correct_lines)
+    result_iter = iter(test_res_lines)
+    correct_pos = result_pos = 0
+    for correct_begin, correct_end, result_begin, result_end in changed_hunks(test_correct_lines, test_res_lines):
+        # skip the identical lines up to this hunk
+        for _ in range(correct_begin - correct_pos):
+            next(correct_iter)
+        for _ in range(result_begin - result_pos):
+            next(result_iter)
+        correct_pos = correct_end
+        result_pos = result_end
+
+        for offset in range(max(correct_end - correct_begin, result_end - result_begin)):
+            # stop at 50 lines if test-data for viewing
+            if to_view and number_of_noted_diff_lines >= MAX_NUMBER_OF_LINES_TO_VIEW:
+                return
+
+            correct_line = correct_begin + offset
+            result_line = result_begin + offset
+            correct = next(correct_iter) if correct_line < correct_end else None
+            result = next(result_iter) if result_line < result_end else None
+            yield render_row(result, result_line, correct, correct_line)
+
+            # increase noted diff line by one
+            number_of_noted_diff_lines += 1
+
+
+# one line representation of a cue, timing first
+def _cue_line(cue: Cue) -> str:
+    return '{timing} {text}'.format(timing=cue.timing, text=' '.join(cue.text.splitlines()))
+
+
+# one table for a pair of differing cues, either one being None for a missing or extra cue
+def cue_row(correct_cue: Optional[Cue], result_cue: Optional[Cue]) -> str:
+    return render_row(
+        None if result_cue is None else _cue_line(result_cue), 0 if result_cue is None else result_cue.line - 1,
+        None if correct_cue is None else _cue_line(correct_cue), 0 if correct_cue is None else correct_cue.line - 1
+    )
+
+
+# yield one HTML formatted table per differing cue, without header
+def caption_rows(correct: List[Cue], result: List[Cue], tolerance: int = 0) -> Iterator[str]:
+    for correct_cue, result_cue in differing_cues(correct, result, tolerance):
+        yield cue_row(correct_cue, result_cue)
+
+
+# yield the difference between two lists of caption cues in HTML formatted tables, one table per differing cue
+def generate_caption_diff(correct: List[Cue], result: List[Cue], tolerance: int = 0,
+                          to_view: bool = True) -> Iterator[str]:
+    yield HEADER_TABLE
+
+    rows = caption_rows(correct, result, tolerance)
+    # stop at 50 cues if test-data for viewing
+    yield from islice(rows, MAX_NUMBER_OF_LINES_TO_VIEW) if to_view else rows
+
+
+# the cues of both files if they are caption files that should be compared cue by cue, None otherwise. Files whose
+# cues are all equal still differ somewhere else (numbering, blank lines, styling), which only a line diff shows.
+def parse_captions(correct_path: str, result_path: str,
+                   caption_tolerance: Optional[int]) -> Optional[Tuple[List[Cue], List[Cue]]]:
+    parser = parser_for(os.path.splitext(correct_path)[1])
+    if caption_tolerance is None or parser is None:
+        return None
+    try:
+        cues = parser(correct_path), parser(result_path)
+    except CaptionParseError:
+        return None
+    if next(differing_cues(cues[0], cues[1], caption_tolerance), None) is None:
+        return None
+    return cues
+
+
+# yield the difference between two files in HTML formatted tables. Caption files are compared cue by cue, allowing
+# their timings to differ by caption_tolerance milliseconds, unless it's None or the files can't be parsed as captions.
+def generate_file_diff(correct_path: str, result_path: str, to_view: bool = True,
+                       caption_tolerance: Optional[int] = None) -> Iterator[str]:
+    cues = parse_captions(correct_path, result_path, caption_tolerance)
+    if cues is not None:
+        return generate_caption_diff(cues[0], cues[1], caption_tolerance or 0, to_view)
+    return generate_html_diff(FileLines(correct_path), FileLines(result_path), to_view)
+
+
+# return generated difference in HTML formatted table
+def get_html_diff(test_correct_lines: List[str], test_res_lines: List[str], to_view: bool = True) -> str:
+    return ''.join(generate_html_diff(test_correct_lines, test_res_lines, to_view))
@@ -0,0 +1,216 @@
+"""
+Linear space O(ND) difference engine used by nicediff.
+
+Implements the divide and conquer variant of the algorithm described in E. Myers, "An O(ND) Difference Algorithm
+and Its Variations" (Algorithmica, 1986). The engine works on any pair of indexable sequences whose items can be
+compared with ``==`` (lists of tokens, lists of line hashes, integer arrays, ...).
+"""
+
+from typing import List, Sequence, Tuple
+
+# Above this number of edit steps a single middle snake search is considered too expensive, and the sequences are
+# split at the furthest reaching point instead. This bounds the cost on completely unrelated inputs, at the price of
+# a (slightly) non-minimal result, like GNU diff does.
+MIN_COST_LIMIT = 256
+
+Block = Tuple[int, int, int]
+
+
+def _cost_limit(n: int, m: int) -> int:
+    limit = 1
+    total = n + m
+    while total > 0:
+        total >>= 2
+        limit <<= 1
+    return max(MIN_COST_LIMIT, limit)
+
+
+def _common_prefix(a: Sequence, a_lo: int, b: Sequence, b_lo: int, limit: int) -> int:
+    """
+    Count the items a[a_lo:] and b[b_lo:] have in common at their start, up to limit.
+
+    Compares growing slices at once instead of item by item, which runs in C for lists and (integer) arrays.
+    """
+    length = 0
+    step = 8
+    while length < limit:
+        size = min(step, limit - length)
+        if a[a_lo + length:a_lo + length + size] != b[b_lo + length:b_lo + length + size]:
+            break
+        length += size
+        step <<= 1
+    else:
+        return length
+    # The first differing item is in the last slice, find it halving the step
+    while size > 1:
+        half = size >> 1
+        if a[a_lo + length:a_lo + length + half] == b[b_lo + length:b_lo + length + half]:
+            length += half
+            size -= half
+        else:
+            size = half
+    return length
+
+
+def _common_suffix(a: Sequence, a_hi: int, b: Sequence, b_hi: int, limit: int) -> int:
+    """Count the items a[:a_hi] and b[:b_hi] have in common at their end, up to limit."""
+    length = 0
+    step = 8
+    while length < limit:
+        size = min(step, limit - length)
+        if a[a_hi - length - size:a_hi - length] != b[b_hi - length - size:b_hi - length]:
+            break
+        length += size
+        step <<= 1
+    else:
+        return length
+    while size > 1:
+        half = size >> 1
+        if a[a_hi - length - half:a_hi - length] == b[b_hi - length - half:b_hi - length]:
+            length += half
+            size -= half
+        else:
+            size = half
+    return length
+
+
+def _middle_snake(a: Sequence, a_lo: int, a_hi: int, b: Sequence, b_lo: int, b_hi: int) -> Tuple[int, int, int, int]:
+    """
+    Find the middle snake of an optimal path through the edit graph of a[a_lo:a_hi] and b[b_lo:b_hi].
+
+    :return: the start and end point (x, y, u, v) of the snake, relative to a_lo and b_lo.
+    :rtype: tuple
+    """
+    n = a_hi - a_lo
+    m = b_hi - b_lo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    limit = min(max_d, _cost_limit(n, m))
+    offset = max_d + 1
+    # Forward: furthest x on diagonal k = x - y. Backward: furthest x' (counted from the ends) on diagonal x' - y'.
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            reverse_k = delta - k
+            if odd and -d < reverse_k < d and x + backward[offset + reverse_k] >= n:
+                return start_x, start_y, x, y
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a_hi - x - 1] == b[b_hi - y - 1]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            forward_k = delta - k
+            if not odd and -d <= forward_k <= d and x + forward[offset + forward_k] >= n:
+                return n - x, m - y, n - start_x, m - start_y
+
+    # Too expensive: split at the point of the forward frontier that got the furthest along.
+    best_x, best_y = n // 2, m // 2
+    best = -1
+    for k in range(-limit, limit + 1, 2):
+        x = min(forward[offset + k], n)
+        y = x - k
+        if 0 <= y <= m and best < x + y < n + m:
+            best, best_x, best_y = x + y, x, y
+    return best_x, best_y, best_x, best_y
+
+
+def matching_blocks(a: Sequence, b: Sequence) -> List[Block]:
+    """
+    Compute the runs of items that a and b have in common, following a shortest edit script.
+
+    :param a: first sequence
+    :type a: Sequence
+    :param b: second sequence
+    :type b: Sequence
+    :return: ordered list of (i, j, size) triples meaning a[i:i + size] == b[j:j + size]
+    :rtype: list
+    """
+    pairs = []  # type: List[Tuple[int, int, int]]
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        # Common prefix and suffix are always part of the result
+        prefix = _common_prefix(a, a_lo, b, b_lo, min(a_hi - a_lo, b_hi - b_lo))
+        if prefix > 0:
+            pairs.append((a_lo, b_lo, prefix))
+            a_lo += prefix
+            b_lo += prefix
+        suffix = _common_suffix(a, a_hi, b, b_hi, min(a_hi - a_lo, b_hi - b_lo))
+        if suffix > 0:
+            pairs.append((a_hi - suffix, b_hi - suffix, suffix))
+            a_hi -= suffix
+            b_hi -= suffix
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+
+        x, y, u, v = _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi)
+        if u > x:
+            pairs.append((a_lo + x, b_lo + y, u - x))
+        stack.append((a_lo + u, a_hi, b_lo + v, b_hi))
+        stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+
+    pairs.sort()
+    return _compact(a, b, _merge(pairs))
+
+
+def _merge(pairs: List[Block]) -> List[Block]:
+    blocks = []  # type: List[Block]
+    for i, j, size in pairs:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            last_i, last_j, last_size = blocks.pop()
+            blocks.append((last_i, last_j, last_size + size))
+        else:
+            blocks.append((i, j, size))
+    return blocks
+
+
+def _compact(a: Sequence, b: Sequence, blocks: List[Block]) -> List[Block]:
+    """
+    Slide pure insertions and deletions towards the start of the sequences.
+
+    A shortest edit script is not unique; moving every one-sided change as far up as possible makes the result
+    deterministic and keeps the longer common runs together at the end of a changed region.
+    """
+    result = list(blocks)
+    for idx in range(len(result) - 1):
+        i, j, size = result[idx]
+        next_i, next_j, next_size = result[idx + 1]
+        gap_a = next_i - (i + size)
+        gap_b = next_j - (j + size)
+        if gap_a and gap_b:
+            continue
+        if gap_a:
+            while size > 0 and a[i + size - 1] == a[next_i - 1]:
+                size -= 1
+                next_i -= 1
+                next_j -= 1
+                next_size += 1
+        elif gap_b:
+            while size > 0 and b[j + size - 1] == b[next_j - 1]:
+                size -= 1
+                next_i -= 1
+                next_j -= 1
+                next_size += 1
+        result[idx] = (i, j, size)
+        result[idx + 1] = (next_i, next_j, next_size)
+    return _merge([block for block in result if block[2] > 0])
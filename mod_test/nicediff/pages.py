@@ -0,0 +1,289 @@
+"""
+Paged rendering of the difference between two files.
+
+Both files are scanned once to build an index of the differing rows: the aligned hunks, split in chunks of at most
+``CHECKPOINT_ROWS`` rows, each with the byte offset of its first line in both files. Any page of differences is then
+rendered by seeking straight to the chunk holding its first row, without reading or aligning the lines before it. The
+index is small (one record per chunk of differing rows) and can be stored next to the rendered diffs.
+
+Lines are split and their endings normalised like the full diff reads them in text mode, so both count the same rows.
+Compressed blobs can't jump to an offset: seeking forward decompresses everything in between, and seeking backward
+decompresses from the start again. A page reads its chunks in order, so it decompresses the part of the files before
+its last row once.
+"""
+
+import os
+import re
+import tempfile
+from array import array
+from bisect import bisect_right
+from typing import IO, Iterator, List, Optional, Tuple
+
+from mod_test.nicediff.captions import differing_cues
+from mod_test.nicediff.diff import (HEADER_TABLE, cue_row, hunks_from_hashes,
+                                    parse_captions, render_row)
+from mod_test.result_store import open_blob
+
+# maximum number of rows between two points of the index
+CHECKPOINT_ROWS = 64
+
+# bump this whenever the layout of a stored index changes
+INDEX_VERSION = 2
+
+# fields per record: begin and end in the expected file, begin and end in the result, byte offsets of both begins
+RECORD_SIZE = 6
+
+
+# a line ends with any of \r\n, \r and \n, as with the universal newlines of text mode
+NEWLINE = re.compile(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+')
+
+
+class _Lines:
+    """Lines of a file opened in binary mode, split like text mode does and ending with a line feed."""
+
+    def __init__(self, f: IO[bytes]) -> None:
+        self.f = f
+        # byte offset of the next line
+        self.position = 0
+        # lines of the last line read from the file, as stored
+        self.pending = []  # type: List[bytes]
+
+    def seek(self, offset: int) -> None:
+        """
+        Move to the line starting at a byte offset, without seeking the file when that line was read already.
+
+        :param offset: byte offset of the line
+        :type offset: int
+        """
+        while len(self.pending) > 0 and self.position < offset:
+            self.position += len(self.pending.pop(0))
+        if self.position != offset:
+            self.f.seek(offset)
+            self.position = offset
+            self.pending = []
+
+    def readline(self) -> bytes:
+        """
+        Read the next line.
+
+        :return: the line, its ending replaced by a line feed, or an empty string at the end of the file
+        :rtype: bytes
+        """
+        if len(self.pending) == 0:
+            self.pending = NEWLINE.findall(self.f.readline())
+            if len(self.pending) == 0:
+                return b''
+        line = self.pending.pop(0)
+        self.position += len(line)
+        if line.endswith(b'\r\n'):
+            return line[:-2] + b'\n'
+        if line.endswith(b'\r'):
+            return line[:-1] + b'\n'
+        return line
+
+
+def _scan(path: str) -> Tuple[array, array]:
+    hashes = array('q')
+    offsets = array('q')
+    with open_blob(path) as f:
+        lines = _Lines(f)
+        while True:
+            position = lines.position
+            line = lines.readline()
+            if line == b'':
+                break
+            offsets.append(position)
+            hashes.append(hash(line))
+    offsets.append(lines.position)
+    return hashes, offsets
+
+
+class DiffIndex:
+    """Index of the differing rows of two files."""
+
+    def __init__(self, records: array) -> None:
+        self.records = records
+        # first row of every record, followed by the total
+        self.starts = array('q', [0])
+        for idx in range(0, len(records), RECORD_SIZE):
+            correct_begin, correct_end, result_begin, result_end = records[idx:idx + 4]
+            self.starts.append(self.starts[-1] + max(correct_end - correct_begin, result_end - result_begin))
+
+    @classmethod
+    def build(cls, correct_path: str, result_path: str) -> 'DiffIndex':
+        """
+        Align two files and index their differing rows.
+
+        :param correct_path: path of the expected file
+        :type correct_path: str
+        :param result_path: path of the obtained file
+        :type result_path: str
+        :return: the index
+        :rtype: DiffIndex
+        """
+        correct_hashes, correct_offsets = _scan(correct_path)
+        result_hashes, result_offsets = _scan(result_path)
+        records = array('q')
+        for correct_begin, correct_end, result_begin, result_end in hunks_from_hashes(correct_hashes, result_hashes):
+            # rows of a hunk pair up the lines of both sides in order, so a hunk splits into independent chunks
+            for row in range(0, max(correct_end - correct_begin, result_end - result_begin), CHECKPOINT_ROWS):
+                chunk_correct = min(correct_begin + row, correct_end)
+                chunk_result = min(result_begin + row, result_end)
+                records.extend([
+                    chunk_correct, min(correct_begin + row + CHECKPOINT_ROWS, correct_end),
+                    chunk_result, min(result_begin + row + CHECKPOINT_ROWS, result_end),
+                    correct_offsets[chunk_correct], result_offsets[chunk_result]
+                ])
+        return cls(records)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['DiffIndex']:
+        """
+        Load a stored index.
+
+        :param path: path of the index
+        :type path: str
+        :return: the index, or None if it doesn't exist or has an older layout
+        :rtype: DiffIndex
+        """
+        records = array('q')
+        try:
+            with open(path, 'rb') as f:
+                records.frombytes(f.read())
+        except (OSError, ValueError):
+            return None
+        if len(records) == 0 or records[0] != INDEX_VERSION or (len(records) - 1) % RECORD_SIZE != 0:
+            return None
+        return cls(records[1:])
+
+    def save(self, path: str) -> None:
+        """
+        Store the index, atomically.
+
+        :param path: path of the index
+        :type path: str
+        """
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write((array('q', [INDEX_VERSION]) + self.records).tobytes())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @property
+    def rows(self) -> int:
+        """Total number of differing rows."""
+        return self.starts[-1]
+
+    def __len__(self) -> int:
+        """Get the number of chunks."""
+        return len(self.records) // RECORD_SIZE
+
+    def rows_of(self, chunk: int, first_row: int, correct: _Lines, result: _Lines) -> Iterator[str]:
+        """
+        Render the rows of a chunk, starting from one of its rows.
+
+        :param chunk: number of the chunk
+        :type chunk: int
+        :param first_row: first row to render, relative to the chunk
+        :type first_row: int
+        :param correct: the lines of the expected file
+        :type correct: _Lines
+        :param result: the lines of the obtained file
+        :type result: _Lines
+        :return: HTML formatted tables, one per row
+        :rtype: Iterator[str]
+        """
+        idx = chunk * RECORD_SIZE
+        correct_begin, correct_end, result_begin, result_end, correct_offset, result_offset = \
+            self.records[idx:idx + RECORD_SIZE]
+        correct.seek(correct_offset)
+        result.seek(result_offset)
+        for row in range(self.starts[chunk + 1] - self.starts[chunk]):
+            correct_line = correct_begin + row
+            result_line = result_begin + row
+            correct_text = correct.readline() if correct_line < correct_end else None
+            result_text = result.readline() if result_line < result_end else None
+            if row < first_row:
+                continue
+            yield render_row(
+                None if result_text is None else result_text.decode('utf-8', 'replace'), result_line,
+                None if correct_text is None else correct_text.decode('utf-8', 'replace'), correct_line
+            )
+
+    def page(self, correct_path: str, result_path: str, offset: int, limit: int) -> Iterator[str]:
+        """
+        Render a page of differing rows.
+
+        :param correct_path: path of the expected file
+        :type correct_path: str
+        :param result_path: path of the obtained file
+        :type result_path: str
+        :param offset: number of differing rows to skip
+        :type offset: int
+        :param limit: maximum number of rows to render
+        :type limit: int
+        :return: HTML formatted tables, one per row
+        :rtype: Iterator[str]
+        """
+        if offset >= self.rows or limit <= 0:
+            return
+        chunk = bisect_right(self.starts, offset) - 1
+        with open_blob(correct_path) as correct, open_blob(result_path) as result:
+            correct_lines, result_lines = _Lines(correct), _Lines(result)
+            first_row = offset - self.starts[chunk]
+            while chunk < len(self) and limit > 0:
+                for table in self.rows_of(chunk, first_row, correct_lines, result_lines):
+                    yield table
+                    limit -= 1
+                    if limit == 0:
+                        return
+                chunk += 1
+                first_row = 0
+
+
+def generate_file_diff_page(correct_path: str, result_path: str, offset: int, limit: int,
+                            caption_tolerance: Optional[int] = None,
+                            index_path: Optional[str] = None) -> Tuple[int, Iterator[str]]:
+    """
+    Render a page of the difference between two files, the first one starting with the header.
+
+    Caption files are compared cue by cue like in the full diff; that comparison is cheap enough to redo for every page.
+
+    :param correct_path: path of the expected file
+    :type correct_path: str
+    :param result_path: path of the obtained file
+    :type result_path: str
+    :param offset: number of differing rows to skip
+    :type offset: int
+    :param limit: maximum number of rows to render
+    :type limit: int
+    :param caption_tolerance: timing tolerance of caption files in milliseconds, None to compare them as text
+    :type caption_tolerance: int
+    :param index_path: where to store the index of the files between requests, None to build it for every page
+    :type index_path: str
+    :return: the total number of differing rows, and the HTML chunks of the page
+    :rtype: Tuple[int, Iterator[str]]
+    """
+    cues = parse_captions(correct_path, result_path, caption_tolerance)
+    if cues is not None:
+        pairs = list(differing_cues(cues[0], cues[1], caption_tolerance or 0))
+        tables = (cue_row(correct_cue, result_cue) for correct_cue, result_cue in pairs[offset:offset + limit])
+        return len(pairs), _with_header(offset, tables)
+
+    index = None if index_path is None else DiffIndex.load(index_path)
+    if index is None:
+        index = DiffIndex.build(correct_path, result_path)
+        if index_path is not None:
+            index.save(index_path)
+    return index.rows, _with_header(offset, index.page(correct_path, result_path, offset, limit))
+
+
+def _with_header(offset: int, tables: Iterator[str]) -> Iterator[str]:
+    if offset == 0:
+        yield HEADER_TABLE
+    yield from tables
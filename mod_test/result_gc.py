@@ -0,0 +1,65 @@
+"""
+Garbage collection of the result blobs nothing references anymore.
+
+The references of a blob are counted from the expected and obtained hashes of the stored results (TestResultFile) and
+the correct hashes of the regression test outputs (RegressionTestOutput). Blobs without any reference are removed,
+unless they were stored recently, as an upload is stored just before the result referencing it.
+"""
+
+import re
+from typing import Dict, Tuple
+
+from sqlalchemy import func
+
+from mod_regression.models import RegressionTestOutput
+from mod_test.models import TestResultFile
+from mod_test.result_store import ResultStore
+
+# seconds a blob is kept after it was stored, even without references
+DEFAULT_MIN_AGE = 24 * 60 * 60
+
+# blobs are named by the SHA-256 of their content, anything else in the store is left alone
+BLOB_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+
+def reference_counts(db) -> Dict[str, int]:
+    """
+    Count the references to every blob.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :return: the number of references, by hash of the blob
+    :rtype: dict
+    """
+    counts = {}  # type: Dict[str, int]
+    for column in [TestResultFile.expected, TestResultFile.got, RegressionTestOutput.correct]:
+        for blob_hash, references in db.query(column, func.count()).filter(column.isnot(None)).group_by(column):
+            counts[blob_hash] = counts.get(blob_hash, 0) + references
+    return counts
+
+
+def collect_garbage(db, store: ResultStore, min_age: float = DEFAULT_MIN_AGE, dry_run: bool = False) -> Tuple[int, int]:
+    """
+    Remove the blobs nothing references.
+
+    :param db: database connection
+    :type db: sqlalchemy.orm.scoped_session
+    :param store: the store of the result blobs
+    :type store: ResultStore
+    :param min_age: seconds a blob is kept after it was stored, even without references
+    :type min_age: float
+    :param dry_run: True to only count the blobs that would be removed
+    :type dry_run: bool
+    :return: the number of removed blobs, and the number of bytes freed
+    :rtype: tuple
+    """
+    counts = reference_counts(db)
+    removed = 0
+    freed = 0
+    for name in sorted(set(store.names())):
+        blob_hash = name.split('.', 1)[0]
+        if BLOB_HASH.match(blob_hash) is None or counts.get(blob_hash, 0) > 0 or store.age(name) < min_age:
+            continue
+        removed += 1
+        freed += store.size(name) if dry_run else store.remove(name)
+    return removed, freed
@@ -0,0 +1,406 @@
+"""
+Content addressed store of the result files, the blobs of the TestResults folder of the sample repository.
+
+A blob is named by the SHA-256 of its content followed by the extension of the output, like ``<hash>.srt``. New blobs
+are compressed with the codec set in RESULT_COMPRESSION (gzip, or zstd when the zstandard package is installed), and
+get the suffix of that codec (``<hash>.srt.gz``). Readers go through open_blob, which finds a blob whatever its codec
+and decompresses it as it's read, so blobs stored before compression was enabled keep working.
+
+The VMs read the results of the baseline test straight from the folder, so those are kept uncompressed; see
+FileResultStore.materialize.
+"""
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import time
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, cast
+
+# bytes copied at once when storing a blob
+CHUNK_SIZE = 1024 * 1024
+
+
+class Codec:
+    """Compression of stored blobs, recognized by the suffix it adds to their names. This one leaves them as is."""
+
+    name = 'none'
+    suffix = ''
+
+    def available(self) -> bool:
+        """Check whether the codec can be used."""
+        return True
+
+    def open_read(self, path: str) -> IO[bytes]:
+        """
+        Open a blob, decompressing it as it's read.
+
+        :param path: path of the blob, with the suffix of the codec
+        :type path: str
+        :return: the decompressed content, seekable
+        :rtype: IO[bytes]
+        """
+        return open(path, 'rb')
+
+    def open_write(self, path: str) -> IO[bytes]:
+        """
+        Create a blob, compressing it as it's written.
+
+        :param path: path of the blob, with the suffix of the codec
+        :type path: str
+        :return: the file to write the content to
+        :rtype: IO[bytes]
+        """
+        return open(path, 'wb')
+
+
+class GzipCodec(Codec):
+    """Blobs compressed with gzip."""
+
+    name = 'gzip'
+    suffix = '.gz'
+
+    def open_read(self, path: str) -> IO[bytes]:
+        """Open a gzipped blob, see Codec.open_read."""
+        return cast(IO[bytes], gzip.open(path, 'rb'))
+
+    def open_write(self, path: str) -> IO[bytes]:
+        """Create a gzipped blob, see Codec.open_write."""
+        return cast(IO[bytes], gzip.open(path, 'wb', compresslevel=6))
+
+
+class ZstdCodec(Codec):
+    """Blobs compressed with zstd, which needs the zstandard package."""
+
+    name = 'zstd'
+    suffix = '.zst'
+
+    def available(self) -> bool:
+        """Check whether the zstandard package is installed."""
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def open_read(self, path: str) -> IO[bytes]:
+        """Open a zstd compressed blob, see Codec.open_read."""
+        import zstandard
+
+        def reader() -> Any:
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return cast(IO[bytes], io.BufferedReader(SeekableReader(reader), CHUNK_SIZE))
+
+    def open_write(self, path: str) -> IO[bytes]:
+        """Create a zstd compressed blob, see Codec.open_write."""
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb'), closefd=True)
+
+
+class SeekableReader(io.RawIOBase):
+    """
+    Seekable view of a decompressing stream.
+
+    Seeking forward skips the content in between, seeking backward starts decompressing from the beginning again.
+    """
+
+    def __init__(self, reader: Callable[[], Any]) -> None:
+        super().__init__()
+        self.reader = reader
+        self.stream = reader()
+        self.position = 0
+
+    def readable(self) -> bool:
+        """Check whether the stream can be read, which it always can."""
+        return True
+
+    def seekable(self) -> bool:
+        """Check whether the stream can be seeked, which it always can."""
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        """Read decompressed content into a buffer, see io.RawIOBase.readinto."""
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        """Get the position in the decompressed content."""
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move to a position in the decompressed content, see io.RawIOBase.seek."""
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('can only seek from the start or the current position')
+        if offset < self.position:
+            self.stream.close()
+            self.stream = self.reader()
+            self.position = 0
+        while self.position < offset:
+            skipped = len(self.stream.read(min(CHUNK_SIZE, offset - self.position)))
+            if skipped == 0:
+                break
+            self.position += skipped
+        return self.position
+
+    def close(self) -> None:
+        """Close the decompressing stream."""
+        if not self.closed:
+            self.stream.close()
+        super().close()
+
+
+CODECS = {codec.name: codec for codec in [Codec(), GzipCodec(), ZstdCodec()]}
+
+
+def stored_files(path: str) -> List[str]:
+    """
+    Get the stored files of a blob, one per codec it's stored with.
+
+    :param path: path of the blob, without the suffix of a codec
+    :type path: str
+    :return: the paths of the files
+    :rtype: List[str]
+    """
+    return [path + codec.suffix for codec in CODECS.values() if os.path.exists(path + codec.suffix)]
+
+
+def open_blob(path: str, mode: str = 'rb', encoding: Optional[str] = None, errors: Optional[str] = None) -> IO:
+    """
+    Open a blob for reading, whatever its codec, decompressing it as it's read.
+
+    :param path: path of the blob, without the suffix of a codec
+    :type path: str
+    :param mode: 'rb' for bytes, 'r' for text
+    :type mode: str
+    :param encoding: encoding of the text, UTF-8 by default
+    :type encoding: str
+    :param errors: how to handle encoding errors of the text
+    :type errors: str
+    :raises FileNotFoundError: when the blob isn't stored
+    :return: the content of the blob
+    :rtype: IO
+    """
+    codec = next((codec for codec in CODECS.values() if os.path.exists(path + codec.suffix)), None)
+    if codec is None:
+        raise FileNotFoundError(path)
+    stream = codec.open_read(path + codec.suffix)
+    if 'b' in mode:
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding or 'utf-8', errors=errors)
+
+
+class ResultStore:
+    """Interface of the stores of result blobs."""
+
+    def exists(self, name: str) -> bool:
+        """
+        Check whether a blob is stored.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :return: True if it's stored, whatever its codec
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    def open(self, name: str) -> IO[bytes]:
+        """
+        Open a blob, decompressing it as it's read.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :raises FileNotFoundError: when the blob isn't stored
+        :return: the content of the blob
+        :rtype: IO[bytes]
+        """
+        raise NotImplementedError
+
+    def put(self, name: str, source: IO[bytes], compress: bool = True) -> None:
+        """
+        Store a blob.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :param source: the content of the blob
+        :type source: IO[bytes]
+        :param compress: False to store the blob uncompressed
+        :type compress: bool
+        """
+        raise NotImplementedError
+
+    def put_file(self, name: str, path: str, compress: bool = True) -> None:
+        """
+        Store a blob from a file, which is taken over.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :param path: path of the file holding the content of the blob, on the same file system as the store
+        :type path: str
+        :param compress: False to store the blob uncompressed
+        :type compress: bool
+        """
+        raise NotImplementedError
+
+    def materialize(self, name: str) -> None:
+        """
+        Make sure a stored blob is also available uncompressed.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        """
+        raise NotImplementedError
+
+    def names(self) -> Iterator[str]:
+        """
+        Iterate over the names of the stored blobs, once per codec they're stored with.
+
+        :return: the names of the blobs
+        :rtype: Iterator[str]
+        """
+        raise NotImplementedError
+
+    def age(self, name: str) -> float:
+        """
+        Get the time since a blob was last stored.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :return: the age in seconds
+        :rtype: float
+        """
+        raise NotImplementedError
+
+    def size(self, name: str) -> int:
+        """
+        Get the space a blob takes.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :return: the size in bytes, of all the codecs it's stored with
+        :rtype: int
+        """
+        raise NotImplementedError
+
+    def remove(self, name: str) -> int:
+        """
+        Remove a blob, stored with any codec.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :return: the number of bytes freed
+        :rtype: int
+        """
+        raise NotImplementedError
+
+
+class FileResultStore(ResultStore):
+    """Store of result blobs in a folder, compressed with a codec."""
+
+    def __init__(self, root: str, codec: Codec, temp_folder: Optional[str] = None) -> None:
+        self.root = root
+        self.codec = codec
+        self.temp_folder = temp_folder or root
+
+    def path(self, name: str) -> str:
+        """
+        Get the path of a blob, without the suffix of a codec.
+
+        :param name: name of the blob, its hash and extension
+        :type name: str
+        :return: the path
+        :rtype: str
+        """
+        return os.path.join(self.root, name)
+
+    def exists(self, name: str) -> bool:
+        """Check whether a blob is stored, see ResultStore.exists."""
+        return len(stored_files(self.path(name))) > 0
+
+    def open(self, name: str) -> IO[bytes]:
+        """Open a blob, see ResultStore.open."""
+        return open_blob(self.path(name))
+
+    def put(self, name: str, source: IO[bytes], compress: bool = True) -> None:
+        """Store a blob, written to a temporary file first so it appears at once, see ResultStore.put."""
+        codec = self.codec if compress else CODECS['none']
+        handle, temp_path = tempfile.mkstemp(dir=self.temp_folder, suffix='.tmp')
+        os.close(handle)
+        try:
+            with codec.open_write(temp_path) as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+            os.rename(temp_path, self.path(name) + codec.suffix)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def put_file(self, name: str, path: str, compress: bool = True) -> None:
+        """Store a blob from a file, moving it into place when it's kept uncompressed, see ResultStore.put_file."""
+        if not compress or self.codec.suffix == '':
+            os.rename(path, self.path(name))
+            return
+        with open(path, 'rb') as source:
+            self.put(name, source, compress)
+        os.remove(path)
+
+    def materialize(self, name: str) -> None:
+        """Decompress a blob stored compressed only, see ResultStore.materialize."""
+        if os.path.exists(self.path(name)):
+            return
+        with self.open(name) as source:
+            self.put(name, source, compress=False)
+
+    def names(self) -> Iterator[str]:
+        """Iterate over the names of the stored blobs, see ResultStore.names."""
+        suffixes = [codec.suffix for codec in CODECS.values() if codec.suffix != '']
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            suffix = next((suffix for suffix in suffixes if entry.name.endswith(suffix)), '')
+            yield entry.name[:len(entry.name) - len(suffix)]
+
+    def size(self, name: str) -> int:
+        """Get the space a blob takes, see ResultStore.size."""
+        return sum(os.path.getsize(path) for path in stored_files(self.path(name)))
+
+    def remove(self, name: str) -> int:
+        """Remove a blob, see ResultStore.remove."""
+        freed = 0
+        for path in stored_files(self.path(name)):
+            freed += os.path.getsize(path)
+            os.remove(path)
+        return freed
+
+    def age(self, name: str) -> float:
+        """Get the time since a blob was last stored, see ResultStore.age."""
+        stored = [os.path.getmtime(path) for path in stored_files(self.path(name))]
+        return time.time() - max(stored) if len(stored) > 0 else 0.0
+
+
+# the stores results can be kept in, by the name RESULT_STORE refers to them with
+STORES = {
+    'filesystem': FileResultStore,
+}
+
+
+def result_store_from_config(config: Dict[str, Any]) -> ResultStore:
+    """
+    Create the store of the result blobs, in the sample repository.
+
+    Falls back on gzip when zstd is configured but the zstandard package isn't installed.
+
+    :param config: the platform configuration
+    :type config: dict
+    :return: the store
+    :rtype: ResultStore
+    """
+    codec = CODECS.get(config.get('RESULT_COMPRESSION', 'none'), CODECS['none'])
+    if not codec.available():
+        codec = CODECS['gzip']
+    folder = config.get('SAMPLE_REPOSITORY', '')
+    store_class = STORES[config.get('RESULT_STORE', 'filesystem')]
+    return store_class(os.path.join(folder, 'TestResults'), codec, os.path.join(folder, 'TempFiles'))
@@ -15,7 +15,8 @@ from mod_regression.models import (Category, InputType, OutputType,
                                    RegressionTest, RegressionTestOutput)
 from mod_sample.models import ForbiddenExtension, ForbiddenMimeType, Sample
 from mod_test.models import (Fork, Test, TestPlatform, TestProgress,
-                             TestResult, TestResultFile, TestStatus, TestType)
+                             TestQueueState, TestResult, TestResultFile,
+                             TestStatus, TestType)
 from mod_upload.models import Platform, Upload
 
 
@@ -267,6 +268,8 @@ class BaseTestCase(TestCase):
             TestProgress(2, TestStatus.completed, "Test 2 completed")
         ]
         g.db.add_all(test_result_progress)
+        for finished_test in test:
+            finished_test.queue_state = TestQueueState.finished
         g.db.commit()
 
         test_results = [
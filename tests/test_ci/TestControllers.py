@@ -1,3 +1,4 @@
+import datetime
 import json
 from importlib import reload
 
@@ -7,11 +8,12 @@ from werkzeug.datastructures import Headers
 
 from mod_auth.models import Role
 from mod_ci.controllers import start_platforms
-from mod_ci.models import BlockedUsers
+from mod_ci.models import BlockedUsers, Kvm, QueueWeight
 from mod_customized.models import CustomizedTest
 from mod_home.models import CCExtractorVersion, GeneralData
 from mod_regression.models import RegressionTest
-from mod_test.models import Test, TestPlatform, TestType
+from mod_test.models import (Test, TestPlatform, TestProgress, TestQueueState,
+                             TestResult, TestResultFile, TestStatus, TestType)
 from tests.base import (BaseTestCase, generate_git_api_header,
                         generate_signature, mock_api_request_github)
 
@@ -84,6 +86,19 @@ class TestControllers(BaseTestCase):
         self.assertEqual(2, mock_log.info.call_count)
         mock_log.info.assert_called_with('started Windows virtual machine process...')
 
+    @mock.patch('mod_ci.controllers.notify_scheduler', return_value=True)
+    @mock.patch('mod_ci.controllers.Process')
+    @mock.patch('run.log')
+    def test_start_platform_scheduler_running(self, mock_log, mock_process, mock_notify):
+        """
+        Test that the scheduler is notified instead of starting processes when it runs.
+        """
+        start_platforms(mock.ANY, mock.ANY, 60, TestPlatform.linux)
+
+        mock_notify.assert_called_once_with(mock.ANY, TestPlatform.linux, 60)
+        mock_process.assert_not_called()
+        mock_log.info.assert_called_once_with('notified the scheduler...')
+
     @mock.patch('run.log')
     def test_kvm_processor_empty_kvm_name(self, mock_log):
         """
@@ -137,82 +152,225 @@ class TestControllers(BaseTestCase):
         mock_log.critical.assert_called_once()
         self.assertEqual(mock_log.debug.call_count, 1)
 
-    @mock.patch('mod_ci.controllers.GeneralData')
+    @mock.patch('run.log')
+    def test_claim_test(self, mock_log):
+        """
+        Test that VMs of a pool claim the waiting tests oldest first, each test once.
+        """
+        from mod_ci.controllers import claim_test
+
+        tests = [Test(TestPlatform.linux, TestType.commit, 1, 'master', 'commit{n}'.format(n=n)) for n in range(2)]
+        g.db.add_all(tests)
+        g.db.add(Test(TestPlatform.windows, TestType.commit, 1, 'master', 'commit'))
+        g.db.commit()
+
+        first = claim_test(g.db, 'linux-1', TestPlatform.linux)
+        second = claim_test(g.db, 'linux-2', TestPlatform.linux)
+        third = claim_test(g.db, 'linux-3', TestPlatform.linux)
+
+        self.assertEqual(tests[0].id, first.test_id)
+        self.assertEqual(tests[1].id, second.test_id)
+        self.assertIsNone(third)
+        self.assertEqual(2, Kvm.query.count())
+
+    @mock.patch.dict('run.config', {'TEST_SHARDS': 2})
+    @mock.patch('run.log')
+    def test_claim_sharded_test(self, mock_log):
+        """
+        Test that the shards of a test are claimed by different VMs, the test running once all of them are claimed.
+        """
+        from mod_ci.controllers import claim_test
+
+        test = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'commit')
+        g.db.add(test)
+        g.db.commit()
+
+        first = claim_test(g.db, 'linux-1', TestPlatform.linux)
+        self.assertEqual(TestQueueState.queued, test.queue_state)
+        second = claim_test(g.db, 'linux-2', TestPlatform.linux)
+
+        self.assertEqual([test.id, test.id], [first.test_id, second.test_id])
+        self.assertEqual([0, 1], [first.shard, second.shard])
+        self.assertEqual([[2], [1]], [shard.get_regression_ids() for shard in test.shards])
+        self.assertEqual(TestQueueState.running, test.queue_state)
+        self.assertIsNone(claim_test(g.db, 'linux-3', TestPlatform.linux))
+
+    @mock.patch.dict('run.config', {'TEST_SHARDS': 2})
+    @mock.patch('mod_ci.controllers.libvirt')
+    @mock.patch('run.log')
+    def test_kvm_processor_requeues_stopped_test(self, mock_log, mock_libvirt):
+        """
+        Test that the shard of a VM that stopped before its test finished is queued again for another VM.
+        """
+        from mod_ci.controllers import claim_test, kvm_processor
+
+        test = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'commit')
+        g.db.add(test)
+        g.db.commit()
+        claim_test(g.db, 'linux-1', TestPlatform.linux)
+        claim_test(g.db, 'linux-2', TestPlatform.linux)
+        conn = MagicMock()
+        conn.lookupByName.return_value.info.return_value = [mock_libvirt.VIR_DOMAIN_SHUTOFF]
+
+        with mock.patch('mod_ci.controllers.claim_test', return_value=None):
+            kvm_processor(self.app, g.db, 'linux-1', TestPlatform.linux, 'repo', None, conn=conn)
+
+        self.assertEqual(['linux-2'], [kvm.name for kvm in Kvm.query.all()])
+        self.assertEqual(TestQueueState.queued, test.queue_state)
+        self.assertEqual([TestQueueState.queued, TestQueueState.running], [shard.queue_state for shard in test.shards])
+        self.assertEqual(0, claim_test(g.db, 'linux-3', TestPlatform.linux).shard)
+
+    @mock.patch.dict('run.config', {'TEST_SHARDS': 2, 'KVM_MAX_RUNTIME': 120})
+    @mock.patch('mod_ci.controllers.libvirt')
+    @mock.patch('run.log')
+    def test_kvm_processor_stops_every_shard_on_timeout(self, mock_log, mock_libvirt):
+        """
+        Test that a test running too long is canceled, on the VMs of all of its shards.
+        """
+        from mod_ci.controllers import claim_test, kvm_processor
+
+        test = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'commit')
+        g.db.add(test)
+        g.db.commit()
+        expired = claim_test(g.db, 'linux-1', TestPlatform.linux)
+        expired.timestamp = datetime.datetime.now() - datetime.timedelta(hours=3)
+        claim_test(g.db, 'linux-2', TestPlatform.linux)
+        g.db.commit()
+        conn = MagicMock()
+        conn.lookupByName.return_value.destroy.return_value = 0
+
+        with mock.patch('mod_ci.controllers.claim_test', return_value=None):
+            kvm_processor(self.app, g.db, 'linux-1', TestPlatform.linux, 'repo', None, conn=conn)
+
+        self.assertEqual([], Kvm.query.all())
+        self.assertEqual(TestQueueState.finished, test.queue_state)
+        self.assertEqual([TestQueueState.finished] * 2, [shard.queue_state for shard in test.shards])
+        self.assertEqual(TestStatus.canceled, test.progress[-1].status)
+        self.assertEqual([mock.call('linux-1'), mock.call('linux-1'), mock.call('linux-2')],
+                         conn.lookupByName.call_args_list)
+        self.assertEqual(2, conn.lookupByName.return_value.destroy.call_count)
+
+    @mock.patch.dict('run.config', {'TEST_SHARDS': 2, 'PREEMPT_SUPERSEDED_TESTS': True})
+    @mock.patch('mod_ci.controllers.libvirt')
+    @mock.patch('run.log')
+    def test_preempt_sharded_test(self, mock_log, mock_libvirt):
+        """
+        Test that preempting a sharded test shuts down the VMs of all of its shards.
+        """
+        from mod_ci.controllers import cancel_superseded_tests, claim_test
+
+        test = Test(TestPlatform.linux, TestType.pull_request, 1, 'pull_request', 'old', 7)
+        g.db.add(test)
+        g.db.commit()
+        claim_test(g.db, 'linux-1', TestPlatform.linux)
+        claim_test(g.db, 'linux-2', TestPlatform.linux)
+        g.db.add(TestProgress(test.id, TestStatus.preparation, 'Preparing'))
+        g.db.commit()
+        conn = mock_libvirt.open.return_value
+        conn.lookupByName.return_value.destroy.return_value = 0
+
+        with mock.patch('mod_ci.controllers.queue_status'), mock.patch('mod_ci.controllers.publish_github_events'):
+            cancel_superseded_tests(g.db, 7, 'new')
+
+        self.assertEqual([], Kvm.query.all())
+        self.assertEqual(TestQueueState.finished, test.queue_state)
+        self.assertEqual([TestQueueState.finished] * 2, [shard.queue_state for shard in test.shards])
+        self.assertEqual([mock.call('linux-1'), mock.call('linux-2')], conn.lookupByName.call_args_list)
+        conn.close.assert_called_once_with()
+
+    def test_kvm_holds_test_once(self):
+        """
+        Test that two VMs can't hold the same test.
+        """
+        from sqlalchemy.exc import IntegrityError
+
+        test = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'commit')
+        g.db.add(test)
+        g.db.commit()
+        g.db.add(Kvm('linux-1', test.id))
+        g.db.commit()
+
+        g.db.add(Kvm('linux-2', test.id))
+        with self.assertRaises(IntegrityError):
+            g.db.commit()
+        g.db.rollback()
+
+    @mock.patch('mod_ci.controllers.PlatformStats')
     @mock.patch('mod_ci.controllers.g')
-    def test_set_avg_time_first(self, mock_g, mock_gd):
+    def test_set_avg_time_first(self, mock_g, mock_stats):
         """
         Test setting average time for the first time.
         """
         from mod_ci.controllers import set_avg_time
 
-        mock_gd.query.filter.return_value.first.return_value = None
+        mock_stats.query.filter.return_value.with_for_update.return_value.first.return_value = None
 
         set_avg_time(TestPlatform.linux, "build", 100)
 
-        mock_gd.query.filter.assert_called_once_with(mock_gd.key == 'avg_build_count_linux')
-        self.assertEqual(mock_gd.call_count, 2)
-        self.assertEqual(mock_g.db.add.call_count, 2)
+        mock_stats.query.filter.assert_called_once_with(
+            mock_stats.platform == TestPlatform.linux, mock_stats.phase == 'build')
+        mock_stats.assert_called_once_with(TestPlatform.linux, 'build')
+        mock_g.db.add.assert_called_once_with(mock_stats.return_value)
+        mock_stats.return_value.add.assert_called_once_with(100)
         mock_g.db.commit.assert_called_once()
 
-    @mock.patch('mod_ci.controllers.int')
-    @mock.patch('mod_ci.controllers.GeneralData')
+    @mock.patch('mod_ci.controllers.PlatformStats')
     @mock.patch('mod_ci.controllers.g')
-    def test_set_avg_time(self, mock_g, mock_gd, mock_int):
+    def test_set_avg_time_first_concurrently(self, mock_g, mock_stats):
         """
-        Test setting average time for NOT first time.
+        Test that the time is added to the statistics another test added first in the meantime.
         """
+        from sqlalchemy.exc import IntegrityError
+
         from mod_ci.controllers import set_avg_time
 
-        mock_int.return_value = 5
+        locked = mock_stats.query.filter.return_value.with_for_update.return_value
+        locked.first.return_value = None
+        mock_g.db.commit.side_effect = [IntegrityError('insert', {}, Exception()), None]
+
+        set_avg_time(TestPlatform.linux, "build", 100)
+
+        mock_g.db.rollback.assert_called_once_with()
+        locked.one.return_value.add.assert_called_once_with(100)
+        self.assertEqual(2, mock_g.db.commit.call_count)
+
+    @mock.patch('mod_ci.controllers.PlatformStats')
+    @mock.patch('mod_ci.controllers.g')
+    def test_set_avg_time(self, mock_g, mock_stats):
+        """
+        Test setting average time for NOT first time.
+        """
+        from mod_ci.controllers import set_avg_time
 
         set_avg_time(TestPlatform.windows, "prep", 100)
 
-        mock_gd.query.filter.assert_called_with(mock_gd.key == 'avg_prep_count_windows')
-        self.assertEqual(mock_gd.call_count, 0)
+        stats = mock_stats.query.filter.return_value.with_for_update.return_value.first.return_value
+        stats.add.assert_called_once_with(100)
+        self.assertEqual(mock_stats.call_count, 0)
         self.assertEqual(mock_g.db.add.call_count, 0)
         mock_g.db.commit.assert_called_once()
 
-    @mock.patch('github.GitHub')
-    def test_comments_successfully_in_passed_pr_test(self, git_mock):
-        import mod_ci.controllers
-        reload(mod_ci.controllers)
-        from mod_ci.controllers import comment_pr, Status
+    @mock.patch('mod_ci.controllers.queue_comment')
+    def test_comments_successfully_in_passed_pr_test(self, mock_queue):
+        from mod_ci.controllers import Status, comment_pr
+
         # Comment on test that passes all regression tests
         comment_pr(1, Status.SUCCESS, 1, 'linux')
-        git_mock.assert_called_with(access_token=g.github['bot_token'])
-        git_mock(access_token=g.github['bot_token']).repos.assert_called_with(g.github['repository_owner'])
-        git_mock(access_token=g.github['bot_token']).repos(
-            g.github['repository_owner']).assert_called_with(g.github['repository'])
-        repository = git_mock(access_token=g.github['bot_token']).repos(
-            g.github['repository_owner'])(g.github['repository'])
-        repository.issues.assert_called_with(1)
-        pull_request = repository.issues(1)
-        pull_request.comments.assert_called_with()
-        new_comment = pull_request.comments()
-        args, kwargs = new_comment.post.call_args
-        message = kwargs['body']
+
+        mock_queue.assert_called_once_with(g.db, 1, 'linux', mock.ANY)
+        message = mock_queue.call_args[0][3]
         if "passed" not in message:
             assert False, "Message not Correct"
 
-    @mock.patch('github.GitHub')
-    def test_comments_successfuly_in_failed_pr_test(self, git_mock):
-        import mod_ci.controllers
-        reload(mod_ci.controllers)
-        from mod_ci.controllers import comment_pr, Status
-        repository = git_mock(access_token=g.github['bot_token']).repos(
-            g.github['repository_owner'])(g.github['repository'])
-        pull_request = repository.issues(1)
-        message = ('<b>CCExtractor CI platform</b> finished running the '
-                   'test files on <b>linux</b>. Below is a summary of the test results')
-        pull_request.comments().get.return_value = [{'user': {'login': g.github['bot_name']},
-                                                    'id': 1, 'body': message}]
+    @mock.patch('mod_ci.controllers.queue_comment')
+    def test_comments_successfuly_in_failed_pr_test(self, mock_queue):
+        from mod_ci.controllers import Status, comment_pr
+
         # Comment on test that fails some/all regression tests
         comment_pr(2, Status.FAILURE, 1, 'linux')
-        pull_request = repository.issues(1)
-        pull_request.comments.assert_called_with(1)
-        new_comment = pull_request.comments(1)
-        args, kwargs = new_comment.post.call_args
-        message = kwargs['body']
+
+        mock_queue.assert_called_once_with(g.db, 1, 'linux', mock.ANY)
+        message = mock_queue.call_args[0][3]
         reg_tests = RegressionTest.query.all()
         flag = False
         for reg_test in reg_tests:
@@ -221,24 +379,35 @@ class TestControllers(BaseTestCase):
         if flag:
             assert False, "Message not Correct"
 
+    @mock.patch('mod_ci.controllers.deliver_due')
+    @mock.patch('mod_ci.controllers.client_from_config')
+    def test_publish_github_events(self, mock_client, mock_deliver):
+        """
+        Test that the queued GitHub events are delivered by the request, unless the publisher runs.
+        """
+        from mod_ci.controllers import publish_github_events
+
+        mock_log = MagicMock()
+        with mock.patch.dict('run.config', {'GITHUB_PUBLISHER': True}):
+            publish_github_events(g.db, mock_log, ['abc'])
+        mock_deliver.assert_not_called()
+
+        with mock.patch.dict('run.config', {'GITHUB_PUBLISHER': False}):
+            publish_github_events(g.db, mock_log, ['abc'])
+        mock_deliver.assert_called_once_with(g.db, mock_client.return_value, g.github['bot_name'], mock_log,
+                                             targets=['abc'])
+
     def test_check_main_repo_returns_in_false_url(self):
         from mod_ci.controllers import check_main_repo
         assert check_main_repo('random_user/random_repo') is False
         assert check_main_repo('test_owner/test_repo') is True
 
-    @mock.patch('github.GitHub')
-    @mock.patch('git.Repo')
-    @mock.patch('libvirt.open')
-    @mock.patch('shutil.rmtree')
-    @mock.patch('mod_ci.controllers.open')
-    @mock.patch('lxml.etree')
-    def test_customize_tests_run_on_fork_if_no_remote(self, mock_etree, mock_open,
-                                                      mock_rmtree, mock_libvirt, mock_repo, mock_git):
-        self.create_user_with_role(
-            self.user.name, self.user.email, self.user.password, Role.tester)
-        self.create_forktest("own-fork-commit", TestPlatform.linux)
-        import mod_ci.cron
+    def run_cron_with_mirror(self, mock_mirror, mock_libvirt):
+        """
+        Run the cron on a shut down VM, with the mirror of the repository mocked.
+        """
         import mod_ci.controllers
+        import mod_ci.cron
         reload(mod_ci.cron)
         reload(mod_ci.controllers)
         from mod_ci.cron import cron
@@ -249,82 +418,69 @@ class TestControllers(BaseTestCase):
         vm.info.return_value = [libvirt.VIR_DOMAIN_SHUTOFF]
         # Setting current snapshot of libvirt
         vm.hasCurrentSnapshot.return_value = 1
-        repo = mock_repo()
-        origin = repo.create_remote()
-        from collections import namedtuple
-        GitPullInfo = namedtuple('GitPullInfo', 'flags')
-        pull_info = GitPullInfo(flags=0)
-        origin.pull.return_value = [pull_info]
         cron(testing=True)
+        return mock_mirror.return_value
+
+    @mock.patch('github.GitHub')
+    @mock.patch('mod_ci.mirror.mirror_from_config')
+    @mock.patch('libvirt.open')
+    @mock.patch('shutil.rmtree')
+    @mock.patch('mod_ci.ci_files.open')
+    @mock.patch('mod_ci.controllers.open')
+    @mock.patch('mod_ci.ci_files.etree')
+    def test_customize_tests_run_on_fork(self, mock_etree, mock_open, mock_files_open,
+                                         mock_rmtree, mock_libvirt, mock_mirror, mock_git):
+        """
+        Test that the commit of a fork is fetched into the mirror, then checked out in the clone of the VM.
+        """
+        self.create_user_with_role(
+            self.user.name, self.user.email, self.user.password, Role.tester)
+        self.create_forktest("own-fork-commit", TestPlatform.linux)
+
+        mirror = self.run_cron_with_mirror(mock_mirror, mock_libvirt)
+
         fork_url = 'https://github.com/{user}/{repo}.git'.format(user=self.user.name, repo=g.github['repository'])
-        repo.create_remote.assert_called_with('fork_2', url=fork_url)
-        repo.create_head.assert_called_with('CI_Branch', origin.refs.master)
+        mirror.ensure_commit.assert_called_with('own-fork-commit', 2, fork_url)
+        mirror.clone.return_value.git.checkout.assert_called_with('-f', '-B', 'CI_Branch', 'own-fork-commit')
 
     @mock.patch('github.GitHub')
-    @mock.patch('git.Repo')
+    @mock.patch('mod_ci.mirror.mirror_from_config')
     @mock.patch('libvirt.open')
     @mock.patch('shutil.rmtree')
+    @mock.patch('mod_ci.ci_files.open')
     @mock.patch('mod_ci.controllers.open')
-    @mock.patch('lxml.etree')
-    def test_customize_tests_run_on_fork_if_remote_exist(self, mock_etree, mock_open,
-                                                         mock_rmtree, mock_libvirt, mock_repo, mock_git):
+    @mock.patch('mod_ci.ci_files.etree')
+    def test_customize_tests_commit_missing_from_mirror(self, mock_etree, mock_open, mock_files_open,
+                                                        mock_rmtree, mock_libvirt, mock_mirror, mock_git):
+        """
+        Test that a test isn't started when its commit can't be fetched into the mirror.
+        """
         self.create_user_with_role(self.user.name, self.user.email, self.user.password, Role.tester)
         self.create_forktest("own-fork-commit", TestPlatform.linux)
-        import mod_ci.cron
-        import mod_ci.controllers
-        reload(mod_ci.cron)
-        reload(mod_ci.controllers)
-        from mod_ci.cron import cron
-        conn = mock_libvirt()
-        vm = conn.lookupByName()
-        import libvirt
-        # mocking the libvirt kvm to shut down
-        vm.info.return_value = [libvirt.VIR_DOMAIN_SHUTOFF]
-        # Setting current snapshot of libvirt
-        vm.hasCurrentSnapshot.return_value = 1
-        repo = mock_repo()
-        origin = repo.remote()
-        from collections import namedtuple
-        Remotes = namedtuple('Remotes', 'name')
-        repo.remotes = [Remotes(name='fork_2')]
-        GitPullInfo = namedtuple('GitPullInfo', 'flags')
-        pull_info = GitPullInfo(flags=0)
-        origin.pull.return_value = [pull_info]
-        cron(testing=True)
-        repo.remote.assert_called_with('fork_2')
+        mock_mirror.return_value.ensure_commit.return_value = False
+
+        mirror = self.run_cron_with_mirror(mock_mirror, mock_libvirt)
+
+        mirror.clone.assert_not_called()
+        mock_libvirt().lookupByName().create.assert_not_called()
 
     @mock.patch('github.GitHub')
-    @mock.patch('git.Repo')
+    @mock.patch('mod_ci.mirror.mirror_from_config')
     @mock.patch('libvirt.open')
     @mock.patch('shutil.rmtree')
+    @mock.patch('mod_ci.ci_files.open')
     @mock.patch('mod_ci.controllers.open')
-    @mock.patch('lxml.etree')
-    def test_customize_tests_run_on_selected_regression_tests(self, mock_etree, mock_open,
-                                                              mock_rmtree, mock_libvirt, mock_repo, mock_git):
+    @mock.patch('mod_ci.ci_files.etree')
+    def test_customize_tests_run_on_selected_regression_tests(self, mock_etree, mock_open, mock_files_open,
+                                                              mock_rmtree, mock_libvirt, mock_mirror, mock_git):
         self.create_user_with_role(
             self.user.name, self.user.email, self.user.password, Role.tester)
         self.create_forktest("own-fork-commit", TestPlatform.linux, regression_tests=[2])
-        import mod_ci.cron
-        import mod_ci.controllers
-        reload(mod_ci.cron)
-        reload(mod_ci.controllers)
-        from mod_ci.cron import cron
-        conn = mock_libvirt()
-        vm = conn.lookupByName()
-        import libvirt
-        vm.info.return_value = [libvirt.VIR_DOMAIN_SHUTOFF]
-        vm.hasCurrentSnapshot.return_value = 1
-        repo = mock_repo()
-        origin = repo.remote()
-        from collections import namedtuple
-        Remotes = namedtuple('Remotes', 'name')
-        repo.remotes = [Remotes(name='fork_2')]
-        GitPullInfo = namedtuple('GitPullInfo', 'flags')
-        pull_info = GitPullInfo(flags=0)
-        origin.pull.return_value = [pull_info]
         single_test = mock_etree.Element('tests')
         mock_etree.Element.return_value = single_test
-        cron(testing=True)
+
+        self.run_cron_with_mirror(mock_mirror, mock_libvirt)
+
         mock_etree.SubElement.assert_any_call(single_test, 'entry', id=str(2))
         assert (single_test, 'entry', str(1)) not in mock_etree.call_args_list
 
@@ -453,6 +609,66 @@ class TestControllers(BaseTestCase):
                 flash_message = dict(session['_flashes']).get('message')
             self.assertEqual(flash_message, "User already blocked.")
 
+    def test_save_queue_weights(self):
+        """
+        Check saving the weights of the queue priority.
+        """
+        self.create_user_with_role(
+            self.user.name, self.user.email, self.user.password, Role.admin)
+        with self.app.test_client() as c:
+            response = c.post(
+                '/account/login', data=self.create_login_form_data(self.user.email, self.user.password))
+            response = c.post('/queue_priority', data=dict(
+                commit=1, pull_request=5, main_fork=2, other_forks=0, fair_share=1, aging=30, save=True))
+            self.assertEqual(5, QueueWeight.query.filter(QueueWeight.name == 'type_pr').first().weight)
+            with c.session_transaction() as session:
+                flash_message = dict(session['_flashes']).get('message')
+            self.assertEqual(flash_message, "Weights saved.")
+
+    def test_save_queue_weights_no_aging(self):
+        """
+        Check that the aging can't be turned off.
+        """
+        self.create_user_with_role(
+            self.user.name, self.user.email, self.user.password, Role.admin)
+        with self.app.test_client() as c:
+            response = c.post(
+                '/account/login', data=self.create_login_form_data(self.user.email, self.user.password))
+            response = c.post('/queue_priority', data=dict(
+                commit=1, pull_request=5, main_fork=2, other_forks=0, fair_share=1, aging=0, save=True))
+            self.assertIsNone(QueueWeight.query.first())
+            self.assertIn("Aging must be at least one minute", str(response.data))
+
+    def test_fork_weight(self):
+        """
+        Check overriding the weight of a fork, then removing the override.
+        """
+        self.create_user_with_role(
+            self.user.name, self.user.email, self.user.password, Role.admin)
+        with self.app.test_client() as c:
+            response = c.post(
+                '/account/login', data=self.create_login_form_data(self.user.email, self.user.password))
+            response = c.post('/queue_priority', data=dict(fork_id=1, weight=-3, set_fork=True))
+            self.assertEqual(-3, QueueWeight.query.filter(QueueWeight.name == 'fork_1').first().weight)
+            response = c.post('/queue_priority', data=dict(fork_id=1, set_fork=True))
+            self.assertIsNone(QueueWeight.query.filter(QueueWeight.name == 'fork_1').first())
+
+    @mock.patch('run.log')
+    def test_claim_test_by_priority(self, mock_log):
+        """
+        Test that the queued test with the highest priority is claimed first.
+        """
+        from mod_ci.controllers import claim_test
+
+        older = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'customized')
+        newer = Test(TestPlatform.linux, TestType.pull_request, 1, 'pull_request', 'pr', 3)
+        newer.priority = older.priority + 1
+        g.db.add_all([older, newer])
+        g.db.commit()
+
+        self.assertEqual(newer.id, claim_test(g.db, 'linux-1', TestPlatform.linux).test_id)
+        self.assertEqual(older.id, claim_test(g.db, 'linux-2', TestPlatform.linux).test_id)
+
     @mock.patch('requests.get', side_effect=mock_api_request_github)
     def test_remove_blocked_users(self, mock_request):
         """
@@ -714,6 +930,114 @@ class TestControllers(BaseTestCase):
         mock_blocked.query.filter.assert_called_once_with(mock_blocked.user_id == 'test')
         mock_queue_test.assert_called_once()
 
+    @mock.patch('mod_ci.controllers.BlockedUsers')
+    @mock.patch('mod_ci.controllers.GitHub')
+    @mock.patch('mod_ci.controllers.queue_test')
+    @mock.patch('requests.get', side_effect=mock_api_request_github)
+    def test_webhook_pr_synchronize_already_queued(self, mock_request, mock_queue_test, mock_github, mock_blocked):
+        """
+        Test webhook triggered with pull_request event for a commit that is already queued.
+        """
+        mock_blocked.query.filter.return_value.first.return_value = None
+        g.db.add(Test(TestPlatform.linux, TestType.pull_request, 1, 'pull_request', 'abcd1234', 1234))
+        g.db.commit()
+
+        data = {'action': 'synchronize',
+                'pull_request': {'number': 1234, 'head': {'sha': 'abcd1234'}, 'user': {'id': 'test'}}}
+        with self.app.test_client() as c:
+            response = c.post(
+                '/start-ci', environ_overrides=WSGI_ENVIRONMENT,
+                data=json.dumps(data), headers=self.generate_header(data, 'pull_request'))
+
+        mock_queue_test.assert_not_called()
+
+    @mock.patch('mod_ci.controllers.publish_github_events')
+    @mock.patch('mod_ci.controllers.queue_status')
+    @mock.patch('run.log')
+    def test_cancel_superseded_tests(self, mock_log, mock_queue, mock_publish):
+        """
+        Test that a new commit of a PR cancels the queued tests of its older commits, leaving running ones alone.
+        """
+        from mod_ci.controllers import Status, cancel_superseded_tests
+
+        queued = [Test(platform, TestType.pull_request, 1, 'pull_request', 'old', 7) for platform in TestPlatform]
+        running = Test(TestPlatform.linux, TestType.pull_request, 1, 'pull_request', 'older', 7)
+        running.queue_state = TestQueueState.running
+        other_pr = Test(TestPlatform.linux, TestType.pull_request, 1, 'pull_request', 'old', 8)
+        g.db.add_all(queued + [running, other_pr])
+        g.db.commit()
+
+        cancel_superseded_tests(g.db, 7, 'new')
+
+        for test in queued:
+            self.assertEqual(TestQueueState.finished, test.queue_state)
+            self.assertEqual(TestStatus.canceled, test.progress[-1].status)
+        self.assertEqual(TestQueueState.running, running.queue_state)
+        self.assertEqual(TestQueueState.queued, other_pr.queue_state)
+        self.assertEqual([mock.call(g.db, 'old', Status.FAILURE, 'Tests canceled, superseded by a newer commit',
+                                    'CI - {name}'.format(name=test.platform.value), mock.ANY) for test in queued],
+                         mock_queue.call_args_list)
+        mock_publish.assert_called_once_with(g.db, mock_log, {'old'})
+
+    @mock.patch('mod_ci.controllers.notify_scheduler')
+    @mock.patch('mod_ci.controllers.publish_github_events')
+    @mock.patch('mod_ci.controllers.queue_status')
+    @mock.patch('mod_ci.controllers.mirror_from_config')
+    @mock.patch('run.log')
+    def test_premerge_pull_request_conflict(self, mock_log, mock_mirror, mock_queue, mock_publish, mock_notify):
+        """
+        Test that the queued tests of a PR conflicting with master are canceled before a VM is claimed for them.
+        """
+        from mod_ci.controllers import premerge_pull_request
+
+        tests = [Test(platform, TestType.pull_request, 1, 'pull_request', 'conflict', 7) for platform in TestPlatform]
+        g.db.add_all(tests)
+        g.db.commit()
+        mock_mirror.return_value.premerge.return_value = None
+
+        with mock.patch.object(g.db, 'remove'):
+            premerge_pull_request(self.app, g.db, 'conflict', 7, [test.id for test in tests])
+
+        mock_mirror.return_value.premerge.assert_called_once_with('conflict', 7)
+        for test in tests:
+            self.assertEqual(TestQueueState.finished, test.queue_state)
+            self.assertEqual(TestStatus.canceled, test.progress[-1].status)
+        self.assertEqual(2, mock_queue.call_count)
+        mock_publish.assert_called_once_with(g.db, mock_log, ['conflict'])
+        mock_notify.assert_called_once()
+
+    @mock.patch('mod_ci.controllers.write_test_files')
+    @mock.patch('mod_ci.controllers.record_changed_files')
+    @mock.patch('mod_ci.controllers.mirror_from_config')
+    @mock.patch('mod_ci.controllers.open')
+    @mock.patch('run.log')
+    def test_start_test_premerged_pull_request(self, mock_log, mock_open, mock_mirror, mock_record, mock_write):
+        """
+        Test that a VM checks out the merge of a PR made when it was queued, without asking GitHub about it.
+        """
+        from mod_ci.controllers import start_test
+
+        test = Test(TestPlatform.linux, TestType.pull_request, 1, 'pull_request', 'premerged', 7)
+        g.db.add(test)
+        g.db.commit()
+        status = Kvm('linux-vm', test.id)
+        g.db.add(status)
+        g.db.commit()
+        vm = MagicMock()
+        vm.hasCurrentSnapshot.return_value = 1
+        vm.revertToSnapshot.return_value = 0
+        mock_mirror.return_value.premerged.return_value = 'merge'
+        mock_write.return_value = None
+        repository = MagicMock()
+
+        self.assertTrue(start_test(self.app, g.db, vm, status, repository))
+
+        repo = mock_mirror.return_value.clone.return_value
+        repo.git.checkout.assert_called_once_with('-f', '-B', 'CI_Branch', 'merge')
+        repo.git.merge.assert_not_called()
+        repository.pulls.assert_not_called()
+        vm.create.assert_called_once()
+
     @mock.patch('mod_ci.controllers.inform_mailing_list')
     @mock.patch('requests.get', side_effect=mock_api_request_github)
     @mock.patch('mod_ci.controllers.Issue')
@@ -786,7 +1110,7 @@ class TestControllers(BaseTestCase):
         self.assertEqual(expected_ret, ret_val)
         mock_test.query.filter.assert_called_once()
         mock_request.assert_not_called()
-        mock_progress_type.assert_called_once_with(mock.ANY, mock.ANY, 1, mock.ANY)
+        mock_progress_type.assert_called_once_with(mock.ANY, mock.ANY, 1, mock.ANY, None)
 
     @mock.patch('mod_ci.controllers.request')
     @mock.patch('mod_ci.controllers.Test')
@@ -810,7 +1134,7 @@ class TestControllers(BaseTestCase):
         self.assertEqual(expected_ret, ret_val)
         mock_test.query.filter.assert_called_once()
         mock_request.assert_not_called()
-        mock_progress_type.assert_called_once_with(mock.ANY, mock.ANY, 1, mock.ANY)
+        mock_progress_type.assert_called_once_with(mock.ANY, mock.ANY, 1, mock.ANY, None)
 
     @mock.patch('mod_ci.controllers.request')
     @mock.patch('mod_ci.controllers.Test')
@@ -858,7 +1182,7 @@ class TestControllers(BaseTestCase):
         self.assertEqual(expected_ret, ret_val)
         mock_test.query.filter.assert_called_once()
         mock_request.assert_not_called()
-        mock_logupload_type.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY, mock.ANY)
+        mock_logupload_type.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY, mock.ANY, None)
 
     @mock.patch('mod_ci.controllers.request')
     @mock.patch('mod_ci.controllers.Test')
@@ -882,7 +1206,7 @@ class TestControllers(BaseTestCase):
         self.assertEqual(expected_ret, ret_val)
         mock_test.query.filter.assert_called_once()
         mock_request.assert_not_called()
-        mock_logupload_type.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY, mock.ANY)
+        mock_logupload_type.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY, mock.ANY, None)
 
     @mock.patch('mod_ci.controllers.request')
     @mock.patch('mod_ci.controllers.Test')
@@ -956,6 +1280,52 @@ class TestControllers(BaseTestCase):
         mock_request.assert_not_called()
         mock_finish_type.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY)
 
+    @mock.patch('mod_ci.controllers.request')
+    @mock.patch('mod_ci.controllers.Test')
+    @mock.patch('mod_ci.controllers.batch_type_request')
+    def test_progress_reporter_batch_type(self, mock_batch_type, mock_test, mock_request):
+        """
+        Test progress_reporter with request type batch, refusing an invalid batch.
+        """
+        from mod_ci.controllers import progress_reporter
+
+        mock_test_obj = MagicMock()
+        mock_test_obj.token = "token"
+        mock_test.query.filter.return_value.first.return_value = mock_test_obj
+        mock_request.form = {'type': 'batch'}
+        mock_batch_type.return_value = "FAIL"
+
+        ret_val = progress_reporter(1, "token")
+
+        self.assertEqual("FAIL", ret_val)
+        mock_batch_type.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY)
+
+    @mock.patch('mod_ci.controllers.report_impacted_tests')
+    def test_batch_type_request(self, mock_report):
+        """
+        Test that a batch stores its results at once, and that posting it again stores nothing more.
+        """
+        from mod_ci.controllers import batch_type_request
+
+        test = Test(TestPlatform.linux, TestType.commit, 1, 'master', 'batch')
+        g.db.add(test)
+        g.db.commit()
+        records = [
+            {'type': 'equality', 'test_id': 1, 'test_file_id': 1},
+            {'type': 'finish', 'test_id': 1, 'runTime': 30, 'exitCode': 0},
+            {'type': 'finish', 'test_id': 2, 'runTime': 40, 'exitCode': 3},
+        ]
+        mock_request = MagicMock()
+        mock_request.files = {}
+        mock_request.form = {'type': 'batch', 'records': '\n'.join(json.dumps(record) for record in records)}
+
+        batch_type_request(MagicMock(), test.id, test, mock_request)
+        batch_type_request(MagicMock(), test.id, test, mock_request)
+
+        self.assertEqual(2, TestResult.query.filter(TestResult.test_id == test.id).count())
+        self.assertEqual(1, TestResultFile.query.filter(TestResultFile.test_id == test.id).count())
+        self.assertEqual(2, mock_report.call_count)
+
     @mock.patch('mod_ci.controllers.RegressionTestOutput')
     def test_equality_type_request_rto_none(self, mock_rto):
         """
@@ -1065,16 +1435,15 @@ class TestControllers(BaseTestCase):
         mock_log.debug.assert_called_once()
         mock_filename.assert_called_once()
 
-    @mock.patch('mod_ci.controllers.hashlib')
+    @mock.patch('mod_ci.controllers.check_main_repo', return_value=False)
+    @mock.patch('mod_ci.controllers.result_store_from_config')
+    @mock.patch('mod_ci.controllers.store_upload')
     @mock.patch('mod_ci.controllers.TestResultFile')
     @mock.patch('mod_ci.controllers.RegressionTestOutput')
     @mock.patch('mod_ci.controllers.g')
-    @mock.patch('mod_ci.controllers.iter')
-    @mock.patch('mod_ci.controllers.open')
-    @mock.patch('mod_ci.controllers.os')
     @mock.patch('mod_ci.controllers.secure_filename')
-    def test_upload_type_request(self, mock_filename, mock_os, mock_open, mock_iter,
-                                 mock_g, mock_rto, mock_result_file, mock_hashlib):
+    def test_upload_type_request(self, mock_filename, mock_g, mock_rto, mock_result_file, mock_store,
+                                 mock_result_store, mock_main_repo):
         """
         Test function upload_type_request.
         """
@@ -1090,24 +1459,20 @@ class TestControllers(BaseTestCase):
             'test_id': 1,
             'test_file_id': 1
         }
-        mock_iter.return_value = ['chunk']
-        mock_os.path.splitext.return_value = "a", "b"
+        mock_filename.return_value = 'output.srt'
+        mock_store.return_value = 'hash', True
 
-        upload_type_request(mock_log, 1, MagicMock(), MagicMock(), mock_request)
+        upload_type_request(mock_log, 1, 'repo', MagicMock(), mock_request)
 
         mock_log.debug.assert_called_once()
         mock_filename.assert_called_once()
-        self.assertEqual(2, mock_os.path.join.call_count)
-        mock_upload_file.save.assert_called_once()
-        mock_open.assert_called_once_with(mock.ANY, "rb")
-        mock_os.path.splitext.assert_called_once_with(mock.ANY)
-        mock_os.rename.assert_called_once_with(mock.ANY, mock.ANY)
+        mock_store.assert_called_once_with(
+            mock_upload_file.stream, mock_result_store.return_value, 'repo/TempFiles', '.srt', compress=True)
+        mock_upload_file.save.assert_not_called()
         mock_rto.query.filter.assert_called_once_with(mock_rto.id == 1)
-        mock_result_file.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY, mock.ANY)
+        mock_result_file.assert_called_once_with(mock.ANY, 1, mock.ANY, mock.ANY, 'hash')
         mock_g.db.add.assert_called_once_with(mock.ANY)
         mock_g.db.commit.assert_called_once_with()
-        mock_hashlib.sha256.assert_called_once_with()
-        mock_iter.assert_called_once_with(mock.ANY, b"")
 
     @mock.patch('mod_ci.controllers.RegressionTest')
     @mock.patch('mod_ci.controllers.TestResult')
@@ -1162,6 +1527,32 @@ class TestControllers(BaseTestCase):
         mock_g.db.commit.assert_called_once_with()
         mock_log.error.assert_called_once()
 
+    @mock.patch('mod_ci.controllers.publish_github_events')
+    @mock.patch('mod_ci.controllers.queue_status')
+    def test_report_impacted_tests(self, mock_queue, mock_publish):
+        """
+        Test that the results of the regression tests most likely impacted are posted once they all finished.
+        """
+        from mod_ci.controllers import Status, report_impacted_tests
+        from mod_test.models import TestResult, TestSelection
+
+        test = Test.query.filter(Test.id == 1).first()
+        crash = TestResult.query.filter(TestResult.test_id == test.id, TestResult.regression_test_id == 2).first()
+        crash.exit_code = crash.expected_rc + 1
+        g.db.add(TestSelection(test.id, [2]))
+        g.db.commit()
+        g.db.refresh(test)
+        mock_log = MagicMock()
+
+        with self.app.test_request_context():
+            report_impacted_tests(mock_log, test)
+
+        self.assertTrue(test.selection.reported)
+        mock_queue.assert_called_once_with(g.db, test.commit, Status.PENDING,
+                                           '1 of the 1 tests most likely impacted failed, running the rest',
+                                           'CI - linux', mock.ANY)
+        mock_publish.assert_called_once_with(g.db, mock_log, [test.commit])
+
     def test_in_maintenance_mode_ValueError(self):
         """
         Test in_maintenance_mode function with invalid platform.
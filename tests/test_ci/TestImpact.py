@@ -0,0 +1,105 @@
+import unittest
+from types import SimpleNamespace
+
+from git import GitCommandError
+from mock import mock
+from sqlalchemy.exc import IntegrityError
+
+import mod_ci.impact as impact
+from mod_test.models import TestType
+
+
+class TestImpact(unittest.TestCase):
+
+    def test_impact_scores(self):
+        """
+        Test that a regression test scores the share of the earlier tests it failed in, summed over the changed files.
+        """
+        runs = {'src/a.c': 4, 'src/b.c': 2}
+        failures = {'src/a.c': {1: 2, 2: 1}, 'src/b.c': {1: 1, 3: 2}}
+
+        self.assertEqual({1: 1.0, 2: 0.25, 3: 1.0}, impact.impact_scores(runs, failures))
+
+    def test_rank_impacted(self):
+        """
+        Test that the regression tests with the highest score are selected, the lowest id first on a tie.
+        """
+        scores = {1: 0.5, 2: 1.5, 3: 0.5, 4: 0.25}
+
+        self.assertEqual([2, 1, 3], impact.rank_impacted(scores, 3))
+        self.assertEqual([2, 1, 3, 4], impact.rank_impacted(scores, 10))
+
+    def test_changed_files(self):
+        """
+        Test getting the files a pull request changes compared to master, and the ones a commit changes.
+        """
+        repo = mock.MagicMock()
+        repo.git.diff.return_value = 'src/b.c\nsrc/a.c\n'
+
+        pull_request = SimpleNamespace(test_type=TestType.pull_request, commit='abc')
+        self.assertEqual(['src/a.c', 'src/b.c'], impact.changed_files(repo, pull_request))
+        repo.git.diff.assert_called_with('--name-only', 'master', 'HEAD')
+
+        commit = SimpleNamespace(test_type=TestType.commit, commit='abc')
+        impact.changed_files(repo, commit)
+        repo.git.diff.assert_called_with('--name-only', 'abc~1', 'abc')
+
+    def test_changed_files_unknown_commit(self):
+        """
+        Test that no files are changed when the parent of a commit can't be found.
+        """
+        repo = mock.MagicMock()
+        repo.git.diff.side_effect = GitCommandError('diff', 128)
+
+        self.assertEqual([], impact.changed_files(repo, SimpleNamespace(test_type=TestType.commit, commit='abc')))
+
+    def test_select_only_pull_requests(self):
+        """
+        Test that nothing is selected for commits, or when the selection is disabled.
+        """
+        db = mock.MagicMock()
+
+        self.assertEqual([], impact.select_impacted_tests(db, SimpleNamespace(test_type=TestType.commit), 5))
+        self.assertEqual([], impact.select_impacted_tests(db, SimpleNamespace(test_type=TestType.pull_request), 0))
+        db.query.assert_not_called()
+
+    def test_select_reuses_selection(self):
+        """
+        Test that all the VMs running a test use the selection stored by the first one.
+        """
+        db = mock.MagicMock()
+        selection = SimpleNamespace(get_regression_ids=lambda: [3, 1])
+        test = SimpleNamespace(test_type=TestType.pull_request, selection=selection)
+
+        self.assertEqual([3, 1], impact.select_impacted_tests(db, test, 5))
+        db.query.assert_not_called()
+        db.add.assert_not_called()
+
+    def test_record_changed_files_concurrently(self):
+        """
+        Test that the changed files stored by the VM of another shard in the meantime are kept.
+        """
+        db = mock.MagicMock()
+        db.commit.side_effect = IntegrityError('INSERT', {}, Exception('duplicate'))
+        test = SimpleNamespace(id=1, changed_files=[])
+
+        with mock.patch.object(impact, 'changed_files', return_value=['src/a.c']):
+            impact.record_changed_files(db, test, mock.ANY)
+
+        db.rollback.assert_called_once_with()
+
+    @mock.patch.object(impact, 'failure_history', return_value=({}, {}))
+    @mock.patch.object(impact, 'impact_scores', return_value={1: 1.0, 3: 2.0})
+    def test_select_concurrently(self, mock_scores, mock_history):
+        """
+        Test that the selection stored by the VM of another shard in the meantime is used.
+        """
+        db = mock.MagicMock()
+        db.commit.side_effect = IntegrityError('INSERT', {}, Exception('duplicate'))
+        stored = SimpleNamespace(get_regression_ids=lambda: [1])
+        db.query.return_value.filter.return_value.one.return_value = stored
+        test = SimpleNamespace(id=1, test_type=TestType.pull_request, selection=None,
+                               get_customized_regressiontests=lambda: [1, 3])
+
+        self.assertEqual([1], impact.select_impacted_tests(db, test, 5))
+        db.rollback.assert_called_once_with()
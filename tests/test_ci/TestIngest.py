@@ -0,0 +1,73 @@
+import json
+import unittest
+
+from mock import mock
+from sqlalchemy.exc import IntegrityError
+
+from mod_ci.ingest import parse_records, result_rows, store_records
+
+
+def mock_db(*results):
+    """Mock a database connection answering its queries with the given rows, in order."""
+    db = mock.MagicMock()
+    db.query.return_value.filter.return_value.all.side_effect = list(results)
+    return db
+
+
+class TestIngest(unittest.TestCase):
+
+    records = [
+        {'type': 'equality', 'test_id': 1, 'test_file_id': 10},
+        {'type': 'finish', 'test_id': 1, 'runTime': 30, 'exitCode': 0},
+        {'type': 'equality', 'test_id': 2, 'test_file_id': 20},
+        {'type': 'finish', 'test_id': 2, 'runTime': 40, 'exitCode': 3},
+    ]
+
+    def test_parse_records(self):
+        """
+        Test that a batch is parsed from a JSON array as well as from a record per line, with numeric fields.
+        """
+        ndjson = '\n'.join(json.dumps(record) for record in self.records) + '\n'
+        as_strings = [{key: str(value) for key, value in record.items()} for record in self.records]
+
+        self.assertEqual(self.records, parse_records(json.dumps(self.records)))
+        self.assertEqual(self.records, parse_records(ndjson))
+        self.assertEqual(self.records, parse_records(json.dumps(as_strings)))
+        self.assertEqual([], parse_records(''))
+
+    def test_parse_invalid_records(self):
+        """
+        Test that a batch with a malformed or incomplete record is refused as a whole.
+        """
+        for payload in ['[{"type": "equality"', '{"type": "upload", "test_id": 1, "test_file_id": 2}',
+                        '{"type": "finish", "test_id": 1, "runTime": 30}', '[1, 2]',
+                        '{"type": "finish", "test_id": 1, "runTime": "fast", "exitCode": 0}']:
+            with self.assertRaises(ValueError):
+                parse_records(payload)
+
+    def test_result_rows(self):
+        """
+        Test that the results stored already, of unknown outputs and repeated in the batch are left out.
+        """
+        db = mock_db([(10, 'correct_10')], [(1, 0), (2, 0)], [(1, 10)], [])
+        records = self.records + [{'type': 'finish', 'test_id': 1, 'runTime': 35, 'exitCode': 0}]
+
+        results, files = result_rows(db, 5, records)
+
+        self.assertEqual([
+            {'test_id': 5, 'regression_test_id': 1, 'runtime': 30, 'exit_code': 0, 'expected_rc': 0},
+            {'test_id': 5, 'regression_test_id': 2, 'runtime': 40, 'exit_code': 3, 'expected_rc': 0},
+        ], results)
+        self.assertEqual([], files)
+
+    def test_store_records_retries_once(self):
+        """
+        Test that the results are read again and inserted once more when a concurrent request stored some first.
+        """
+        db = mock_db([(1, 0)], [], [(1, 0)], [(1,)])
+        db.execute.side_effect = [IntegrityError('insert', {}, Exception())]
+        records = [self.records[1]]
+
+        self.assertEqual(0, store_records(db, 5, records))
+        db.rollback.assert_called_once()
+        db.commit.assert_called_once()
@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from git import Actor, Repo
+
+from mod_ci.mirror import Mirror, can_premerge
+
+AUTHOR = Actor('CI', 'ci@example.com')
+
+
+class TestMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.upstream = Repo.init(os.path.join(self.folder, 'upstream'))
+        self.first = self.commit(self.upstream, 'first')
+        self.upstream.git.branch('-M', 'master')
+        self.mirror = Mirror(os.path.join(self.folder, 'mirror.git'), self.upstream.working_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def commit(self, repo, content, name='file.txt'):
+        with open(os.path.join(repo.working_dir, name), 'w') as f:
+            f.write(content)
+        repo.index.add([name])
+        return repo.index.commit(content, author=AUTHOR, committer=AUTHOR).hexsha
+
+    def test_update(self):
+        """
+        Test that the mirror is created on its first update, and holds the commits of the main repository.
+        """
+        self.assertFalse(self.mirror.has_commit(self.first))
+
+        self.assertTrue(self.mirror.update())
+
+        self.assertTrue(self.mirror.has_commit(self.first))
+        self.assertTrue(Repo(self.mirror.path).bare)
+
+    def test_ensure_commit_of_fork(self):
+        """
+        Test that the branches of a fork are fetched when one of its commits is missing.
+        """
+        fork = self.upstream.clone(os.path.join(self.folder, 'fork'))
+        fork_commit = self.commit(fork, 'fork')
+        self.mirror.update()
+
+        self.assertFalse(self.mirror.ensure_commit(fork_commit))
+        self.assertTrue(self.mirror.ensure_commit(fork_commit, 2, fork.working_dir))
+        self.assertIn('refs/forks/2/heads/master', Repo(self.mirror.path).git.for_each_ref('--format=%(refname)'))
+
+    def test_clone(self):
+        """
+        Test that the clone of a VM borrows the objects of the mirror and follows its master branch.
+        """
+        self.mirror.update()
+        path = os.path.join(self.folder, 'vm', 'unsafe-ccextractor')
+        clone = self.mirror.clone(path)
+        clone.git.checkout('-f', '-B', 'CI_Branch', self.first)
+        with open(os.path.join(path, 'file.txt'), 'w') as f:
+            f.write('left behind')
+
+        second = self.commit(self.upstream, 'second')
+        self.mirror.update()
+        clone = self.mirror.clone(path)
+
+        self.assertEqual(second, clone.heads.master.commit.hexsha)
+        self.assertFalse(clone.is_dirty())
+        with open(os.path.join(clone.git_dir, 'objects', 'info', 'alternates')) as f:
+            self.assertEqual([os.path.join(self.mirror.path, 'objects')], f.read().splitlines())
+        clone.git.checkout('-f', '-B', 'CI_Branch', second)
+
+    def pull_request(self, content, name):
+        self.upstream.git.checkout('-b', 'feature', self.first)
+        commit = self.commit(self.upstream, content, name)
+        self.upstream.git.checkout('master')
+        return commit
+
+    def test_premerge(self):
+        """
+        Test that a pull request is merged on master in the mirror, and the merge is dropped once master moves on.
+        """
+        pr_commit = self.pull_request('feature', 'other.txt')
+        self.commit(self.upstream, 'second')
+        self.mirror.update()
+
+        merge = self.mirror.premerge(pr_commit, 5)
+
+        self.assertIsNotNone(merge)
+        self.assertEqual(merge, self.mirror.premerged(pr_commit, 5))
+        self.assertIsNone(self.mirror.premerged(pr_commit, 6))
+        clone = self.mirror.clone(os.path.join(self.folder, 'vm', 'unsafe-ccextractor'))
+        clone.git.checkout('-f', '-B', 'CI_Branch', merge)
+        with open(os.path.join(clone.working_dir, 'file.txt')) as f:
+            self.assertEqual('second', f.read())
+        with open(os.path.join(clone.working_dir, 'other.txt')) as f:
+            self.assertEqual('feature', f.read())
+
+        self.commit(self.upstream, 'third')
+        self.mirror.update()
+
+        self.assertIsNone(self.mirror.premerged(pr_commit, 5))
+
+    def test_premerge_conflict(self):
+        """
+        Test that no merge is made for a pull request that conflicts with master.
+        """
+        pr_commit = self.pull_request('feature', 'file.txt')
+        self.commit(self.upstream, 'second')
+        self.mirror.update()
+
+        self.assertIsNone(self.mirror.premerge(pr_commit, 5))
+        self.assertIsNone(self.mirror.premerged(pr_commit, 5))
+
+    @mock.patch('mod_ci.mirror.Git')
+    def test_can_premerge(self, mock_git):
+        """
+        Test that pull requests are only merged in the mirror with a git that can merge without a working tree.
+        """
+        for version, expected in [((2, 37, 4), False), ((2, 38, 0), True), ((3, 0), True)]:
+            mock_git.return_value.version_info = version
+            self.assertEqual(expected, can_premerge())
@@ -0,0 +1,46 @@
+import json
+import statistics
+import unittest
+
+from mod_ci.models import PlatformStats, percentile
+from mod_test.models import TestPlatform
+from tests import base  # noqa: F401 (imports every model to map them)
+
+
+class TestPlatformStats(unittest.TestCase):
+
+    def test_add(self):
+        """
+        Test that the mean and variance follow every duration, and the percentiles the last ones only.
+        """
+        stats = PlatformStats(TestPlatform.linux, 'build')
+        durations = [float(duration) for duration in range(1, PlatformStats.WINDOW_SIZE + 21)]
+
+        for duration in durations:
+            stats.add(duration)
+
+        self.assertEqual(len(durations), stats.count)
+        self.assertAlmostEqual(statistics.mean(durations), stats.mean)
+        self.assertAlmostEqual(statistics.variance(durations), stats.variance)
+        self.assertEqual(durations[-PlatformStats.WINDOW_SIZE:], json.loads(stats.window))
+        self.assertAlmostEqual(statistics.median(durations[-PlatformStats.WINDOW_SIZE:]), stats.median)
+        self.assertAlmostEqual(110.1, stats.p90)
+
+    def test_single_duration(self):
+        """
+        Test the statistics of a single duration.
+        """
+        stats = PlatformStats(TestPlatform.windows, 'prep')
+
+        stats.add(30)
+
+        self.assertEqual((1, 30, 0.0, 30, 30), (stats.count, stats.mean, stats.variance, stats.median, stats.p90))
+
+    def test_percentile(self):
+        """
+        Test that percentiles interpolate between the closest values.
+        """
+        self.assertEqual(5, percentile([5], 0.9))
+        self.assertEqual(2.5, percentile([4, 1, 3, 2], 0.5))
+        self.assertEqual(4, percentile([4, 1, 3, 2], 1))
+        self.assertAlmostEqual(3.7, percentile([4, 1, 3, 2], 0.9))
@@ -0,0 +1,80 @@
+import unittest
+
+from mock import mock
+
+from mod_ci.priority import (AGING, DEFAULT_WEIGHTS, FAIR_SHARE,
+                             assign_priority, compute_priority, fork_key,
+                             is_main_fork, weight_of)
+from mod_test.models import TestPlatform, TestType
+
+# two hours after the epoch, in seconds
+NOW = 7200.0
+
+
+class TestPriority(unittest.TestCase):
+
+    def test_weight_of(self):
+        """
+        Test that the weight of a test adds up its type and its fork, an override replacing the weight of the fork.
+        """
+        weights = dict(DEFAULT_WEIGHTS)
+        weights[fork_key(3)] = 5
+
+        self.assertEqual(4, weight_of(weights, TestType.pull_request, 1, True))
+        self.assertEqual(1, weight_of(weights, TestType.commit, 2, False))
+        self.assertEqual(6, weight_of(weights, TestType.commit, 3, False))
+
+    def test_heavier_test_runs_first(self):
+        """
+        Test that a test with more weight gets ahead of the tests queued shortly before it.
+        """
+        weights = dict(DEFAULT_WEIGHTS)
+        customized = compute_priority(weights, 1, 0, NOW)
+        pull_request = compute_priority(weights, 4, 0, NOW + 60)
+
+        self.assertGreater(pull_request, customized)
+
+    def test_aging(self):
+        """
+        Test that a test waiting longer than the aging per unit of weight runs before a heavier test queued later.
+        """
+        weights = dict(DEFAULT_WEIGHTS)
+        customized = compute_priority(weights, 1, 0, NOW)
+        later = NOW + (3 * weights[AGING] + 1) * 60
+        pull_request = compute_priority(weights, 4, 0, later)
+
+        self.assertGreater(customized, pull_request)
+
+    def test_fair_share(self):
+        """
+        Test that every test of a fork already waiting lowers the priority of the next test of that fork.
+        """
+        weights = dict(DEFAULT_WEIGHTS)
+
+        first = compute_priority(weights, 2, 0, NOW)
+        tenth = compute_priority(weights, 2, 9, NOW)
+
+        self.assertEqual(9 * weights[FAIR_SHARE] * weights[AGING], first - tenth)
+        self.assertGreater(compute_priority(weights, 2, 0, NOW + 60), tenth)
+
+    def test_is_main_fork(self):
+        """
+        Test recognizing the main repository among the forks.
+        """
+        github = {'repository_owner': 'test_owner', 'repository': 'test_repo'}
+
+        self.assertTrue(is_main_fork('https://github.com/test_owner/test_repo.git', github))
+        self.assertFalse(is_main_fork('https://github.com/someone/test_repo.git', github))
+
+    def test_assign_priority(self):
+        """
+        Test that the priority of a queued test counts the tests of its fork waiting on its platform.
+        """
+        db = mock.MagicMock()
+        db.query.return_value.filter.return_value.count.return_value = 2
+        test = mock.MagicMock(platform=TestPlatform.linux, test_type=TestType.commit, fork_id=2)
+
+        with mock.patch('mod_ci.priority.time.time', return_value=NOW):
+            assign_priority(db, test, False, dict(DEFAULT_WEIGHTS))
+
+        self.assertEqual(compute_priority(DEFAULT_WEIGHTS, 1, 2, NOW), test.priority)
@@ -0,0 +1,163 @@
+import datetime
+import json
+import unittest
+
+import requests
+from mock import mock
+from sqlalchemy.exc import IntegrityError
+
+from mod_ci.models import GitHubEventKind
+from mod_ci.publisher import (MAX_ATTEMPTS, GitHubClient, PublishError,
+                              deliver_due, queue_comment, queue_status)
+
+
+def response(status_code, content=None):
+    """Mock an answer of GitHub."""
+    answer = mock.MagicMock(status_code=status_code, text='')
+    answer.content = b'' if content is None else json.dumps(content).encode()
+    answer.json.return_value = content
+    return answer
+
+
+def event(kind, target, context, payload, attempts=0):
+    """Mock a queued event."""
+    return mock.MagicMock(id=1, revision=3, attempts=attempts, kind=kind, target=target, context=context,
+                          payload=json.dumps(payload))
+
+
+class TestPublisher(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.client = mock.MagicMock()
+        self.log = mock.MagicMock()
+
+    def due(self, *events):
+        self.db.query.return_value.filter.return_value.order_by.return_value.limit.return_value.all.return_value = \
+            list(events)
+
+    def test_queue_status_coalesces(self):
+        """
+        Test that a status replaces the one waiting for the same commit and context, and is added otherwise.
+        """
+        waiting = self.db.query.return_value.filter.return_value
+        waiting.update.return_value = 1
+
+        queue_status(self.db, 'abc', 'pending', 'Testing', 'CI - linux', 'url')
+
+        values = waiting.update.call_args[0][0]
+        self.assertEqual({'state': 'pending', 'description': 'Testing', 'context': 'CI - linux', 'target_url': 'url'},
+                         json.loads(values['payload']))
+        self.assertEqual(0, values['attempts'])
+        self.db.execute.assert_not_called()
+        self.db.commit.assert_called_once_with()
+
+        waiting.update.return_value = 0
+        queue_comment(self.db, 12, 'linux', 'report')
+
+        added = self.db.execute.call_args[0][1]
+        self.assertEqual((GitHubEventKind.comment, '12', 'linux', {'body': 'report'}, 0),
+                         (added['kind'], added['target'], added['context'], json.loads(added['payload']),
+                          added['revision']))
+
+    def test_queue_status_concurrently(self):
+        """
+        Test that a status queued by a concurrent request first is replaced.
+        """
+        waiting = self.db.query.return_value.filter.return_value
+        waiting.update.side_effect = [0, 1]
+        self.db.commit.side_effect = [IntegrityError('insert', {}, Exception()), None]
+
+        queue_status(self.db, 'abc', 'pending', 'Testing', 'CI - linux', 'url')
+
+        self.db.rollback.assert_called_once_with()
+        self.assertEqual(2, waiting.update.call_count)
+        self.assertEqual(2, self.db.commit.call_count)
+
+    def test_deliver_due(self):
+        """
+        Test that delivered events are removed, failed ones are retried later and dropped in the end.
+        """
+        status = {'state': 'success', 'description': 'Tests completed', 'context': 'CI - linux', 'target_url': 'url'}
+        self.due(event(GitHubEventKind.status, 'abc', 'CI - linux', status),
+                 event(GitHubEventKind.comment, '12', 'linux', {'body': 'report'}))
+        self.client.post_comment.side_effect = PublishError('unavailable', True)
+        now = datetime.datetime(2026, 1, 1)
+        same_revision = self.db.query.return_value.filter.return_value
+
+        self.assertEqual((1, 1), deliver_due(self.db, self.client, 'bot', self.log, now=now))
+
+        self.client.post_status.assert_called_once_with('abc', status)
+        self.client.post_comment.assert_called_once_with('12', 'linux', 'report', 'bot')
+        same_revision.delete.assert_called_once_with(synchronize_session=False)
+        same_revision.update.assert_called_once_with(
+            {'attempts': 1, 'next_attempt': now + datetime.timedelta(seconds=15)}, synchronize_session=False)
+
+        self.due(event(GitHubEventKind.comment, '12', 'linux', {'body': 'report'}, attempts=MAX_ATTEMPTS - 1))
+        self.assertEqual((0, 1), deliver_due(self.db, self.client, 'bot', self.log, now=now))
+        self.assertEqual(2, same_revision.delete.call_count)
+        self.log.error.assert_called_once()
+
+    def test_deliver_due_skips_claimed(self):
+        """
+        Test that an event claimed by a concurrent deliverer isn't delivered twice.
+        """
+        self.due(event(GitHubEventKind.comment, '12', 'linux', {'body': 'report'}))
+        claim = self.db.query.return_value.filter.return_value.filter.return_value
+        claim.update.return_value = 0
+
+        self.assertEqual((0, 0), deliver_due(self.db, self.client, 'bot', self.log))
+
+        self.client.post_comment.assert_not_called()
+        self.db.query.return_value.filter.return_value.delete.assert_not_called()
+
+    def test_deliver_due_of_targets(self):
+        """
+        Test that only the events of the given commits and pull requests are delivered.
+        """
+        status = {'state': 'pending', 'description': 'Tests queued', 'context': 'CI - linux', 'target_url': 'url'}
+        of_targets = self.db.query.return_value.filter.return_value.filter
+        of_targets.return_value.order_by.return_value.limit.return_value.all.return_value = [
+            event(GitHubEventKind.status, 'abc', 'CI - linux', status)]
+
+        self.assertEqual((1, 0), deliver_due(self.db, self.client, 'bot', self.log, targets=['abc', 12]))
+
+        self.client.post_status.assert_called_once_with('abc', status)
+        clause = of_targets.call_args_list[0][0][0].compile(compile_kwargs={'literal_binds': True})
+        self.assertEqual("github_event.target IN ('abc', '12')", str(clause))
+
+    def test_client_post_comment(self):
+        """
+        Test that the report of a platform replaces the previous one of the bot, and is posted when there's none.
+        """
+        client = GitHubClient('token', 'owner', 'repo')
+        client.session = mock.MagicMock()
+        comments = [{'id': 1, 'user': {'login': 'someone'}, 'body': 'linux'},
+                    {'id': 2, 'user': {'login': 'bot'}, 'body': 'windows'},
+                    {'id': 3, 'user': {'login': 'bot'}, 'body': 'linux'}]
+        client.session.request.side_effect = [response(200, comments), response(200, {}),
+                                              response(200, comments[:2]), response(201, {})]
+
+        client.post_comment('12', 'linux', 'report', 'bot')
+        client.post_comment('12', 'linux', 'report', 'bot')
+
+        self.assertEqual([
+            mock.call('GET', client.url + '/issues/12/comments', timeout=mock.ANY, params={'per_page': 100}),
+            mock.call('PATCH', client.url + '/issues/comments/3', timeout=mock.ANY, json={'body': 'report'}),
+            mock.call('GET', client.url + '/issues/12/comments', timeout=mock.ANY, params={'per_page': 100}),
+            mock.call('POST', client.url + '/issues/12/comments', timeout=mock.ANY, json={'body': 'report'}),
+        ], client.session.request.call_args_list)
+
+    def test_client_errors(self):
+        """
+        Test that only the failures that may pass are retried.
+        """
+        client = GitHubClient('token', 'owner', 'repo')
+        client.session = mock.MagicMock()
+        client.session.request.side_effect = [response(502), response(429), response(422),
+                                              requests.ConnectionError('reset')]
+
+        for retry in [True, True, False, True]:
+            with self.assertRaises(PublishError) as context:
+                client.post_status('abc', {})
+            self.assertEqual(retry, context.exception.retry)
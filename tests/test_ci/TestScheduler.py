@@ -0,0 +1,177 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import mock
+
+from mod_ci.scheduler import (Scheduler, SchedulerMetrics, kvm_names,
+                              notify_scheduler, scheduler_metrics)
+from mod_test.models import TestPlatform
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatched = []
+        self.log = mock.MagicMock()
+        vms = {'linux-1': TestPlatform.linux, 'linux-2': TestPlatform.linux, 'windows-1': TestPlatform.windows}
+        self.scheduler = Scheduler(lambda *args: self.dispatched.append(args), vms, self.log)
+
+    def test_notify_one_platform(self):
+        """
+        Test that a notification only wakes up the workers of the VMs of its platform.
+        """
+        self.scheduler.notify(TestPlatform.linux)
+
+        self.assertEqual({'linux-1': 1, 'linux-2': 1, 'windows-1': 0}, self.scheduler.depths())
+        self.assertTrue(self.scheduler.run_once('linux-2', 0))
+        self.assertEqual([(TestPlatform.linux, 'linux-2')], self.dispatched)
+
+    def test_notifications_are_coalesced(self):
+        """
+        Test that notifications pending at once are served by a single dispatch.
+        """
+        for _ in range(3):
+            self.scheduler.notify()
+
+        self.scheduler.run_once('windows-1', 0)
+
+        self.assertEqual([(TestPlatform.windows, 'windows-1')], self.dispatched)
+        self.assertEqual({'linux-1': 3, 'linux-2': 3, 'windows-1': 0}, self.scheduler.depths())
+        metrics = self.scheduler.snapshot()
+        self.assertEqual(1, metrics['windows-1']['dispatched'])
+        self.assertEqual('windows', metrics['windows-1']['platform'])
+        self.assertEqual(0, metrics['linux-1']['dispatched'])
+        self.assertEqual(3, metrics['linux-1']['queue_depth'])
+
+    def test_timeout_dispatches_anyway(self):
+        """
+        Test that a platform is checked when no notification came in before the timeout.
+        """
+        self.assertFalse(self.scheduler.run_once('linux-1', 0.01))
+        self.assertEqual([(TestPlatform.linux, 'linux-1')], self.dispatched)
+
+    def test_delayed_notification(self):
+        """
+        Test that a delayed notification is only dispatched once its delay passed, along with earlier ones.
+        """
+        self.scheduler.notify(TestPlatform.linux)
+        self.scheduler.notify(TestPlatform.linux, 0.2)
+
+        with mock.patch.object(self.scheduler.stopped, 'wait') as mock_wait:
+            self.assertTrue(self.scheduler.run_once('linux-1', 0))
+
+        mock_wait.assert_called_once()
+        self.assertGreater(mock_wait.call_args[0][0], 0.1)
+        self.assertEqual([(TestPlatform.linux, 'linux-1')], self.dispatched)
+
+    def test_stop_while_delayed(self):
+        """
+        Test that a worker waiting for a delayed notification doesn't dispatch once stopped.
+        """
+        self.scheduler.notify(TestPlatform.windows, 60)
+        self.scheduler.stopped.set()
+
+        self.scheduler.run_once('windows-1', 0)
+
+        self.assertEqual([], self.dispatched)
+
+    def test_handle_notify_delay(self):
+        """
+        Test that the delay of a client notification is passed on to the workers.
+        """
+        with mock.patch.object(self.scheduler, 'notify') as mock_notify:
+            self.scheduler.handle({'type': 'notify', 'platform': 'linux', 'delay': 60})
+
+        mock_notify.assert_called_once_with(TestPlatform.linux, 60)
+
+    def test_failed_dispatch_is_counted(self):
+        """
+        Test that an exception of a dispatch is logged and counted, without stopping the worker.
+        """
+        scheduler = Scheduler(mock.MagicMock(side_effect=RuntimeError), {'linux-1': TestPlatform.linux}, self.log)
+        scheduler.notify()
+
+        scheduler.run_once('linux-1', 0)
+
+        self.log.exception.assert_called_once()
+        self.assertEqual(1, scheduler.snapshot()['linux-1']['failed'])
+
+    def test_stop(self):
+        """
+        Test that stopped workers exit without dispatching again.
+        """
+        self.scheduler.start()
+        self.scheduler.stop()
+        for thread in self.scheduler.threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_latency(self):
+        """
+        Test the dispatch latency metrics.
+        """
+        metrics = SchedulerMetrics()
+        metrics.record('linux-1', 0.5)
+        metrics.record('linux-1', 1.5)
+
+        snapshot = metrics.snapshot({'linux-1': 0})
+
+        self.assertEqual(1500.0, snapshot['linux-1']['latency_last_ms'])
+        self.assertEqual(1000.0, snapshot['linux-1']['latency_mean_ms'])
+        self.assertEqual(1500.0, snapshot['linux-1']['latency_max_ms'])
+
+    def test_kvm_names(self):
+        """
+        Test reading the VMs of a platform from a single name, a comma separated list or a list.
+        """
+        self.assertEqual([], kvm_names({}, TestPlatform.linux))
+        self.assertEqual(['linux-1'], kvm_names({'KVM_LINUX_NAME': 'linux-1'}, TestPlatform.linux))
+        self.assertEqual(['linux-1', 'linux-2'], kvm_names({'KVM_LINUX_NAME': 'linux-1, linux-2'}, TestPlatform.linux))
+        self.assertEqual(['win-1', 'win-2'], kvm_names({'KVM_WINDOWS_NAME': ['win-1', 'win-2']}, TestPlatform.windows))
+
+    def test_scheduler_not_configured(self):
+        """
+        Test that clients don't notify a scheduler that isn't configured or isn't running.
+        """
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+
+        self.assertFalse(notify_scheduler({}))
+        self.assertFalse(notify_scheduler({'SCHEDULER_SOCKET': os.path.join(folder, 'missing.sock')}))
+        self.assertIsNone(scheduler_metrics({'SCHEDULER_SOCKET': os.path.join(folder, 'missing.sock')}))
+
+    def test_socket_round_trip(self):
+        """
+        Test notifying a scheduler and getting its metrics over its socket.
+        """
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        config = {'SCHEDULER_SOCKET': os.path.join(folder, 'scheduler.sock'), 'HMAC_KEY': 'secret'}
+        dispatched = threading.Event()
+        scheduler = Scheduler(lambda platform, kvm_name: dispatched.set(), {'linux-1': TestPlatform.linux}, self.log)
+        # only answer clients; the worker is driven by hand below
+        scheduler.start = lambda: None
+        server = threading.Thread(target=scheduler.serve_forever, args=(config['SCHEDULER_SOCKET'], b'secret'),
+                                  daemon=True)
+        server.start()
+        for _ in range(100):
+            if os.path.exists(config['SCHEDULER_SOCKET']):
+                break
+            threading.Event().wait(0.05)
+
+        self.assertTrue(notify_scheduler(config, TestPlatform.linux))
+        self.assertEqual(1, scheduler_metrics(config)['linux-1']['queue_depth'])
+        self.assertIsNone(scheduler_metrics(dict(config, HMAC_KEY='wrong')))
+
+        scheduler.run_once('linux-1', 0)
+        self.assertTrue(dispatched.is_set())
+        self.assertEqual(1, scheduler_metrics(config)['linux-1']['dispatched'])
+
+        scheduler.stop()
+        # the listener only checks whether it's stopped between two clients
+        notify_scheduler(config)
+        server.join(5)
+        self.assertFalse(server.is_alive())
@@ -0,0 +1,63 @@
+import unittest
+from types import SimpleNamespace
+
+from mod_ci.sharding import balance_shards, merge_shard_progress
+from mod_test.models import TestQueueState, TestStatus
+
+
+class TestSharding(unittest.TestCase):
+
+    def setUp(self):
+        self.shards = [SimpleNamespace(number=number, status=None, queue_state=TestQueueState.running)
+                       for number in range(2)]
+        self.test = SimpleNamespace(shards=self.shards, progress=[])
+
+    def progress(self, status):
+        self.test.progress.append(SimpleNamespace(status=status))
+
+    def test_balance_shards(self):
+        """
+        Test that the longest regression tests are spread first, each one on the shard with the least runtime.
+        """
+        runtimes = {1: 100.0, 2: 60.0, 3: 50.0, 4: 40.0, 5: 10.0}
+
+        self.assertEqual([[1, 4], [2, 3, 5]], balance_shards(runtimes, 2))
+        self.assertEqual([[1], [2, 5], [3, 4]], balance_shards(runtimes, 3))
+
+    def test_balance_shards_few_tests(self):
+        """
+        Test that there are no empty shards when there are fewer regression tests than shards.
+        """
+        self.assertEqual([[1], [2]], balance_shards({1: 5.0, 2: 5.0}, 4))
+        self.assertEqual([], balance_shards({}, 2))
+
+    def test_first_shard_moves_test(self):
+        """
+        Test that the test takes the step of the shard that reaches it first, only once.
+        """
+        self.assertEqual((TestStatus.preparation, 'm'), merge_shard_progress(
+            self.test, self.shards[0], TestStatus.preparation, 'm'))
+        self.progress(TestStatus.preparation)
+
+        self.assertIsNone(merge_shard_progress(self.test, self.shards[1], TestStatus.preparation, 'm'))
+        self.assertEqual(TestStatus.preparation, self.shards[1].status)
+
+    def test_completed_after_all_shards(self):
+        """
+        Test that a test only completes once all of its shards did.
+        """
+        self.progress(TestStatus.testing)
+
+        self.assertIsNone(merge_shard_progress(self.test, self.shards[1], TestStatus.completed, 'done'))
+        self.assertEqual(TestQueueState.finished, self.shards[1].queue_state)
+        self.assertEqual((TestStatus.completed, 'done'), merge_shard_progress(
+            self.test, self.shards[0], TestStatus.completed, 'done'))
+
+    def test_canceled_shard_cancels_test(self):
+        """
+        Test that a canceled shard cancels its test right away.
+        """
+        self.progress(TestStatus.building)
+
+        self.assertEqual((TestStatus.canceled, 'error'), merge_shard_progress(
+            self.test, self.shards[0], TestStatus.canceled, 'error'))
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from lxml import etree
+
+from mod_ci.ci_files import (COLLECTION_FILE, IMPACTED_TESTS_FILE, Suite,
+                             TestFileCache, cache_key)
+from mod_regression.models import InputType, OutputType
+
+
+def output_file(output_id, correct):
+    """Create an output file of a regression test."""
+    return SimpleNamespace(
+        id=output_id, ignore=False,
+        filename_correct=correct + '.srt',
+        create_correct_filename=lambda name: name + '.srt',
+        filename_expected=lambda sha: sha + '.srt'
+    )
+
+
+class TestTestFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def suite(self):
+        suite = Suite.__new__(Suite)
+        sample = SimpleNamespace(sha='abc', filename='abc.ts')
+        suite.tests = {regression_id: ('-out=srt', InputType.file, OutputType.file, sample)
+                       for regression_id in [1, 2, 3]}
+        suite.outputs = {1: [output_file(11, 'correct1')], 2: [output_file(21, 'correct2')]}
+        suite.categories = [('broken', [3]), ('general', [1, 2])]
+        suite.baseline_got = {21: 'got2'}
+        return suite
+
+    def test_cache_key(self):
+        """
+        Test that the key depends on the set of regression tests, but on the order of the impacted ones.
+        """
+        key = cache_key(3, '1-5', [2, 1], [])
+
+        self.assertEqual(key, cache_key(3, '1-5', [1, 2, 2], []))
+        self.assertTrue(key.startswith('r3/'))
+        self.assertNotEqual(key, cache_key(4, '1-5', [1, 2], []))
+        self.assertNotEqual(key, cache_key(3, '1-6', [1, 2], []))
+        self.assertNotEqual(cache_key(3, '1-5', [1, 2], [1, 2]), cache_key(3, '1-5', [1, 2], [2, 1]))
+
+    def test_build(self):
+        """
+        Test that the impacted regression tests get a file of their own, listed first, and the baseline results used.
+        """
+        files = dict(self.suite().build([2]))
+
+        collection = etree.fromstring(files[COLLECTION_FILE])
+        self.assertEqual([IMPACTED_TESTS_FILE, 'broken.xml', 'general.xml'],
+                         [location.text for location in collection.iter('location')])
+        impacted = etree.fromstring(files[IMPACTED_TESTS_FILE])
+        self.assertEqual(['2'], [entry.get('id') for entry in impacted])
+        self.assertEqual('got2.srt', impacted.find('entry/compare/file/correct').text)
+        general = etree.fromstring(files['general.xml'])
+        self.assertEqual(['1'], [entry.get('id') for entry in general])
+        self.assertEqual('correct1.srt', general.find('entry/compare/file/correct').text)
+        self.assertEqual('abc.ts', general.find('entry/input').text)
+
+    def test_build_skips_empty_categories(self):
+        """
+        Test that categories without regression tests to run get no file.
+        """
+        suite = self.suite()
+        del suite.tests[3]
+
+        self.assertEqual(['general.xml', COLLECTION_FILE], [name for name, _ in suite.build([])])
+
+    def test_cache(self):
+        """
+        Test that cached files are copied to the folder of a VM, and missing keys reported.
+        """
+        cache = TestFileCache(os.path.join(self.folder, 'cache'))
+        vm_folder = os.path.join(self.folder, 'vm')
+        os.mkdir(vm_folder)
+        files = [('general.xml', b'<tests/>'), (COLLECTION_FILE, b'<multitest/>')]
+
+        self.assertFalse(cache.copy_to('r1/key', vm_folder))
+        cache.store('r1/key', files)
+
+        self.assertTrue(cache.copy_to('r1/key', vm_folder))
+        with open(os.path.join(vm_folder, 'general.xml'), 'rb') as f:
+            self.assertEqual(b'<tests/>', f.read())
+
+    def test_cache_eviction(self):
+        """
+        Test that storing files drops the other revisions and the entries beyond the maximum.
+        """
+        cache = TestFileCache(os.path.join(self.folder, 'cache'), max_entries=2)
+        files = [(COLLECTION_FILE, b'<multitest/>')]
+        cache.store('r1/old', files)
+        for number, key in enumerate(['r2/a', 'r2/b', 'r2/c']):
+            cache.store(key, files)
+            entry = os.path.join(self.folder, 'cache', key)
+            os.utime(entry, (number, number))
+
+        self.assertEqual(['r2'], os.listdir(os.path.join(self.folder, 'cache')))
+        cache.evict('r2')
+        self.assertEqual(['b', 'c'], sorted(os.listdir(os.path.join(self.folder, 'cache', 'r2'))))
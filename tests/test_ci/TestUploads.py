@@ -0,0 +1,76 @@
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from mod_ci.uploads import store_upload
+from mod_test.result_store import CODECS, FileResultStore
+
+
+class TestUploads(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.results = os.path.join(self.folder, 'TestResults')
+        self.temp = os.path.join(self.folder, 'TempFiles')
+        os.mkdir(self.results)
+        os.mkdir(self.temp)
+        self.store = FileResultStore(self.results, CODECS['none'], self.temp)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_store_upload(self):
+        """
+        Test that an upload is stored under its hash, and an identical one isn't written again.
+        """
+        content = b'1\n00:00:01,000 --> 00:00:02,000\nHello\n'
+        digest = hashlib.sha256(content).hexdigest()
+
+        self.assertEqual((digest, True), store_upload(io.BytesIO(content), self.store, self.temp, '.srt'))
+        self.assertEqual((digest, False), store_upload(io.BytesIO(content), self.store, self.temp, '.srt'))
+
+        with open(os.path.join(self.results, digest + '.srt'), 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertEqual([], os.listdir(self.temp))
+
+    def test_store_large_upload(self):
+        """
+        Test that an upload larger than the spool is written as it's read, and dropped when it's stored already.
+        """
+        content = os.urandom(64 * 1024)
+        digest = hashlib.sha256(content).hexdigest()
+
+        self.assertEqual((digest, True), store_upload(io.BytesIO(content), self.store, self.temp, '.bin',
+                                                      spool_size=1024))
+        self.assertEqual((digest, False), store_upload(io.BytesIO(content), self.store, self.temp, '.bin',
+                                                       spool_size=1024))
+
+        with open(os.path.join(self.results, digest + '.bin'), 'rb') as f:
+            self.assertEqual(content, f.read())
+        self.assertEqual([], os.listdir(self.temp))
+
+    def test_store_compressed_upload(self):
+        """
+        Test that uploads are compressed, and a stored one is decompressed next to it when it must be read plainly.
+        """
+        store = FileResultStore(self.results, CODECS['gzip'], self.temp)
+        small = b'Hello\n' * 100
+        large = os.urandom(64 * 1024)
+
+        for content in [small, large]:
+            digest = hashlib.sha256(content).hexdigest()
+            self.assertEqual((digest, True), store_upload(io.BytesIO(content), store, self.temp, '.srt',
+                                                          spool_size=1024))
+            self.assertEqual([digest + '.srt.gz'], [name for name in os.listdir(self.results) if digest in name])
+            with gzip.open(os.path.join(self.results, digest + '.srt.gz'), 'rb') as f:
+                self.assertEqual(content, f.read())
+
+            self.assertEqual((digest, False), store_upload(io.BytesIO(content), store, self.temp, '.srt',
+                                                           compress=False, spool_size=1024))
+            with open(os.path.join(self.results, digest + '.srt'), 'rb') as f:
+                self.assertEqual(content, f.read())
+        self.assertEqual([], os.listdir(self.temp))
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mod_test.nicediff.captions import (CaptionParseError, Cue, differing_cues,
+                                        parse_dfxp, parse_srt,
+                                        parse_time_expression, parse_timestamp,
+                                        parser_for)
+from mod_test.nicediff.diff import generate_file_diff
+from mod_test.nicediff.pages import generate_file_diff_page
+
+EXPECTED_SRT = """1
+00:00:01,000 --> 00:00:02,500
+May the fourth
+
+2
+00:00:03,000 --> 00:00:04,000
+be with you!
+
+3
+00:00:05,000 --> 00:00:06,000
+Always.
+"""
+
+DRIFTED_SRT = """1
+00:00:01,040 --> 00:00:02,540
+May the fourth
+
+2
+00:00:03,040 --> 00:00:04,040
+be with you!
+
+3
+00:00:05,040 --> 00:00:06,040
+Always!
+"""
+
+WEBVTT = """WEBVTT
+
+NOTE a comment --> not a cue
+
+intro
+00:01.000 --> 00:02.500 align:start
+May the fourth
+be with you!
+"""
+
+DFXP = """<?xml version="1.0" encoding="UTF-8"?>
+<tt xmlns="http://www.w3.org/ns/ttml" xmlns:tts="http://www.w3.org/ns/ttml#styling">
+  <body><div>
+    <p begin="00:00:01.000" end="00:00:02.500">May the fourth<br/>be with you!</p>
+    <p begin="3s" end="4000ms"><span tts:color="white">Always</span>.</p>
+  </div></body>
+</tt>
+"""
+
+
+class TestCaptions(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_parse_timestamps(self):
+        self.assertEqual(3723004, parse_timestamp('01:02:03,004'))
+        self.assertEqual(12340, parse_timestamp('00:12.340'))
+        self.assertEqual(12500, parse_time_expression('00:00:12.5'))
+        self.assertEqual(12340, parse_time_expression('12.34s'))
+        self.assertEqual(340, parse_time_expression('340ms'))
+        with self.assertRaises(CaptionParseError):
+            parse_timestamp('12 seconds')
+
+    def test_parse_srt(self):
+        cues = parse_srt(self.write('expected.srt', EXPECTED_SRT))
+
+        self.assertEqual(3, len(cues))
+        self.assertEqual(Cue(1000, 2500, 'May the fourth', 2, '00:00:01,000 --> 00:00:02,500'), cues[0])
+        self.assertEqual('Always.', cues[2].text)
+
+    def test_parse_webvtt(self):
+        cues = parse_srt(self.write('expected.vtt', WEBVTT))
+
+        self.assertEqual([Cue(1000, 2500, 'May the fourth\nbe with you!', 6, '00:01.000 --> 00:02.500 align:start')],
+                         cues)
+
+    def test_parse_dfxp(self):
+        cues = parse_dfxp(self.write('expected.dfxp', DFXP))
+
+        self.assertEqual([(1000, 2500, 'May the fourth\nbe with you!'), (3000, 4000, 'Always.')],
+                         [(cue.start, cue.end, cue.text) for cue in cues])
+
+    def test_parse_errors(self):
+        with self.assertRaises(CaptionParseError):
+            parse_srt(self.write('empty.srt', 'not captions\n'))
+        with self.assertRaises(CaptionParseError):
+            parse_dfxp(self.write('broken.dfxp', '<tt><p begin="1s"'))
+
+    def test_parser_for(self):
+        self.assertEqual(parse_srt, parser_for('.SRT'))
+        self.assertEqual(parse_dfxp, parser_for('.dfxp'))
+        self.assertIsNone(parser_for('.txt'))
+
+    def test_differing_cues_tolerance(self):
+        """
+        Test that drifted cues only differ when the drift exceeds the tolerance.
+        """
+        expected = parse_srt(self.write('expected.srt', EXPECTED_SRT))
+        drifted = parse_srt(self.write('drifted.srt', DRIFTED_SRT))
+
+        self.assertEqual([(expected[2], drifted[2])], list(differing_cues(expected, drifted, tolerance=40)))
+        self.assertEqual(list(zip(expected, drifted)), list(differing_cues(expected, drifted, tolerance=39)))
+
+    def test_differing_cues_missing_and_extra(self):
+        expected = parse_srt(self.write('expected.srt', EXPECTED_SRT))
+
+        self.assertEqual([(expected[1], None)], list(differing_cues(expected, expected[:1] + expected[2:])))
+        self.assertEqual([(None, expected[1])], list(differing_cues(expected[:1] + expected[2:], expected)))
+
+    def test_generate_file_diff_captions(self):
+        """
+        Test that caption files are compared cue by cue, and other files line by line.
+        """
+        expected = self.write('expected.srt', EXPECTED_SRT)
+        drifted = self.write('drifted.srt', DRIFTED_SRT)
+
+        caption_diff = ''.join(generate_file_diff(expected, drifted, caption_tolerance=100))
+        line_diff = ''.join(generate_file_diff(expected, drifted))
+
+        self.assertEqual(2, caption_diff.count('<table>'))
+        self.assertIn('Always</div>!', caption_diff)
+        self.assertEqual(5, line_diff.count('<table>'))
+
+    def test_generate_file_diff_falls_back_to_lines(self):
+        expected = self.write('expected.srt', 'not captions\n')
+        obtained = self.write('obtained.srt', 'not captions either\n')
+
+        self.assertEqual(2, ''.join(generate_file_diff(expected, obtained, caption_tolerance=100)).count('<table>'))
+
+    def test_generate_file_diff_equal_cues(self):
+        """
+        Test that caption files with equal cues that still differ are compared line by line.
+        """
+        expected = self.write('expected.srt', EXPECTED_SRT)
+        renumbered = self.write('renumbered.srt', EXPECTED_SRT.replace('3\n', '4\n', 1) + '\n')
+        expected_dfxp = self.write('expected.dfxp', DFXP)
+        restyled = self.write('restyled.dfxp', DFXP.replace('tts:color="white"', 'tts:color="red"'))
+
+        for correct, result in [(expected, renumbered), (expected_dfxp, restyled)]:
+            diff = ''.join(generate_file_diff(correct, result, caption_tolerance=100))
+            self.assertGreater(diff.count('<table>'), 1)
+            rows, _ = generate_file_diff_page(correct, result, 0, 50, caption_tolerance=100)
+            self.assertGreater(rows, 0)
@@ -4,8 +4,8 @@ from werkzeug.exceptions import Forbidden, NotFound
 
 from mod_auth.models import Role
 from mod_regression.models import RegressionTest
-from mod_test.models import (Test, TestPlatform, TestProgress, TestResult,
-                             TestResultFile, TestStatus)
+from mod_test.models import (Test, TestPlatform, TestProgress, TestQueueState,
+                             TestResult, TestResultFile, TestStatus)
 from tests.base import BaseTestCase
 
 
@@ -64,6 +64,7 @@ class TestControllers(BaseTestCase):
             response = c.get('/test/restart_test/3')
             test = Test.query.filter(Test.id == 3).first()
             self.assertEqual(test.finished, False)
+            self.assertEqual(test.queue_state, TestQueueState.queued)
 
     def test_restart_fails_on_no_permission(self):
         self.create_user_with_role(
@@ -84,6 +85,7 @@ class TestControllers(BaseTestCase):
             response = c.get('/test/stop_test/3')
             test = Test.query.filter(Test.id == 3).first()
             self.assertEqual(test.finished, True)
+            self.assertEqual(test.queue_state, TestQueueState.finished)
 
     def test_stop_fails_on_no_permission(self):
         self.create_user_with_role(
@@ -119,10 +121,10 @@ class TestControllers(BaseTestCase):
         self.assert_template_used('test/test_not_found.html')
 
     @mock.patch('mod_test.controllers.g')
-    @mock.patch('mod_test.controllers.GeneralData')
+    @mock.patch('mod_test.controllers.PlatformStats')
     @mock.patch('mod_test.controllers.Category')
     @mock.patch('mod_test.controllers.TestProgress')
-    def test_data_for_test(self, mock_test_progress, mock_category, mock_gen_data, mock_g):
+    def test_data_for_test(self, mock_test_progress, mock_category, mock_stats, mock_g):
         """
         Test get_data_for_test method.
         """
@@ -135,7 +137,7 @@ class TestControllers(BaseTestCase):
         self.assertIsInstance(result, dict)
         self.assertEqual(5, mock_g.db.query.call_count)
         mock_category.query.filter.assert_called_once()
-        mock_gen_data.query.filter.assert_called()
+        mock_stats.query.filter.assert_called_once_with(mock_stats.platform == mock_test.platform)
 
     @mock.patch('mod_test.controllers.Test')
     def test_get_json_data_no_test(self, mock_test):
@@ -219,6 +221,67 @@ class TestControllers(BaseTestCase):
 
         self.assertTrue(response, mock_response())
 
+    @mock.patch('mod_test.controllers.diff_cache_from_config')
+    @mock.patch('mod_test.controllers.TestResultFile')
+    @mock.patch('mod_test.controllers.request')
+    def test_generate_diff_cached_gzip(self, mock_request, mock_test_result_file, mock_cache):
+        """
+        Test that a cached diff is handed over to nginx when the client accepts gzip.
+        """
+        from mod_test.controllers import generate_diff
+
+        mock_request.is_xhr = True
+        mock_request.accept_encodings = ['gzip']
+        mock_cache.return_value.relative_path.return_value = 'v1/a_b_view.html.gz'
+
+        response = generate_diff(1, 1, 1)
+
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/diffcache-download/v1/a_b_view.html.gz')
+        mock_cache.return_value.store.assert_not_called()
+
+    @mock.patch('mod_test.controllers.read_cached_diff')
+    @mock.patch('mod_test.controllers.diff_cache_from_config')
+    @mock.patch('mod_test.controllers.TestResultFile')
+    @mock.patch('mod_test.controllers.request')
+    def test_generate_diff_cached_plain(self, mock_request, mock_test_result_file, mock_cache, mock_read):
+        """
+        Test that a cached diff is decompressed when the client doesn't accept gzip.
+        """
+        from mod_test.controllers import generate_diff
+
+        mock_request.accept_encodings = []
+        mock_read.return_value = iter(['diff'])
+
+        response = generate_diff(1, 1, 1, to_view=0)
+
+        self.assertEqual(response.get_data(as_text=True), 'diff')
+        self.assertIn('attachment', response.headers['Content-disposition'])
+        mock_read.assert_called_once_with(mock_cache.return_value.lookup.return_value)
+        mock_cache.return_value.store.assert_not_called()
+
+    @mock.patch('mod_test.controllers.diff_cache_from_config')
+    @mock.patch('mod_test.controllers.TestResultFile')
+    @mock.patch('mod_test.controllers.request')
+    def test_generate_diff_page(self, mock_request, mock_test_result_file, mock_cache):
+        """
+        Test viewing a page of a diff.
+        """
+        from werkzeug.datastructures import MultiDict
+
+        from mod_test.controllers import MAX_DIFF_PAGE_SIZE, generate_diff
+
+        mock_request.is_xhr = True
+        mock_request.args = MultiDict({'offset': '50', 'limit': '10000'})
+        result = mock_test_result_file.query.filter.return_value.first.return_value
+        result.stream_html_diff_page.return_value = (120, iter(['page']))
+
+        response = generate_diff(1, 1, 1)
+
+        self.assertEqual(response.get_data(as_text=True), 'page')
+        self.assertEqual(response.headers['X-Diff-Total'], '120')
+        result.stream_html_diff_page.assert_called_once_with(
+            mock.ANY, 50, MAX_DIFF_PAGE_SIZE, mock.ANY, mock_cache.return_value.index_path.return_value)
+
     @mock.patch('mod_test.controllers.Test')
     def test_download_build_log_file_test_not_found(self, mock_test):
         """
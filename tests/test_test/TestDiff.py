@@ -1,8 +1,15 @@
 import os
 import unittest
+from array import array
 from pathlib import Path
+from unittest import mock
 
-from mod_test.nicediff.diff import get_html_diff
+from mod_regression.models import RegressionTestOutput
+from mod_test.models import TestResultFile
+from mod_test.nicediff.cache import LRUCache, make_key, region_cache
+from mod_test.nicediff.diff import (changed_hunks, compress, get_html_diff,
+                                    intern_tokens, same_regions)
+from mod_test.nicediff.myers import matching_blocks
 from tests.base import load_file_lines
 
 STATIC_MOCK_DIR = os.path.join(Path(__file__).parents[1], 'static_mock_files')
@@ -80,3 +87,130 @@ class TestDiff(unittest.TestCase):
         obtained_tr_count = obtained_diff.count("</tr>")
 
         self.assertGreater(obtained_tr_count, limit_tr_count)
+
+    def test_matching_blocks_are_common_runs(self):
+        """
+        Test that the engine returns ordered runs shared by both sequences.
+        """
+        a = list('abcabba')
+        b = list('cbabac')
+
+        blocks = matching_blocks(a, b)
+
+        self.assertEqual(4, sum(size for _, _, size in blocks))
+        for i, j, size in blocks:
+            self.assertEqual(a[i:i + size], b[j:j + size])
+
+    def test_intern_tokens(self):
+        """
+        Test that equal tokens of both lines get the same integer id.
+        """
+        a, b = intern_tokens(['May', ' ', 'the', ' ', 'fourth'], ['the', ' ', 'twenty', ' ', 'fourth'])
+
+        self.assertEqual(array('I', [0, 1, 2, 1, 3]), a)
+        self.assertEqual(array('I', [2, 1, 4, 1, 3]), b)
+
+    def test_matching_blocks_on_interned_tokens(self):
+        """
+        Test that the engine finds the same runs on interned tokens, also across the slices compared at once.
+        """
+        a = list('x' * 100 + 'abcabba' + 'y' * 100)
+        b = list('x' * 100 + 'cbabac' + 'y' * 100)
+
+        self.assertEqual(matching_blocks(a, b), matching_blocks(*intern_tokens(a, b)))
+        self.assertEqual((0, 0, 100), matching_blocks(a, b)[0])
+        self.assertEqual((107, 106, 100), matching_blocks(a, b)[-1])
+
+    def test_same_regions_on_long_lines(self):
+        """
+        Test that long lines with a single change are split in two regions around it.
+        """
+        correct = compress(' '.join(['word'] * 5000))
+        result = compress(' '.join(['word'] * 2500 + ['other'] + ['word'] * 2499))
+
+        regions = same_regions(result, correct)
+
+        self.assertEqual([[0, 5000, 0, 5000], [5001, 9999, 5001, 9999]], regions)
+
+    def test_region_cache_hit(self):
+        """
+        Test that diffing the same pair of lines again is served from the region cache.
+        """
+        region_cache.clear()
+        correct = compress('00:00:12,340 --> 00:00:15,356\n')
+        result = compress('00:00:12,300 --> 00:00:15,356\n')
+
+        first = same_regions(result, correct)
+        second = same_regions(result, correct)
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, region_cache.hits)
+        self.assertEqual(1, region_cache.misses)
+
+    def test_region_cache_bounds(self):
+        """
+        Test that the cache evicts the least recently used entries once a bound is exceeded.
+        """
+        cache = LRUCache(max_entries=2)
+        cache.put(make_key(['a']), (1,))
+        cache.put(make_key(['b']), (2,))
+        cache.get(make_key(['a']))
+        cache.put(make_key(['c']), (3,))
+
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(make_key(['b'])))
+        self.assertEqual((1,), cache.get(make_key(['a'])))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+        byte_bound = LRUCache(max_bytes=cache.stats()['bytes'] // 2)
+        for name in ['a', 'b', 'c']:
+            byte_bound.put(make_key([name]), (name,))
+        self.assertLessEqual(byte_bound.bytes, byte_bound.max_bytes)
+
+    def test_region_cache_after_fork(self):
+        """
+        Test that a forked process starts with an empty cache and a lock of its own.
+        """
+        cache = LRUCache()
+        cache.put(make_key(['a']), (1,))
+        # a thread of the parent held the lock while forking
+        cache._lock.acquire()
+
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNone(cache.get(make_key(['a'])))
+            cache.put(make_key(['b']), (2,))
+            self.assertEqual(1, len(cache))
+            self.assertEqual(0, cache.stats()['hits'])
+
+    def test_inserted_line_shows_once(self):
+        """
+        Test that a line inserted at the top of the result doesn't make all following lines differ.
+        """
+        expected = ['{number}\n'.format(number=number) for number in range(100)]
+        obtained = ['0\n', 'extra line\n'] + expected[1:]
+
+        obtained_diff = get_html_diff(expected, obtained, to_view=False)
+
+        self.assertEqual(4, obtained_diff.count('</tr>'))
+        self.assertIn('<td class="diff-table-td" style="width: 30px;">2</td>', obtained_diff)
+
+    def test_changed_hunks(self):
+        """
+        Test that changed hunks pair up replaced lines and keep insertions and deletions apart.
+        """
+        expected = ['a\n', 'b\n', 'c\n', 'd\n', 'e\n']
+        obtained = ['a\n', 'x\n', 'c\n', 'e\n', 'f\n']
+
+        self.assertEqual([(1, 2, 1, 2), (3, 4, 3, 3), (5, 5, 4, 5)], list(changed_hunks(expected, obtained)))
+
+    def test_stream_html_diff_from_files(self):
+        """
+        Test that streaming the diff of two stored result files gives the same diff as the in-memory version.
+        """
+        result_file = TestResultFile(1, 1, 1, 'expected', 'obtained')
+        result_file.regression_test_output = RegressionTestOutput(1, 'expected', '.txt', '')
+
+        streamed = ''.join(result_file.stream_html_diff(STATIC_MOCK_DIR, to_view=False))
+
+        self.assertEqual(get_html_diff(load_file_lines(EXPECTED_RESULT_FILE), load_file_lines(OBTAINED_RESULT_FILE),
+                                       to_view=False), streamed)
@@ -0,0 +1,107 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mod_test.diff_cache import (MODE_FULL, MODE_VIEW, DiffCache, diff_mode,
+                                 read_cached_diff)
+
+
+class TestDiffCache(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = DiffCache(self.root, max_size=1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_diff_mode(self):
+        self.assertEqual(diff_mode(True), MODE_VIEW)
+        self.assertEqual(diff_mode(False), MODE_FULL)
+
+    def test_store_and_lookup(self):
+        """
+        Test that a fully streamed diff ends up gzipped in the cache.
+        """
+        self.assertIsNone(self.cache.lookup('a', 'b', MODE_VIEW))
+
+        chunks = list(self.cache.store('a', 'b', MODE_VIEW, iter(['<table>', 'diff', '</table>'])))
+
+        self.assertEqual(chunks, ['<table>', 'diff', '</table>'])
+        path = self.cache.lookup('a', 'b', MODE_VIEW)
+        self.assertEqual(path, self.cache.path('a', 'b', MODE_VIEW))
+        self.assertTrue(path.endswith('a_b_view.html.gz'))
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(f.read(), '<table>diff</table>')
+        self.assertEqual(''.join(read_cached_diff(path)), '<table>diff</table>')
+        self.assertIsNone(self.cache.lookup('a', 'b', MODE_FULL))
+
+    def test_interrupted_store_is_discarded(self):
+        """
+        Test that a diff of which not all chunks were sent isn't cached.
+        """
+        chunks = self.cache.store('a', 'b', MODE_FULL, iter(['<table>', 'diff', '</table>']))
+        next(chunks)
+        chunks.close()
+
+        self.assertIsNone(self.cache.lookup('a', 'b', MODE_FULL))
+        self.assertEqual(os.listdir(self.cache.folder), [])
+
+    def test_evict_least_recently_used(self):
+        """
+        Test that the least recently used diffs are evicted once the cache is too big.
+        """
+        content = os.urandom(600).hex()
+        for idx, name in enumerate(['old', 'used', 'new']):
+            list(self.cache.store(name, name, MODE_VIEW, iter([content])))
+            os.utime(self.cache.path(name, name, MODE_VIEW), (idx, idx))
+        os.utime(self.cache.path('used', 'used', MODE_VIEW), (10, 10))
+        self.cache.max_size = sum(
+            os.path.getsize(self.cache.path(name, name, MODE_VIEW)) for name in ['used', 'new'])
+
+        self.assertEqual(self.cache.evict(), 1)
+
+        self.assertIsNone(self.cache.lookup('old', 'old', MODE_VIEW))
+        self.assertIsNotNone(self.cache.lookup('used', 'used', MODE_VIEW))
+        self.assertIsNotNone(self.cache.lookup('new', 'new', MODE_VIEW))
+
+    def test_store_walks_when_over_size(self):
+        """
+        Test that storing a diff only walks the cache when its total size is unknown or over the maximum.
+        """
+        with mock.patch.object(self.cache, 'evict', wraps=self.cache.evict) as mock_evict:
+            list(self.cache.store('a', 'b', MODE_VIEW, iter(['diff'])))
+            self.assertEqual(1, mock_evict.call_count)
+            size = os.path.getsize(self.cache.path('a', 'b', MODE_VIEW))
+            os.utime(self.cache.path('a', 'b', MODE_VIEW), (0, 0))
+
+            list(self.cache.store('a', 'c', MODE_VIEW, iter(['diff'])))
+            self.assertEqual(1, mock_evict.call_count)
+            self.assertEqual(2 * size, self.cache.update_size())
+
+            self.cache.max_size = 2 * size
+            list(self.cache.store('a', 'd', MODE_VIEW, iter(['diff'])))
+            self.assertEqual(2, mock_evict.call_count)
+
+        self.assertEqual(2 * size, self.cache.update_size())
+        self.assertIsNone(self.cache.lookup('a', 'b', MODE_VIEW))
+
+    def test_evict_older_format_first(self):
+        """
+        Test that diffs of an older format version are evicted before the current ones.
+        """
+        stale_folder = os.path.join(self.root, 'v0')
+        os.makedirs(stale_folder)
+        stale = os.path.join(stale_folder, DiffCache.file_name('a', 'b', MODE_VIEW))
+        with open(stale, 'wb') as f:
+            f.write(os.urandom(2048))
+        list(self.cache.store('a', 'b', MODE_VIEW, iter(['diff'])))
+        os.utime(self.cache.path('a', 'b', MODE_VIEW), (0, 0))
+        self.cache.max_size = 1024
+
+        self.cache.evict()
+
+        self.assertFalse(os.path.exists(stale))
+        self.assertIsNotNone(self.cache.lookup('a', 'b', MODE_VIEW))
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mod_regression.models import RegressionTestOutput
+from mod_test.diff_cache import MODE_FULL, MODE_VIEW, DiffCache
+from mod_test.diff_worker import (DiffPrecomputer, get_precomputer,
+                                  queue_diffs, render_diffs)
+from mod_test.models import TestResultFile
+
+
+class TestDiffWorker(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.results = os.path.join(self.root, 'TestResults')
+        os.makedirs(self.results)
+        with open(os.path.join(self.results, 'expected.srt'), 'w') as f:
+            f.write('1\nsame\nexpected\n')
+        with open(os.path.join(self.results, 'got.srt'), 'w') as f:
+            f.write('1\nsame\nobtained\n')
+        self.cache = DiffCache(os.path.join(self.root, 'DiffCache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    @staticmethod
+    def result_file(got='got'):
+        result_file = TestResultFile(1, 1, 1, 'expected', got)
+        result_file.regression_test_output = RegressionTestOutput(1, 'expected', '.srt', '')
+        return result_file
+
+    def test_render_diffs(self):
+        """
+        Test that both the view and the download diff are rendered, once.
+        """
+        self.assertEqual(render_diffs(self.cache, self.results, 'expected', 'got', '.srt'), 2)
+
+        self.assertIsNotNone(self.cache.lookup('expected', 'got', MODE_VIEW))
+        self.assertIsNotNone(self.cache.lookup('expected', 'got', MODE_FULL))
+        self.assertEqual(render_diffs(self.cache, self.results, 'expected', 'got', '.srt'), 0)
+
+    def test_queue_diffs_disabled(self):
+        """
+        Test that nothing is queued when precomputing diffs is disabled, or when the result is equal.
+        """
+        self.assertIsNone(get_precomputer({}))
+        self.assertFalse(queue_diffs({'SAMPLE_REPOSITORY': self.root}, self.result_file()))
+        self.assertFalse(queue_diffs({'DIFF_PRECOMPUTE_WORKERS': 1}, self.result_file(got=None)))
+        self.assertFalse(queue_diffs({'DIFF_PRECOMPUTE_WORKERS': 1}, self.result_file(got='expected')))
+
+    @mock.patch('mod_test.diff_worker.ProcessPoolExecutor')
+    def test_bounded_queue(self, mock_pool):
+        """
+        Test that results are dropped once too many diffs are pending, until one finishes.
+        """
+        precomputer = DiffPrecomputer(workers=2, log=mock.MagicMock(), queue_size=2)
+
+        self.assertTrue(precomputer.submit(self.cache, self.results, self.result_file()))
+        self.assertTrue(precomputer.submit(self.cache, self.results, self.result_file()))
+        self.assertFalse(precomputer.submit(self.cache, self.results, self.result_file()))
+
+        mock_pool.assert_called_once_with(max_workers=2)
+        mock_pool.return_value.submit.assert_called_with(
+            mock.ANY, self.cache.root, self.cache.max_size, self.results, 'expected', 'got', '.srt', None)
+        self.assertEqual(precomputer.dropped, 1)
+        done_callback = mock_pool.return_value.submit.return_value.add_done_callback.call_args[0][0]
+        future = mock_pool.return_value.submit.return_value
+        future.cancelled.return_value = False
+        future.exception.return_value = None
+        done_callback(future)
+        self.assertEqual(precomputer.pending, 1)
+        self.assertTrue(precomputer.submit(self.cache, self.results, self.result_file()))
+
+    @mock.patch('mod_test.diff_worker.ProcessPoolExecutor')
+    def test_failed_diff_is_logged(self, mock_pool):
+        """
+        Test that a diff failing in a worker process is logged, and no longer counts as pending.
+        """
+        mock_log = mock.MagicMock()
+        precomputer = DiffPrecomputer(workers=1, log=mock_log)
+        precomputer.submit(self.cache, self.results, self.result_file())
+        future = mock_pool.return_value.submit.return_value
+        future.cancelled.return_value = False
+        error = OSError('gone')
+        future.exception.return_value = error
+
+        future.add_done_callback.call_args[0][0](future)
+
+        self.assertEqual(precomputer.pending, 0)
+        mock_log.error.assert_called_once_with('Precomputing a diff failed: gone', exc_info=error)
+
+    @mock.patch('mod_test.diff_worker.ProcessPoolExecutor')
+    def test_pool_not_shared_after_fork(self, mock_pool):
+        """
+        Test that a forked process starts a pool of its own instead of using the one of its parent.
+        """
+        precomputer = DiffPrecomputer(workers=1, log=mock.MagicMock(), queue_size=1)
+        precomputer.submit(self.cache, self.results, self.result_file())
+
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.assertTrue(precomputer.submit(self.cache, self.results, self.result_file()))
+
+        self.assertEqual(2, mock_pool.call_count)
+        self.assertEqual(precomputer.pending, 1)
+
+    def test_precompute_in_worker_process(self):
+        """
+        Test rendering the diffs in an actual worker process.
+        """
+        precomputer = DiffPrecomputer(workers=1, log=mock.MagicMock())
+
+        self.assertTrue(precomputer.submit(self.cache, self.results, self.result_file()))
+        precomputer.shutdown()
+
+        self.assertEqual(precomputer.pending, 0)
+        self.assertIsNotNone(self.cache.lookup('expected', 'got', MODE_VIEW))
+        self.assertIsNotNone(self.cache.lookup('expected', 'got', MODE_FULL))
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from mod_test.nicediff import pages
+from mod_test.nicediff.diff import HEADER_TABLE, FileLines, get_html_diff
+from mod_test.nicediff.pages import DiffIndex, generate_file_diff_page
+
+
+class TestPages(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        correct = ['line {idx}\n'.format(idx=idx) for idx in range(1000)]
+        result = list(correct)
+        # a long changed block, an insertion and a deletion
+        for idx in range(100, 300):
+            result[idx] = 'changed {idx}\n'.format(idx=idx)
+        result.insert(500, 'inserted\n')
+        del result[800]
+        self.correct_lines, self.result_lines = correct, result
+        self.correct = self.write('expected.txt', correct)
+        self.result = self.write('obtained.txt', result)
+        self.full_diff = get_html_diff(correct, result, to_view=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, lines):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        return path
+
+    def test_index(self):
+        """
+        Test that the index counts every differing row, in chunks of bounded size.
+        """
+        index = DiffIndex.build(self.correct, self.result)
+
+        self.assertEqual(202, index.rows)
+        self.assertEqual(6, len(index))
+
+    def test_pages_match_full_diff(self):
+        """
+        Test that all pages together, whatever their size, give the full diff.
+        """
+        index = DiffIndex.build(self.correct, self.result)
+
+        for limit in [1, 7, 50, 64, 500]:
+            paged = HEADER_TABLE + ''.join(
+                ''.join(index.page(self.correct, self.result, offset, limit))
+                for offset in range(0, index.rows, limit)
+            )
+            self.assertEqual(self.full_diff, paged)
+
+    def test_page_past_the_end(self):
+        index = DiffIndex.build(self.correct, self.result)
+
+        self.assertEqual([], list(index.page(self.correct, self.result, index.rows, 50)))
+
+    def test_save_and_load(self):
+        path = os.path.join(self.folder, 'cache', 'diff.index')
+        index = DiffIndex.build(self.correct, self.result)
+
+        self.assertIsNone(DiffIndex.load(path))
+        index.save(path)
+        loaded = DiffIndex.load(path)
+
+        self.assertEqual(index.records, loaded.records)
+        self.assertEqual(index.starts, loaded.starts)
+
+    def test_generate_file_diff_page(self):
+        """
+        Test that the first page starts with the header, and that the index is kept between pages.
+        """
+        path = os.path.join(self.folder, 'diff.index')
+
+        total, first = generate_file_diff_page(self.correct, self.result, 0, 50, index_path=path)
+        first = ''.join(first)
+
+        self.assertEqual(202, total)
+        self.assertTrue(first.startswith(HEADER_TABLE))
+        self.assertEqual(get_html_diff(self.correct_lines, self.result_lines), first)
+        self.assertTrue(os.path.isfile(path))
+
+        with mock.patch.object(pages.DiffIndex, 'build') as mock_build:
+            total, second = generate_file_diff_page(self.correct, self.result, 50, 50, index_path=path)
+            second = ''.join(second)
+
+        mock_build.assert_not_called()
+        self.assertFalse(second.startswith(HEADER_TABLE))
+        self.assertEqual(50, second.count('<table>'))
+
+    def test_line_endings_match_full_diff(self):
+        """
+        Test that lines are split and compared like the full diff reads them, whatever their endings.
+        """
+        correct = self.write('expected.crlf', ['line {idx}\r\n'.format(idx=idx) for idx in range(200)])
+        result = ['line {idx}\n'.format(idx=idx) for idx in range(200)]
+        result[100:102] = ['line 100\rline 101\rchanged\r\n']
+        result = self.write('obtained.crlf', result)
+        full_diff = get_html_diff(list(FileLines(correct)), list(FileLines(result)), to_view=False)
+
+        total, page = generate_file_diff_page(correct, result, 0, 50)
+
+        self.assertEqual(1, total)
+        self.assertEqual(full_diff, ''.join(page))
+        self.assertNotIn('\r', full_diff)
+
+    def test_generate_file_diff_page_captions(self):
+        correct = self.write('expected.srt', ['1\n', '00:00:01,000 --> 00:00:02,000\n', 'Hello\n', '\n',
+                                              '2\n', '00:00:03,000 --> 00:00:04,000\n', 'World\n'])
+        result = self.write('obtained.srt', ['1\n', '00:00:01,500 --> 00:00:02,000\n', 'Hello\n', '\n',
+                                             '2\n', '00:00:03,000 --> 00:00:04,000\n', 'World!\n'])
+
+        total, page = generate_file_diff_page(correct, result, 1, 50, caption_tolerance=100)
+        page = ''.join(page)
+
+        self.assertEqual(2, total)
+        self.assertEqual(1, page.count('<table>'))
+        self.assertIn('World</div>!', page)
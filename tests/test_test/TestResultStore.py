@@ -0,0 +1,103 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import mock
+
+from mod_test.result_gc import collect_garbage
+from mod_test.result_store import (CODECS, FileResultStore, open_blob,
+                                   result_store_from_config)
+
+HASH_A = 'a' * 64
+HASH_B = 'b' * 64
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.results = os.path.join(self.folder, 'TestResults')
+        os.mkdir(self.results)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_codecs(self):
+        """
+        Test that blobs are read back from every available codec, as bytes and as text, and seek both ways.
+        """
+        content = ''.join('line {number}\n'.format(number=number) for number in range(5000)).encode()
+        for codec in CODECS.values():
+            if not codec.available():
+                continue
+            with self.subTest(codec=codec.name):
+                store = FileResultStore(self.results, codec)
+                name = '{codec}.txt'.format(codec=codec.name)
+                store.put(name, io.BytesIO(content))
+
+                self.assertTrue(os.path.exists(store.path(name) + codec.suffix))
+                self.assertTrue(store.exists(name))
+                with store.open(name) as f:
+                    self.assertEqual(content, f.read())
+                with open_blob(store.path(name), 'r', encoding='utf-8') as f:
+                    self.assertEqual('line 0\n', f.readline())
+                with open_blob(store.path(name)) as f:
+                    f.seek(20000)
+                    self.assertEqual(content[20000:20010], f.read(10))
+                    f.seek(7)
+                    self.assertEqual(content[7:20], f.read(13))
+
+    def test_missing_blob(self):
+        """
+        Test that opening a blob that isn't stored fails like opening a missing file.
+        """
+        with self.assertRaises(FileNotFoundError):
+            open_blob(os.path.join(self.results, 'missing.srt'))
+
+    def test_names_size_remove(self):
+        """
+        Test that a blob is listed once per codec, and removed with all of them.
+        """
+        store = FileResultStore(self.results, CODECS['gzip'])
+        store.put(HASH_A + '.srt', io.BytesIO(b'Hello\n'))
+        store.materialize(HASH_A + '.srt')
+        open(os.path.join(self.results, 'upload.tmp'), 'w').close()
+
+        self.assertEqual([HASH_A + '.srt'] * 2, list(store.names()))
+        size = store.size(HASH_A + '.srt')
+        self.assertEqual(size, store.remove(HASH_A + '.srt'))
+        self.assertFalse(store.exists(HASH_A + '.srt'))
+
+    def test_result_store_from_config(self):
+        """
+        Test that the store is made in the sample repository, with the configured codec.
+        """
+        store = result_store_from_config({'SAMPLE_REPOSITORY': self.folder, 'RESULT_COMPRESSION': 'gzip'})
+
+        self.assertEqual(self.results, store.root)
+        self.assertEqual(CODECS['gzip'], store.codec)
+        self.assertEqual(CODECS['none'], result_store_from_config({'SAMPLE_REPOSITORY': self.folder}).codec)
+
+    def test_collect_garbage(self):
+        """
+        Test that only old blobs nothing refers to are removed.
+        """
+        store = FileResultStore(self.results, CODECS['gzip'])
+        for name in [HASH_A + '.srt', HASH_B + '.srt', 'readme.txt']:
+            store.put(name, io.BytesIO(b'Hello\n'))
+            old = time.time() - 2 * 24 * 60 * 60
+            os.utime(store.path(name) + '.gz', (old, old))
+        store.put('c' * 64 + '.srt', io.BytesIO(b'New\n'))
+        db = mock.MagicMock()
+        db.query.return_value.filter.return_value.group_by.side_effect = [[(HASH_A, 2)], [], [(HASH_A, 1)]]
+
+        size = store.size(HASH_B + '.srt')
+        self.assertEqual((1, size), collect_garbage(db, store, dry_run=True))
+        self.assertTrue(store.exists(HASH_B + '.srt'))
+
+        db.query.return_value.filter.return_value.group_by.side_effect = [[(HASH_A, 2)], [], [(HASH_A, 1)]]
+        self.assertEqual((1, size), collect_garbage(db, store))
+        self.assertEqual(sorted([HASH_A + '.srt', 'c' * 64 + '.srt', 'readme.txt']), sorted(store.names()))